@@ -34,5 +34,8 @@ setup(
         'pyemvue>=0.18.9',
         'paho-mqtt>=2.1.0',
         'argparse>= 1.4.0'
-    ]
+    ],
+    extras_require={
+        'numpy': ['numpy>=1.26'],
+    }
 )
@@ -0,0 +1,79 @@
+# Copyright (c) Jason Ertel (jertel).
+# This file is part of the Vuegraf project and is made available under the MIT License.
+
+# Compares the time taken to serialize points with LineProtocolEncoder against building
+# influxdb_client.Point objects or v1 dicts with createDataPoint, as writes did previously.
+#
+# Usage, from the src directory: python benchmarks/lineprotocol_benchmark.py --points 100000
+
+import argparse
+import datetime
+import os
+import sys
+import time
+
+import influxdb.line_protocol
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from vuegraf.collect import Point  # noqa: E402
+from vuegraf.influx import createDataPoint  # noqa: E402
+from vuegraf.lineprotocol import LineProtocolEncoder  # noqa: E402
+
+
+def newPoints(count, channels):
+    """Creates points resembling a minute history import: every channel of a device at each minute."""
+    startTime = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+    points = []
+    for index in range(count):
+        minute, channel = divmod(index, channels)
+        points.append(Point('Home', 'Panel', 'Channel {}'.format(channel), 123.456 + index,
+                            startTime + datetime.timedelta(minutes=minute), 'False'))
+    return points
+
+
+def encodeV1(config, points):
+    return influxdb.line_protocol.make_lines({'points': [createDataPoint(config, pt) for pt in points]})
+
+
+def encodeV2(config, points):
+    return '\n'.join(createDataPoint(config, pt).to_line_protocol() for pt in points).encode('utf-8')
+
+
+def encodeLines(config, points):
+    # A new encoder each time, so its series cache is rebuilt as on a fresh start
+    return '\n'.join(LineProtocolEncoder('detailed', config['addStationField']).encodeLines(points)).encode('utf-8')
+
+
+def bestSecs(fn, config, points, repeat):
+    timings = []
+    for _ in range(repeat):
+        startSecs = time.perf_counter()
+        fn(config, points)
+        timings.append(time.perf_counter() - startSecs)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks serializing points for InfluxDB.')
+    parser.add_argument('--points', type=int, default=100000, help='Number of points to serialize')
+    parser.add_argument('--channels', type=int, default=16, help='Number of channels the points are spread over')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of runs; the fastest is reported')
+    args = parser.parse_args()
+
+    points = newPoints(args.points, args.channels)
+    results = [
+        ('createDataPoint (v1 dict + make_lines)', bestSecs(encodeV1, {'influxDb': {'version': 1}, 'addStationField': False},
+                                                            points, args.repeat)),
+        ('createDataPoint (v2 Point)', bestSecs(encodeV2, {'influxDb': {'version': 2}, 'addStationField': False}, points, args.repeat)),
+        ('LineProtocolEncoder', bestSecs(encodeLines, {'addStationField': False}, points, args.repeat)),
+    ]
+
+    encoderSecs = results[-1][1]
+    print('points={}; channels={}; repeat={}'.format(args.points, args.channels, args.repeat))
+    for name, secs in results:
+        print('{:<40} {:8.3f}s {:12.0f} points/s {:6.1f}x'.format(name, secs, args.points / secs, secs / encoderSecs))
+
+
+if __name__ == '__main__':
+    main()
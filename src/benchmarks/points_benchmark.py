@@ -0,0 +1,80 @@
+# Copyright (c) Jason Ertel (jertel).
+# This file is part of the Vuegraf project and is made available under the MIT License.
+
+# Compares the memory taken by an hour of second data held in a points.PointBatch against a list of Point objects,
+# as collect held it previously, along with the time taken to fill and encode each of them.
+#
+# Usage, from the src directory: python benchmarks/points_benchmark.py --seconds 3600 --channels 16
+
+import argparse
+import datetime
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from vuegraf.lineprotocol import LineProtocolEncoder  # noqa: E402
+from vuegraf.points import Point, PointBatch, fromNanoseconds, toNanoseconds  # noqa: E402
+from vuegraf.usage import NANOSECONDS_PER_SEC  # noqa: E402
+
+
+def newSeries(startTime, seconds, channels):
+    """Creates the timestamps and watts of each channel, as returned by usage.convertUsage."""
+    startNanoseconds = toNanoseconds(startTime)
+    nanoseconds = [startNanoseconds + index * NANOSECONDS_PER_SEC for index in range(seconds)]
+    return [('Channel {}'.format(channel), nanoseconds, [float(index % 500) for index in range(seconds)]) for channel in range(channels)]
+
+
+def newPointList(series):
+    points = []
+    for chanName, nanoseconds, watts in series:
+        points.extend(Point('Home', 'Panel', chanName, value, fromNanoseconds(timestamp), 'True')
+                      for timestamp, value in zip(nanoseconds, watts))
+    return points
+
+
+def newPointBatch(series):
+    batch = PointBatch()
+    for chanName, nanoseconds, watts in series:
+        batch.addSeries('Home', 'Panel', chanName, 'True', nanoseconds, watts)
+    return batch
+
+
+def measure(fn, series):
+    """Returns the bytes allocated by the points fn creates, the seconds taken to create them, and to encode them."""
+    tracemalloc.start()
+    startSecs = time.perf_counter()
+    points = fn(series)
+    createSecs = time.perf_counter() - startSecs
+    allocatedBytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    startSecs = time.perf_counter()
+    LineProtocolEncoder('detailed', False).encodePoints(points)
+    return allocatedBytes, createSecs, time.perf_counter() - startSecs
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks holding collected points in a PointBatch.')
+    parser.add_argument('--seconds', type=int, default=3600, help='Number of values per channel')
+    parser.add_argument('--channels', type=int, default=16, help='Number of channels')
+    args = parser.parse_args()
+
+    startTime = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+    series = newSeries(startTime, args.seconds, args.channels)
+    if LineProtocolEncoder('detailed', False).encodePoints(newPointList(series)) != \
+            LineProtocolEncoder('detailed', False).encodePoints(newPointBatch(series)):
+        raise SystemExit('A PointBatch does not encode the same lines as a list of points')
+
+    values = args.seconds * args.channels
+    print('values={}; channels={}'.format(values, args.channels))
+    for name, fn in [('list of Point', newPointList), ('PointBatch', newPointBatch)]:
+        allocatedBytes, createSecs, encodeSecs = measure(fn, series)
+        print('{:<16} {:10.1f} MiB {:8.1f} bytes/value {:8.3f}s create {:8.3f}s encode'.format(
+            name, allocatedBytes / 1024 / 1024, allocatedBytes / values, createSecs, encodeSecs))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+# Copyright (c) Jason Ertel (jertel).
+# This file is part of the Vuegraf project and is made available under the MIT License.
+
+# Compares the time taken to turn chart usage lists into line protocol the way collection does, with
+# usage.convertUsage, PointBatch.addSeries and LineProtocolEncoder.encodeBatch, against creating a Point per
+# value, as extractDataPoints did previously. Run it with and without NumPy installed to compare both paths
+# of convertUsage.
+#
+# Usage, from the src directory: python benchmarks/usage_benchmark.py --seconds 3600 --channels 16
+
+import argparse
+import datetime
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from vuegraf import usage  # noqa: E402
+from vuegraf.lineprotocol import LineProtocolEncoder  # noqa: E402
+from vuegraf.points import Point, PointBatch  # noqa: E402
+
+WATTS_PER_KWH_SECOND = 3600000.0
+
+
+def newUsages(seconds, channels):
+    """Creates an hour of second chart usage per channel, resembling a detail run, with a few seconds without data."""
+    random.seed(1)
+    return [[None if random.random() < 0.01 else random.random() / 1000 for _ in range(seconds)] for _ in range(channels)]
+
+
+def encodePoints(startTime, usages):
+    encoder = LineProtocolEncoder('detailed', False)
+    lines = []
+    for channel, channelUsage in enumerate(usages):
+        points = []
+        index = 0
+        for kwhUsage in channelUsage:
+            if kwhUsage is None:
+                index += 1
+                continue
+            timestamp = startTime + datetime.timedelta(seconds=index)
+            points.append(Point('Home', 'Panel', 'Channel {}'.format(channel), WATTS_PER_KWH_SECOND * kwhUsage, timestamp, 'True'))
+            index += 1
+        lines.extend(encoder.encodeLines(points))
+    return lines
+
+
+def encodeBatch(startTime, usages):
+    batch = PointBatch()
+    for channel, channelUsage in enumerate(usages):
+        nanoseconds, watts = usage.convertUsage(channelUsage, startTime, 1, WATTS_PER_KWH_SECOND)
+        batch.addSeries('Home', 'Panel', 'Channel {}'.format(channel), 'True', nanoseconds, watts)
+    return LineProtocolEncoder('detailed', False).encodeBatch(batch)
+
+
+def bestSecs(fn, startTime, usages, repeat):
+    timings = []
+    for _ in range(repeat):
+        startSecs = time.perf_counter()
+        fn(startTime, usages)
+        timings.append(time.perf_counter() - startSecs)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks converting chart usage into line protocol.')
+    parser.add_argument('--seconds', type=int, default=3600, help='Number of values per channel')
+    parser.add_argument('--channels', type=int, default=16, help='Number of channels')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of runs; the fastest is reported')
+    args = parser.parse_args()
+
+    startTime = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+    usages = newUsages(args.seconds, args.channels)
+    if encodePoints(startTime, usages) != encodeBatch(startTime, usages):
+        raise SystemExit('convertUsage, addSeries and encodeBatch do not produce the same lines as encoding points')
+
+    results = [
+        ('Point per value + encodeLines', bestSecs(encodePoints, startTime, usages, args.repeat)),
+        ('convertUsage + addSeries + encodeBatch', bestSecs(encodeBatch, startTime, usages, args.repeat)),
+    ]
+
+    batchSecs = results[-1][1]
+    values = args.seconds * args.channels
+    print('values={}; channels={}; repeat={}; numpy={}'.format(values, args.channels, args.repeat, usage.numpy is not None))
+    for name, secs in results:
+        print('{:<40} {:8.3f}s {:12.0f} values/s {:6.1f}x'.format(name, secs, values / secs, secs / batchSecs))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,33 @@
+# Copyright (c) Jason Ertel (jertel).
+# This file is part of the Vuegraf project and is made available under the MIT License.
+
+import json
+import os
+from unittest.mock import patch
+import pytest
+
+# Local imports
+from vuegraf.atomicfile import writeJsonAtomically
+
+
+def test_write_json_atomically(tmp_path):
+    path = tmp_path / 'data.json'
+    path.write_text('previous')
+
+    writeJsonAtomically(str(path), {'version': 1}, '.data-')
+
+    assert json.loads(path.read_text()) == {'version': 1}
+    # No temporary files are left behind next to the file
+    assert os.listdir(tmp_path) == ['data.json']
+
+
+@patch('vuegraf.atomicfile.json.dump', side_effect=TypeError('not serializable'))
+def test_write_json_atomically_failure_keeps_previous_file(_mock_dump, tmp_path):
+    path = tmp_path / 'data.json'
+    path.write_text('previous')
+
+    with pytest.raises(TypeError):
+        writeJsonAtomically(str(path), {'version': 1}, '.data-')
+
+    assert path.read_text() == 'previous'
+    assert os.listdir(tmp_path) == ['data.json']
@@ -0,0 +1,201 @@
+# Copyright (c) Jason Ertel (jertel).
+# This file is part of the Vuegraf project and is made available under the MIT License.
+
+import datetime
+import json
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from pyemvue.enums import Scale
+
+from vuegraf.checkpoint import CHECKPOINT_FILE_VERSION, loadHistoryCheckpoint
+
+
+START = datetime.datetime(2024, 1, 1, 0, 0, 0, tzinfo=datetime.timezone.utc)
+STOP = datetime.datetime(2024, 1, 31, 0, 0, 0, tzinfo=datetime.timezone.utc)
+WINDOW_STOP = datetime.datetime(2024, 1, 20, 23, 59, 59, tzinfo=datetime.timezone.utc)
+FIRST_WINDOW = (Scale.HOUR.value, START, WINDOW_STOP)
+SECOND_WINDOW = (Scale.HOUR.value, WINDOW_STOP + datetime.timedelta(seconds=1), STOP)
+
+
+SAMPLE_CONFIG = {
+    'influxDb': {},
+    'timezone': 'UTC',
+    'historyCheckpointFile': None,
+    'historySkipExisting': False,
+    'args': MagicMock(resetdatabase=False),
+}
+
+
+def newChannel(gid, channelNum, nestedDevices=None):
+    return MagicMock(device_gid=gid, channel_num=channelNum, nested_devices=nestedDevices)
+
+
+@patch('vuegraf.checkpoint.logger')
+def test_progress_without_checkpoint_file(mock_logger):
+    flush = MagicMock()
+    checkpoint = loadHistoryCheckpoint(dict(SAMPLE_CONFIG), flush)
+
+    assert checkpoint.begin(30, START, STOP, 2) == START
+    # 30 days are imported in two hour windows and a day window, for each of the two accounts
+    assert checkpoint.windowsTotal == 6
+    checkpoint.complete('Account', [1], FIRST_WINDOW, 10)
+    checkpoint.complete('Account', [], SECOND_WINDOW, 0)
+
+    flush.assert_not_called()
+    assert not checkpoint.isDone('Account', 1, FIRST_WINDOW)
+    assert 'History import progress; windows=2/6; etaSecs=' in mock_logger.info.call_args[0][0]
+    assert checkpoint.pointsThisRun == 10
+
+
+def test_records_and_resumes_import(tmp_path):
+    checkpointFile = tmp_path / 'history.checkpoint'
+    flush = MagicMock(return_value=True)
+    checkpoint = loadHistoryCheckpoint(dict(SAMPLE_CONFIG, historyCheckpointFile=str(checkpointFile)), flush)
+    assert checkpoint.begin(30, START, STOP, 1) == START
+
+    checkpoint.complete('Account', [1, 2], FIRST_WINDOW, 10)
+    # A window whose devices were all skipped does not wait for the writer
+    checkpoint.complete('Account', [], SECOND_WINDOW, 0)
+    flush.assert_called_once()
+    assert checkpoint.windowsDone == 2
+    assert checkpoint.windowsDoneThisRun == 1
+
+    # A restart a day later resumes the recorded import, so its windows line up with the completed ones
+    checkpoint = loadHistoryCheckpoint(dict(SAMPLE_CONFIG, historyCheckpointFile=str(checkpointFile)), flush)
+    assert checkpoint.begin(30, START + datetime.timedelta(days=1), STOP + datetime.timedelta(days=1), 1) == START
+    assert checkpoint.isDone('Account', 1, FIRST_WINDOW)
+    assert checkpoint.isDone('Account', 2, FIRST_WINDOW)
+    assert not checkpoint.isDone('Account', 1, SECOND_WINDOW)
+
+    # Skipped windows count towards progress, but not towards the rate the ETA is based on
+    with patch('vuegraf.checkpoint.logger') as mock_logger:
+        checkpoint.complete('Account', [], FIRST_WINDOW, 0)
+    mock_logger.info.assert_called_once_with('History import progress; windows=1/3; etaSecs=0; pointsPerSec=0.0')
+
+
+def test_different_import_starts_over(tmp_path):
+    checkpointFile = tmp_path / 'history.checkpoint'
+    checkpoint = loadHistoryCheckpoint(dict(SAMPLE_CONFIG, historyCheckpointFile=str(checkpointFile)), MagicMock(return_value=True))
+    checkpoint.begin(30, START, STOP, 1)
+    checkpoint.complete('Account', [1], FIRST_WINDOW, 10)
+
+    checkpoint = loadHistoryCheckpoint(dict(SAMPLE_CONFIG, historyCheckpointFile=str(checkpointFile)), MagicMock(return_value=True))
+    newStart = START + datetime.timedelta(days=1)
+    assert checkpoint.begin(29, newStart, STOP, 1) == newStart
+
+    assert not checkpoint.isDone('Account', 1, FIRST_WINDOW)
+    assert json.loads(checkpointFile.read_text()) == {'version': CHECKPOINT_FILE_VERSION, 'historyDays': 29,
+                                                      'startTimeUTC': newStart.isoformat()}
+
+
+@patch('vuegraf.checkpoint.logger')
+def test_failed_write_is_not_recorded(mock_logger, tmp_path):
+    checkpointFile = tmp_path / 'history.checkpoint'
+    checkpoint = loadHistoryCheckpoint(dict(SAMPLE_CONFIG, historyCheckpointFile=str(checkpointFile)), MagicMock(return_value=False))
+    checkpoint.begin(30, START, STOP, 1)
+
+    checkpoint.complete('Account', [1], FIRST_WINDOW, 10)
+
+    assert not checkpoint.isDone('Account', 1, FIRST_WINDOW)
+    assert checkpoint.windowsDone == 0
+    assert 'Not recording history window as complete' in mock_logger.warning.call_args[0][0]
+
+
+def test_incomplete_unit_is_redone(tmp_path):
+    checkpointFile = tmp_path / 'history.checkpoint'
+    checkpoint = loadHistoryCheckpoint(dict(SAMPLE_CONFIG, historyCheckpointFile=str(checkpointFile)), MagicMock(return_value=True))
+    checkpoint.begin(30, START, STOP, 1)
+    checkpoint.complete('Account', [1], FIRST_WINDOW, 10)
+    with open(checkpointFile, 'a') as f:
+        f.write('["Account", 2')
+
+    checkpoint = loadHistoryCheckpoint(dict(SAMPLE_CONFIG, historyCheckpointFile=str(checkpointFile)), MagicMock())
+
+    assert checkpoint.doneUnits == {('Account', 1, Scale.HOUR.value, START.isoformat(), WINDOW_STOP.isoformat())}
+
+
+@pytest.mark.parametrize('content', ['not json\n', json.dumps({'version': 99}) + '\n'])
+@patch('vuegraf.checkpoint.logger')
+def test_unreadable_file_is_ignored(mock_logger, content, tmp_path):
+    checkpointFile = tmp_path / 'history.checkpoint'
+    checkpointFile.write_text(content)
+
+    checkpoint = loadHistoryCheckpoint(dict(SAMPLE_CONFIG, historyCheckpointFile=str(checkpointFile)), MagicMock())
+
+    assert checkpoint.header is None
+    assert 'Ignoring unreadable history checkpoint file' in mock_logger.warning.call_args[0][0]
+    assert checkpoint.begin(30, START, STOP, 1) == START
+
+
+@patch('vuegraf.checkpoint.logger')
+def test_ignored_when_resetting_database(mock_logger, tmp_path):
+    checkpointFile = tmp_path / 'history.checkpoint'
+    checkpoint = loadHistoryCheckpoint(dict(SAMPLE_CONFIG, historyCheckpointFile=str(checkpointFile)), MagicMock(return_value=True))
+    checkpoint.begin(30, START, STOP, 1)
+    checkpoint.complete('Account', [1], FIRST_WINDOW, 10)
+
+    config = dict(SAMPLE_CONFIG, historyCheckpointFile=str(checkpointFile), args=MagicMock(resetdatabase=True))
+    checkpoint = loadHistoryCheckpoint(config, MagicMock())
+
+    assert checkpoint.doneUnits == set()
+    assert 'Ignoring history checkpoint file since the database is being reset' in mock_logger.info.call_args[0][0]
+
+
+# Daylight saving time starts on 2024-03-10 in New York, so that day has 23 hours
+DST_START = datetime.datetime(2024, 3, 9, 5, 0, 0, tzinfo=datetime.timezone.utc)
+DST_STOP = datetime.datetime(2024, 3, 11, 3, 59, 59, tzinfo=datetime.timezone.utc)
+DST_HOUR_WINDOW = (Scale.HOUR.value, DST_START, DST_STOP)
+DST_DAY_WINDOW = (Scale.DAY.value, DST_START, DST_STOP)
+
+
+@pytest.mark.parametrize('addStationField', [False, True])
+@patch('vuegraf.checkpoint.getHistoryCoverage')
+def test_skips_history_already_in_database(mock_get_history_coverage, addStationField):
+    config = dict(SAMPLE_CONFIG, timezone='America/New_York', historySkipExisting=True, addStationField=addStationField)
+    account = {'name': 'Account', 'deviceIdMap': {1: MagicMock(device_name='Device'), 2: MagicMock(device_name='Nested')}}
+    nestedDevice = MagicMock(channels={'1,2,3': newChannel(2, '1,2,3')})
+    # Like a Vue main panel, the device has Balance and TotalUsage channels, which never get history points
+    device = MagicMock(channels={'1': newChannel(1, '1', {2: nestedDevice}), 'Balance': newChannel(1, 'Balance'),
+                                 'TotalUsage': newChannel(1, 'TotalUsage')})
+    days = {datetime.date(2024, 3, 9): 24, datetime.date(2024, 3, 10): 23}
+    deviceStation, nestedStation = ('Device', 'Nested') if addStationField else (None, None)
+    mock_get_history_coverage.return_value = {
+        (deviceStation, 'Device-1', 'Hour'): days,
+        (nestedStation, 'Nested', 'Hour'): days,
+        # The nested device has no day points
+        (deviceStation, 'Device-1', 'Day'): {day: 1 for day in days},
+    }
+    checkpoint = loadHistoryCheckpoint(config, MagicMock())
+    checkpoint.begin(2, DST_START, DST_STOP, 1)
+
+    mock_get_history_coverage.assert_called_once_with(config, DST_START, DST_STOP)
+    assert checkpoint.isCovered(account, device, DST_HOUR_WINDOW)
+    assert not checkpoint.isCovered(account, device, DST_DAY_WINDOW)
+    assert not checkpoint.isCovered(account, nestedDevice, DST_DAY_WINDOW)
+    # The most recent window ends during its last day, so is always fetched again
+    assert not checkpoint.isCovered(account, device, (Scale.HOUR.value, DST_START, DST_STOP - datetime.timedelta(hours=1)))
+
+    days[datetime.date(2024, 3, 10)] = 22
+    assert not checkpoint.isCovered(account, device, DST_HOUR_WINDOW)
+
+
+@patch('vuegraf.checkpoint.getHistoryCoverage')
+def test_existing_history_not_skipped_by_default(mock_get_history_coverage):
+    checkpoint = loadHistoryCheckpoint(dict(SAMPLE_CONFIG), MagicMock())
+    checkpoint.begin(2, DST_START, DST_STOP, 1)
+
+    mock_get_history_coverage.assert_not_called()
+    assert not checkpoint.isCovered({'name': 'Account'}, MagicMock(), DST_HOUR_WINDOW)
+
+
+@patch('vuegraf.checkpoint.logger')
+@patch('vuegraf.checkpoint.getHistoryCoverage')
+def test_unreadable_coverage_skips_nothing(mock_get_history_coverage, mock_logger):
+    mock_get_history_coverage.side_effect = ConnectionError('influx down')
+    checkpoint = loadHistoryCheckpoint(dict(SAMPLE_CONFIG, historySkipExisting=True), MagicMock())
+    checkpoint.begin(2, DST_START, DST_STOP, 1)
+
+    assert checkpoint.coverage is None
+    assert 'Not skipping history already in the database' in mock_logger.warning.call_args[0][0]
@@ -1,8 +1,10 @@
 # Copyright (c) Jason Ertel (jertel).
 # This file is part of the Vuegraf project and is made available under the MIT License.
 
+import copy
 import datetime
 import logging
+import threading
 import time
 from unittest import TestCase
 from unittest.mock import MagicMock, patch
@@ -10,8 +12,10 @@ from unittest.mock import MagicMock, patch
 from pyemvue.device import VueDeviceChannel, VueDevice
 from pyemvue.enums import Scale, Unit
 
-from vuegraf import collect
+from vuegraf import collect, influx
 from vuegraf.collect import Point
+from vuegraf.config import Settings
+from vuegraf.device import ChannelInfo
 
 
 # Basic config structure for tests
@@ -76,7 +80,7 @@ logging.disable(logging.CRITICAL)  # Disable logging during tests
 class TestCollect(TestCase):
 
     def setUp(self):
-        self.mock_config = MOCK_CONFIG.copy()
+        self.mock_config = copy.deepcopy(MOCK_CONFIG)
         self.mock_account = MOCK_ACCOUNT_INFO.copy()
         self.mock_account['vue'] = MagicMock()  # Reset mock for each test
         self.usage_data_points = []
@@ -84,31 +88,39 @@ class TestCollect(TestCase):
         self.detailed_start_time_utc = self.stop_time_utc - datetime.timedelta(hours=1)
 
         # Mock dependencies
-        self.patcher_getConfigValue = patch('vuegraf.collect.getConfigValue', side_effect=self._mock_getConfigValue)
-        self.patcher_getInfluxTag = patch('vuegraf.collect.getInfluxTag', return_value=(None, 'Seconds', 'Minutes', 'Hours', 'Days'))
+        self.patcher_getSettings = patch('vuegraf.collect.getSettings', side_effect=self._mock_getSettings)
         self.patcher_lookupDeviceName = patch('vuegraf.collect.lookupDeviceName', return_value='TestDevice1')
-        self.patcher_lookupChannelName = patch('vuegraf.collect.lookupChannelName', side_effect=self._mock_lookupChannelName)
+        # Tests set the channel names through mock_lookupChannelName
+        self.mock_lookupChannelName = MagicMock(side_effect=self._mock_lookupChannelName)
+        self.patcher_lookupChannel = patch('vuegraf.collect.lookupChannel', side_effect=lambda account, chan: ChannelInfo(
+            'TestDevice1', self.mock_lookupChannelName(account, chan)))
         self.patcher_getLastDBTimeStamp = patch('vuegraf.collect.getLastDBTimeStamp')
-        self.patcher_calculateHistoryTimeRange = patch('vuegraf.collect.calculateHistoryTimeRange')
+        self.patcher_getCachedLastDBTimeStamps = patch('vuegraf.collect.getCachedLastDBTimeStamps', return_value={})
+        self.patcher_planHistoryWindows = patch('vuegraf.collect.planHistoryWindows')
         self.patcher_convertToLocalDayInUTC = patch('vuegraf.collect.convertToLocalDayInUTC',
                                                     side_effect=lambda cfg, dt: dt.replace(hour=0, minute=0, second=0, microsecond=0))
+        # The Emporia API has backed off once, so history windows are paused by the base pause
+        self.patcher_getApiLimiter = patch('vuegraf.collect.getApiLimiter')
 
-        self.mock_getConfigValue = self.patcher_getConfigValue.start()
-        self.mock_getInfluxTag = self.patcher_getInfluxTag.start()
+        self.mock_getSettings = self.patcher_getSettings.start()
         self.mock_lookupDeviceName = self.patcher_lookupDeviceName.start()
-        self.mock_lookupChannelName = self.patcher_lookupChannelName.start()
+        self.patcher_lookupChannel.start()
         self.mock_getLastDBTimeStamp = self.patcher_getLastDBTimeStamp.start()
-        self.mock_calculateHistoryTimeRange = self.patcher_calculateHistoryTimeRange.start()
+        self.mock_getCachedLastDBTimeStamps = self.patcher_getCachedLastDBTimeStamps.start()
+        self.mock_planHistoryWindows = self.patcher_planHistoryWindows.start()
         self.mock_convertToLocalDayInUTC = self.patcher_convertToLocalDayInUTC.start()
+        self.mock_getApiLimiter = self.patcher_getApiLimiter.start()
+        self.mock_getApiLimiter.return_value.getPauseSecs.return_value = collect.HISTORY_PAUSE_SECS
 
     def tearDown(self):
-        self.patcher_getConfigValue.stop()
-        self.patcher_getInfluxTag.stop()
+        self.patcher_getSettings.stop()
         self.patcher_lookupDeviceName.stop()
-        self.patcher_lookupChannelName.stop()
+        self.patcher_lookupChannel.stop()
         self.patcher_getLastDBTimeStamp.stop()
-        self.patcher_calculateHistoryTimeRange.stop()
+        self.patcher_getCachedLastDBTimeStamps.stop()
+        self.patcher_planHistoryWindows.stop()
         self.patcher_convertToLocalDayInUTC.stop()
+        self.patcher_getApiLimiter.stop()
 
     def _mock_getConfigValue(self, config, key, default=None):
         # Simplified mock for getConfigValue
@@ -126,8 +138,36 @@ class TestCollect(TestCase):
             return config.get('data', {}).get('detailedDataSecondsHistoryHours', 1)
         if key == 'timezone':
             return config.get('data', {}).get('timezone', 'UTC')
+        if key == 'maxConcurrentChannels':
+            return config.get('data', {}).get('maxConcurrentChannels', 1)
+        if key == 'historyConcurrentWindows':
+            return config.get('data', {}).get('historyConcurrentWindows', 1)
+        if key == 'backfillConcurrentChunks':
+            return config.get('data', {}).get('backfillConcurrentChunks', 1)
         return default  # Should not happen in these tests if config is set up
 
+    def _mock_getSettings(self, config):
+        # Settings are compiled from the simplified config values on every call, so tests may change them at any time
+        return Settings(
+            influxVersion=1,
+            tagName=None,
+            tagValue_second='Seconds',
+            tagValue_minute='Minutes',
+            tagValue_hour='Hours',
+            tagValue_day='Days',
+            addStationField=False,
+            timezone=None,
+            detailedDataEnabled=self._mock_getConfigValue(config, 'detailedDataEnabled'),
+            detailedDataSecondsEnabled=self._mock_getConfigValue(config, 'detailedDataSecondsEnabled'),
+            detailedIntervalSecs=config.get('data', {}).get('detailedIntervalSecs', 3600),
+            updateIntervalSecs=60,
+            lagSecs=5,
+            maxConcurrentChannels=self._mock_getConfigValue(config, 'maxConcurrentChannels'),
+            historyConcurrentWindows=self._mock_getConfigValue(config, 'historyConcurrentWindows'),
+            backfillConcurrentChunks=self._mock_getConfigValue(config, 'backfillConcurrentChunks'),
+            backfillNewestFirst=config.get('data', {}).get('backfillOrder', 'oldest') == 'newest',
+        )
+
     def _mock_lookupChannelName(self, account, channel):
         # Simplified mock based on channel number
         if channel.channel_num == '1,2,3':
@@ -229,7 +269,7 @@ class TestCollect(TestCase):
         self.mock_account['vue'].get_chart_usage.assert_called_once_with(
             mock_device.channels['1,2,3'],
             minute_history_start,
-            stop_time_min,
+            self.stop_time_utc,
             scale=Scale.MINUTE.value,
             unit=Unit.KWH.value
         )
@@ -257,106 +297,63 @@ class TestCollect(TestCase):
             'TestAccount', 'TestDevice1', 'TestChannel1', expected_watts_3, expected_ts_3, 'Minutes'
         ))
 
-    def test_extractDataPoints_minute_history_no_data_retry(self):
-        # Test minute history collection when the first attempt returns no data
+    def test_extractDataPoints_minute_history_full_gap(self):
+        # Test a minute gap longer than one request is filled in a single cycle, by concurrent 12 hour chunks
         self.mock_config['data']['detailedDataMinutesHistoryEnabled'] = True
-        minute_history_start_initial = self.stop_time_utc.replace(second=0, microsecond=0) - datetime.timedelta(hours=12)
-        stop_time_min_initial = self.stop_time_utc.replace(second=0, microsecond=0) - datetime.timedelta(hours=6)
-        self.mock_getLastDBTimeStamp.return_value = (minute_history_start_initial, stop_time_min_initial, True)
-
-        mock_device = self._create_mock_device(12345, [('1,2,3', 0.01, None)])
-
-        # Mock return values for get_chart_usage
-        # First call: all None
-        mock_minute_usage_none = [None] * 10
-        mock_usage_start_time_initial = minute_history_start_initial
-        # Second call: some data
-        mock_minute_usage_data = [8, 9]
-        minute_history_start_next = stop_time_min_initial  # Next interval starts where the last one ended
-        stop_time_min_next = stop_time_min_initial + (stop_time_min_initial - minute_history_start_initial)
-        stop_time_min_next = min(
-            stop_time_min_next,
-            self.stop_time_utc.replace(second=0, microsecond=0)
-        )  # Ensure it doesn't exceed stopTimeUTC
-        mock_usage_start_time_next = minute_history_start_next
-
-        self.mock_account['vue'].get_chart_usage.side_effect = [
-            (mock_minute_usage_none, mock_usage_start_time_initial),
-            (mock_minute_usage_data, mock_usage_start_time_next)
+        self.mock_config['data']['backfillConcurrentChunks'] = 3
+        minute_history_start = self.stop_time_utc.replace(second=0, microsecond=0) - datetime.timedelta(hours=30)
+        self.mock_getLastDBTimeStamp.return_value = (minute_history_start, minute_history_start + datetime.timedelta(hours=12), True)
+        chunks = [
+            (minute_history_start, minute_history_start + datetime.timedelta(hours=12)),
+            (minute_history_start + datetime.timedelta(hours=12), minute_history_start + datetime.timedelta(hours=24)),
+            (minute_history_start + datetime.timedelta(hours=24), self.stop_time_utc),
         ]
+        # The first chunk has no data, and the last chunk finishes first
+        chunk_usage = {chunks[0][0]: [None] * 10, chunks[1][0]: [8, None, 9], chunks[2][0]: [7]}
+        last_chunk_done = threading.Event()
+
+        def get_chart_usage(chan, start, stop, scale, unit):
+            if start == chunks[2][0]:
+                last_chunk_done.set()
+            else:
+                last_chunk_done.wait(5)
+            return chunk_usage[start], start
+        self.mock_account['vue'].get_chart_usage.side_effect = get_chart_usage
 
+        mock_device = self._create_mock_device(12345, [('1,2,3', 0.01, None)])
         collect.extractDataPoints(self.mock_config, self.mock_account, mock_device, self.stop_time_utc,
                                   False, self.usage_data_points, self.detailed_start_time_utc)
 
-        self.assertEqual(self.mock_account['vue'].get_chart_usage.call_count, 2)
-        # Check first call args
-        self.mock_account['vue'].get_chart_usage.assert_any_call(
-            mock_device.channels['1,2,3'],
-            minute_history_start_initial,
-            stop_time_min_initial,
-            scale=Scale.MINUTE.value,
-            unit=Unit.KWH.value
-        )
-        # Check second call args
-        self.mock_account['vue'].get_chart_usage.assert_any_call(
-            mock_device.channels['1,2,3'],
-            minute_history_start_next,
-            stop_time_min_next,
-            scale=Scale.MINUTE.value,
-            unit=Unit.KWH.value
-        )
-
-        self.assertEqual(len(self.usage_data_points), 2)  # Points from the second call
-        expected_watts_0 = 8 * 60 * 1000
-        expected_ts_0 = mock_usage_start_time_next + datetime.timedelta(minutes=0)
-        self.assertEqual(self.usage_data_points[0], Point(
-            'TestAccount', 'TestDevice1', 'TestChannel1', expected_watts_0, expected_ts_0, 'Minutes'
-        ))
-
-        expected_watts_1 = 9 * 60 * 1000
-        expected_ts_1 = mock_usage_start_time_next + datetime.timedelta(minutes=1)
-        self.assertEqual(self.usage_data_points[1], Point(
-            'TestAccount', 'TestDevice1', 'TestChannel1', expected_watts_1, expected_ts_1, 'Minutes'
-        ))
+        self.assertEqual(self.mock_account['vue'].get_chart_usage.call_count, 3)
+        for start, stop in chunks:
+            self.mock_account['vue'].get_chart_usage.assert_any_call(
+                mock_device.channels['1,2,3'], start, stop, scale=Scale.MINUTE.value, unit=Unit.KWH.value)
+        # Points are in time order, regardless of the order the chunks finished in
+        self.assertEqual(self.usage_data_points, [
+            Point('TestAccount', 'TestDevice1', 'TestChannel1', 8 * 60 * 1000, chunks[1][0], 'Minutes'),
+            Point('TestAccount', 'TestDevice1', 'TestChannel1', 9 * 60 * 1000, chunks[1][0] + datetime.timedelta(minutes=2), 'Minutes'),
+            Point('TestAccount', 'TestDevice1', 'TestChannel1', 7 * 60 * 1000, chunks[2][0], 'Minutes'),
+        ])
+        self.assertEqual(self.mock_config.get('_minuteBackfillSkipCache', {}), {})
 
     def test_extractDataPoints_minute_history_no_data_offline(self):
-        # Test minute history collection when the device seems offline (keeps returning no data)
+        # Test minute history collection when the device seems offline (returns no data for any chunk)
         self.mock_config['data']['detailedDataMinutesHistoryEnabled'] = True
-        minute_history_start_initial = self.stop_time_utc.replace(second=0, microsecond=0) - datetime.timedelta(hours=12)
-        stop_time_min_initial = self.stop_time_utc.replace(second=0, microsecond=0) - datetime.timedelta(hours=6)
-        self.mock_getLastDBTimeStamp.return_value = (minute_history_start_initial, stop_time_min_initial, True)
+        minute_history_start = self.stop_time_utc.replace(second=0, microsecond=0) - datetime.timedelta(hours=20)
+        self.mock_getLastDBTimeStamp.return_value = (minute_history_start, minute_history_start + datetime.timedelta(hours=12), True)
 
         mock_device = self._create_mock_device(12345, [('1', 0.01, None)])
-
-        # Mock return values for get_chart_usage - always None
-        mock_minute_usage_none = [None] * 10
-        mock_usage_start_time_initial = minute_history_start_initial
-        minute_history_start_next = stop_time_min_initial
-        stop_time_min_next = stop_time_min_initial + (stop_time_min_initial - minute_history_start_initial)
-        mock_usage_start_time_next = minute_history_start_next
-
-        # Simulate reaching the global stop time
-        minute_history_start_final = stop_time_min_next
-        stop_time_min_final = self.stop_time_utc.replace(second=0, microsecond=0)
-        mock_usage_start_time_final = minute_history_start_final
-
-        self.mock_account['vue'].get_chart_usage.side_effect = [
-            (mock_minute_usage_none, mock_usage_start_time_initial),
-            (mock_minute_usage_none, mock_usage_start_time_next),
-            (mock_minute_usage_none, mock_usage_start_time_final),
-        ]
+        self.mock_account['vue'].get_chart_usage.side_effect = lambda chan, start, stop, scale, unit: ([None] * 10, start)
 
         collect.extractDataPoints(self.mock_config, self.mock_account, mock_device, self.stop_time_utc,
                                   False, self.usage_data_points, self.detailed_start_time_utc)
 
-        # It should try multiple times until stopTimeMin reaches stopTimeUTC
-        self.assertGreaterEqual(self.mock_account['vue'].get_chart_usage.call_count, 2)  # At least the initial and one retry
-        # Check the last call went up to the global stop time
-
+        # Every chunk up to the global stop time is fetched
+        self.assertEqual(self.mock_account['vue'].get_chart_usage.call_count, 2)
         self.mock_account['vue'].get_chart_usage.assert_any_call(
             mock_device.channels['1'],
-            stop_time_min_initial,
-            stop_time_min_final,
+            minute_history_start + datetime.timedelta(hours=12),
+            self.stop_time_utc,
             scale=Scale.MINUTE.value,
             unit=Unit.KWH.value
         )
@@ -370,8 +367,8 @@ class TestCollect(TestCase):
         # that channel, and the simple current-sample branch writes one minute
         # point per cycle.
         self.mock_config['data']['detailedDataMinutesHistoryEnabled'] = True
-        minute_history_start = self.stop_time_utc.replace(second=0, microsecond=0) - datetime.timedelta(hours=12)
-        stop_time_min = self.stop_time_utc.replace(second=0, microsecond=0) - datetime.timedelta(hours=6)
+        minute_history_start = self.stop_time_utc.replace(second=0, microsecond=0) - datetime.timedelta(hours=30)
+        stop_time_min = minute_history_start + datetime.timedelta(hours=12)
         self.mock_getLastDBTimeStamp.return_value = (minute_history_start, stop_time_min, True)
 
         mock_device = self._create_mock_device(12345, [('1,2,3', 0.01, None)])
@@ -417,9 +414,8 @@ class TestCollect(TestCase):
         # Pre-seed the cache with an entry that expired one second ago.
         self.mock_config['_minuteBackfillSkipCache'] = {('TestDevice1', 'TestChannel1'): time.time() - 1}
 
-        minute_history_start = self.stop_time_utc.replace(second=0, microsecond=0) - datetime.timedelta(hours=12)
-        stop_time_min = self.stop_time_utc.replace(second=0, microsecond=0) - datetime.timedelta(hours=6)
-        self.mock_getLastDBTimeStamp.return_value = (minute_history_start, stop_time_min, True)
+        minute_history_start = self.stop_time_utc.replace(second=0, microsecond=0) - datetime.timedelta(hours=10)
+        self.mock_getLastDBTimeStamp.return_value = (minute_history_start, self.stop_time_utc, True)
 
         mock_device = self._create_mock_device(12345, [('1,2,3', 0.01, None)])
         # Simulate the API now returning real data -- recovery scenario.
@@ -465,7 +461,7 @@ class TestCollect(TestCase):
         # getLastDBTimeStamp should still be called to check minute history status
         self.mock_getLastDBTimeStamp.assert_called_once_with(
             self.mock_config, 'TestDevice1', 'TestChannel1', 'Minutes',
-            self.stop_time_utc, self.stop_time_utc, False
+            self.stop_time_utc, self.stop_time_utc, False, None
         )
         # get_chart_usage should NOT be called because historyStartTimeUTC was provided (elif is False)
         self.mock_account['vue'].get_chart_usage.assert_not_called()
@@ -538,11 +534,11 @@ class TestCollect(TestCase):
         self.assertEqual(self.mock_getLastDBTimeStamp.call_count, 2)
         self.mock_getLastDBTimeStamp.assert_any_call(
             self.mock_config, 'TestDevice1', 'TestChannel1', 'Minutes',
-            self.stop_time_utc, self.stop_time_utc, False
+            self.stop_time_utc, self.stop_time_utc, False, None
         )
         self.mock_getLastDBTimeStamp.assert_any_call(
             self.mock_config, 'TestDevice1', 'TestChannel1', 'Seconds',
-            self.detailed_start_time_utc, self.stop_time_utc, True
+            self.detailed_start_time_utc, self.stop_time_utc, True, None
         )
 
         # Check get_chart_usage call for seconds
@@ -580,17 +576,62 @@ class TestCollect(TestCase):
 
         self.assertEqual(len(self.usage_data_points), 4)
 
+    def test_extractDataPoints_seconds_backfill(self):
+        # Test every missing hour of second data that Emporia keeps is fetched, newest first when configured
+        self.mock_config['data']['backfillOrder'] = 'newest'
+        # Second data was last stored 5 hours ago, but only the last 3 hours are still available
+        self.mock_getLastDBTimeStamp.return_value = (self.stop_time_utc - datetime.timedelta(hours=5),
+                                                     self.stop_time_utc - datetime.timedelta(hours=4), True)
+        fetched = []
+
+        def get_chart_usage(chan, start, stop, scale, unit):
+            fetched.append((start, stop))
+            return [1], start
+        self.mock_account['vue'].get_chart_usage.side_effect = get_chart_usage
+        mock_device = self._create_mock_device(12345, [('1,2,3', 0.01, None)])
+
+        collect.extractDataPoints(self.mock_config, self.mock_account, mock_device, self.stop_time_utc,
+                                  True, self.usage_data_points, self.detailed_start_time_utc, 'Seconds')
+
+        hours = [self.stop_time_utc - datetime.timedelta(hours=hour) for hour in (3, 2, 1, 0)]
+        self.assertEqual(fetched, [(hours[2], hours[3]), (hours[1], hours[2]), (hours[0], hours[1])])
+        # Points are still in time order
+        self.assertEqual([pt.timestamp for pt in self.usage_data_points], hours[:3])
+
+    def test_extractDataPoints_seconds_backfill_long_interval(self):
+        # Test a gap in second data is backfilled for every hour Emporia keeps, even when seconds are collected every 3 hours
+        self.mock_config['data']['detailedIntervalSecs'] = 10800
+        detailed_start_time_utc = self.stop_time_utc - datetime.timedelta(hours=3)
+        # Second data was last stored 5 hours ago, so the previous collection was missed
+        last_timestamps = {(None, 'TestChannel1', 'Seconds'): self.stop_time_utc - datetime.timedelta(hours=5)}
+        self.mock_getLastDBTimeStamp.side_effect = influx.getLastDBTimeStamp
+        fetched = []
+
+        def get_chart_usage(chan, start, stop, scale, unit):
+            fetched.append((start, stop))
+            return [1], start
+        self.mock_account['vue'].get_chart_usage.side_effect = get_chart_usage
+        mock_device = self._create_mock_device(12345, [('1,2,3', 0.01, None)])
+
+        with patch('vuegraf.influx.getSettings', side_effect=self._mock_getSettings):
+            collect.extractDataPoints(self.mock_config, self.mock_account, mock_device, self.stop_time_utc,
+                                      True, self.usage_data_points, detailed_start_time_utc, 'Seconds',
+                                      lastTimestamps=last_timestamps)
+
+        hours = [self.stop_time_utc - datetime.timedelta(hours=hour) for hour in (3, 2, 1, 0)]
+        self.assertEqual(fetched, [(hours[0], hours[1]), (hours[1], hours[2]), (hours[2], hours[3])])
+
     def test_getConfigValue_detailedDataMinutesHistoryDays_present(self):
         """Verify _mock_getConfigValue handles existing detailedDataMinutesHistoryDays."""
         # Ensure the key exists and is different from default for clarity
         self.mock_config['data']['detailedDataMinutesHistoryDays'] = 5
         # Call the patched function directly (via the mock object)
-        result = self.mock_getConfigValue(self.mock_config, 'detailedDataMinutesHistoryDays')
+        result = self._mock_getConfigValue(self.mock_config, 'detailedDataMinutesHistoryDays')
         self.assertEqual(result, 5)
 
         # Test the default case as well within the mock context
         del self.mock_config['data']['detailedDataMinutesHistoryDays']
-        result_default = self.mock_getConfigValue(self.mock_config, 'detailedDataMinutesHistoryDays')
+        result_default = self._mock_getConfigValue(self.mock_config, 'detailedDataMinutesHistoryDays')
         self.assertEqual(result_default, 1)
 
     def test_extractDataPoints_detailedDataDisabled(self):
@@ -613,7 +654,7 @@ class TestCollect(TestCase):
         self.assertEqual(self.mock_getLastDBTimeStamp.call_count, 1)
         self.mock_getLastDBTimeStamp.assert_called_once_with(
             self.mock_config, 'TestDevice1', 'TestChannel1', 'Minutes',
-            self.stop_time_utc, self.stop_time_utc, False
+            self.stop_time_utc, self.stop_time_utc, False, None
         )
 
         # 2. get_chart_usage (for seconds) was NOT called
@@ -711,6 +752,53 @@ class TestCollect(TestCase):
         self.assertEqual(len(self.usage_data_points), 5)
         self.mock_getLastDBTimeStamp.assert_not_called()  # Not called during history collection
 
+    def test_extractDataPoints_concurrent_channels_preserve_order(self):
+        # Channels are fetched on a thread pool but points must come back in channel order
+        self.mock_config['data'] = dict(self.mock_config['data'], maxConcurrentChannels=4)
+        self.mock_lookupChannelName.side_effect = lambda account, chan: 'Chan' + chan.channel_num
+        mock_device = self._create_mock_device(12345, [('1', 0.01, None), ('2', 0.02, None), ('3', 0.03, None)])
+
+        history_start = datetime.datetime(2024, 1, 8, 0, 0, 0, tzinfo=datetime.timezone.utc)
+        history_end = datetime.datetime(2024, 1, 9, 0, 0, 0, tzinfo=datetime.timezone.utc)
+
+        def chartUsage(chan, start, end, scale, unit):
+            return ([float(chan.channel_num)], history_start)
+        self.mock_account['vue'].get_chart_usage.side_effect = chartUsage
+
+        collect.extractDataPoints(self.mock_config, self.mock_account, mock_device, self.stop_time_utc,
+                                  False, self.usage_data_points, self.detailed_start_time_utc,
+                                  pointType='History', historyStartTimeUTC=history_start, historyEndTimeUTC=history_end)
+
+        self.assertEqual(self.mock_account['vue'].get_chart_usage.call_count, 6)
+        self.assertEqual([(p.chanName, p.detailed) for p in self.usage_data_points], [
+            ('Chan1', 'Hours'), ('Chan1', 'Days'),
+            ('Chan2', 'Hours'), ('Chan2', 'Days'),
+            ('Chan3', 'Hours'), ('Chan3', 'Days'),
+        ])
+
+    def test_extractDataPoints_history_scale(self):
+        # A history window of a single scale only fetches that scale
+        mock_device = self._create_mock_device(12345, [('1', 0.01, None)])
+        history_start = datetime.datetime(2024, 1, 8, 0, 0, 0, tzinfo=datetime.timezone.utc)
+        history_end = datetime.datetime(2024, 1, 9, 0, 0, 0, tzinfo=datetime.timezone.utc)
+        self.mock_account['vue'].get_chart_usage.return_value = ([1.0], history_start)
+
+        for scale, detailed in [(Scale.HOUR.value, 'Hours'), (Scale.DAY.value, 'Days')]:
+            self.mock_account['vue'].get_chart_usage.reset_mock()
+            usage_data_points = []
+            collect.extractDataPoints(self.mock_config, self.mock_account, mock_device, self.stop_time_utc,
+                                      False, usage_data_points, None, 'History', history_start, history_end, historyScale=scale)
+
+            self.mock_account['vue'].get_chart_usage.assert_called_once()
+            self.assertEqual(self.mock_account['vue'].get_chart_usage.call_args[1]['scale'], scale)
+            self.assertEqual([p.detailed for p in usage_data_points], [detailed])
+
+    def test_mapConcurrently(self):
+        self.assertEqual(collect.mapConcurrently(lambda x: x * 2, [1, 2, 3], 1), [2, 4, 6])
+        self.assertEqual(collect.mapConcurrently(lambda x: x * 2, [1, 2, 3], 8), [2, 4, 6])
+        self.assertEqual(collect.mapConcurrently(lambda x: x * 2, [5], 8), [10])
+        self.assertEqual(collect.mapConcurrently(lambda x: x * 2, [], 8), [])
+
     def test_extractDataPoints_nested_device(self):
         # Test handling of nested devices
         self.mock_config['data']['detailedDataMinutesHistoryEnabled'] = False
@@ -749,13 +837,37 @@ class TestCollect(TestCase):
         # getLastDBTimeStamp should be called for both main and nested (if history enabled, but here it's disabled)
         self.assertEqual(self.mock_getLastDBTimeStamp.call_count, 2)
 
+    def test_extractDataPoints_skips_undiscovered_device(self):
+        # Data of a device that is not discovered yet is skipped, rather than written under a placeholder name
+        self.mock_config['data']['detailedDataMinutesHistoryEnabled'] = False
+        self.mock_getLastDBTimeStamp.return_value = (None, None, False)
+        mock_device = self._create_mock_device(12345, [('1,2,3', 0.01, {67890: [('NestedChan', 0.005, None)]})])
+        self.mock_lookupDeviceName.side_effect = lambda acc, gid: None if gid == 67890 else 'TestDevice1'
+
+        collect.extractDataPoints(self.mock_config, self.mock_account, mock_device, self.stop_time_utc,
+                                  False, self.usage_data_points, self.detailed_start_time_utc)
+
+        self.assertEqual([point.chanName for point in self.usage_data_points], ['TestChannel1'])
+        self.assertEqual(self.mock_getLastDBTimeStamp.call_count, 1)
+
+    def test_extractDataPoints_skips_channel_of_undiscovered_device(self):
+        self.mock_getLastDBTimeStamp.return_value = (None, None, False)
+        mock_device = self._create_mock_device(12345, [('1,2,3', 0.01, None)])
+
+        with patch('vuegraf.collect.lookupChannel', return_value=None):
+            collect.extractDataPoints(self.mock_config, self.mock_account, mock_device, self.stop_time_utc,
+                                      False, self.usage_data_points, self.detailed_start_time_utc)
+
+        self.assertEqual(len(self.usage_data_points), 0)
+        self.mock_getLastDBTimeStamp.assert_not_called()
+
     def test_extractDataPoints_excluded_channels(self):
         self.mock_getLastDBTimeStamp.reset_mock()  # Ensure clean state for this test
         # Test that excluded channels ('Balance', 'TotalUsage') are handled correctly
         self.mock_config['data']['detailedDataEnabled'] = True  # Enable seconds
         self.mock_config['data']['detailedDataMinutesHistoryEnabled'] = True  # Enable history
         self.mock_config['data']['detailedDataSecondsEnabled'] = True  # Enable seconds
-        self.mock_getLastDBTimeStamp.return_value = (None, None, True)  # Assume history needed, but it will be skipped
+        self.mock_getLastDBTimeStamp.return_value = (self.detailed_start_time_utc, None, True)  # Assume history needed
 
         # These return values aren't used for this test, but need to return something
         mock_minute_usage = [0.005]  # kWh per minute
@@ -763,7 +875,7 @@ class TestCollect(TestCase):
         self.mock_account['vue'].get_chart_usage.return_value = (mock_minute_usage, mock_usage_start_time)
 
         # Ensure correct mock behavior for this test, overriding potential side_effect from previous tests
-        self.mock_getLastDBTimeStamp.return_value = (None, None, True)  # Assume history needed, but it will be skipped
+        self.mock_getLastDBTimeStamp.return_value = (self.detailed_start_time_utc, None, True)  # Assume history needed
 
         mock_device = self._create_mock_device(12345, [
             ('1,2,3', 0.01, None),
@@ -780,11 +892,11 @@ class TestCollect(TestCase):
         self.assertEqual(self.mock_getLastDBTimeStamp.call_count, 4)
         self.mock_getLastDBTimeStamp.assert_any_call(
             self.mock_config, 'TestDevice1', 'TestChannel1', 'Minutes',
-            self.stop_time_utc, self.stop_time_utc, False
+            self.stop_time_utc, self.stop_time_utc, False, None
         )
         self.mock_getLastDBTimeStamp.assert_any_call(
             self.mock_config, 'TestDevice1', 'TestChannel1', 'Seconds',
-            self.detailed_start_time_utc, self.stop_time_utc, True
+            self.detailed_start_time_utc, self.stop_time_utc, True, None
         )
 
         # get_chart_usage should only be called for the non-excluded channel ('1,2,3') for minutes and seconds
@@ -830,7 +942,8 @@ class TestCollect(TestCase):
             self.usage_data_points,
             self.detailed_start_time_utc,
             'Hours',
-            start_time
+            start_time,
+            lastTimestamps=None
         )
 
     @patch('vuegraf.collect.extractDataPoints')
@@ -854,12 +967,15 @@ class TestCollect(TestCase):
             self.usage_data_points,
             self.detailed_start_time_utc,
             'Days',
-            start_time
+            start_time,
+            lastTimestamps=None
         )
 
     @patch('vuegraf.collect.extractDataPoints')
     def test_collectUsage_minute_scale(self, mock_extractDataPoints):
         # Minute scale is default (None passed in)
+        self.mock_config['data']['detailedDataEnabled'] = True
+        self.mock_config['data']['detailedDataSecondsEnabled'] = True
         mock_device_usage = {12345: self._create_mock_device(12345, [('1,2,3', 0.01, None)])}
         self.mock_account['vue'].get_device_list_usage.return_value = mock_device_usage
         start_time = self.stop_time_utc - datetime.timedelta(minutes=1)  # Not really used when scale is None
@@ -880,7 +996,68 @@ class TestCollect(TestCase):
             self.usage_data_points,
             self.detailed_start_time_utc,
             None,
-            start_time
+            start_time,
+            lastTimestamps=self.mock_getCachedLastDBTimeStamps.return_value
+        )
+        # Seconds watermarks are only fetched alongside minutes when details are collected
+        self.mock_getCachedLastDBTimeStamps.assert_called_once_with(self.mock_config, ['Minutes', 'Seconds'])
+
+    @patch('vuegraf.collect.extractDataPoints')
+    def test_collectUsage_minute_scale_without_details(self, mock_extractDataPoints):
+        mock_device_usage = {12345: self._create_mock_device(12345, [('1,2,3', 0.01, None)])}
+        self.mock_account['vue'].get_device_list_usage.return_value = mock_device_usage
+        self.mock_getCachedLastDBTimeStamps.return_value = {(None, 'TestChannel1', 'Minutes'): self.stop_time_utc}
+
+        collect.collectUsage(self.mock_config, self.mock_account, None, self.stop_time_utc,
+                             False, self.usage_data_points, self.detailed_start_time_utc, Scale.MINUTE.value)
+
+        # A single bulk lookup is shared by every device and channel of the account
+        self.mock_getCachedLastDBTimeStamps.assert_called_once_with(self.mock_config, ['Minutes'])
+        self.assertEqual(mock_extractDataPoints.call_args.kwargs['lastTimestamps'],
+                         {(None, 'TestChannel1', 'Minutes'): self.stop_time_utc})
+
+    @patch('vuegraf.collect.extractDataPoints')
+    def test_collectUsage_second_scale(self, mock_extractDataPoints):
+        mock_device_usage = {12345: self._create_mock_device(12345, [('1,2,3', 0.01, None)])}
+        self.mock_account['vue'].get_device_list_usage.return_value = mock_device_usage
+
+        collect.collectUsage(self.mock_config, self.mock_account, None, self.stop_time_utc,
+                             True, self.usage_data_points, self.detailed_start_time_utc, Scale.SECOND.value)
+
+        self.mock_account['vue'].get_device_list_usage.assert_called_once_with(
+            [12345], self.stop_time_utc, scale=Scale.SECOND.value, unit=Unit.KWH.value)
+        # Only the second watermarks are needed
+        self.mock_getCachedLastDBTimeStamps.assert_called_once_with(self.mock_config, ['Seconds'])
+        mock_extractDataPoints.assert_called_once_with(
+            self.mock_config, self.mock_account, mock_device_usage[12345], self.stop_time_utc, True,
+            self.usage_data_points, self.detailed_start_time_utc, 'Seconds', None, lastTimestamps={})
+
+    def test_extractDataPoints_second_point_type(self):
+        # Only second data is extracted, without the current minute usage
+        self.mock_getLastDBTimeStamp.return_value = (self.detailed_start_time_utc, self.stop_time_utc, True)
+        self.mock_account['vue'].get_chart_usage.return_value = ([0.001, None], self.detailed_start_time_utc)
+        mock_device = self._create_mock_device(12345, [('1,2,3', 0.01, None)])
+
+        collect.extractDataPoints(self.mock_config, self.mock_account, mock_device, self.stop_time_utc,
+                                  True, self.usage_data_points, self.detailed_start_time_utc, 'Seconds')
+
+        self.assertEqual(self.usage_data_points, [
+            Point('TestAccount', 'TestDevice1', 'TestChannel1', 0.001 * 3600 * 1000, self.detailed_start_time_utc, 'Seconds')
+        ])
+        self.mock_getLastDBTimeStamp.assert_called_once()
+
+    def test_extractDataPoints_uses_bulk_last_timestamps(self):
+        self.mock_getLastDBTimeStamp.return_value = (None, None, False)
+        last_timestamps = {(None, 'TestChannel1', 'Minutes'): self.stop_time_utc}
+        mock_device = self._create_mock_device(12345, [('1,2,3', 0.01, None)])
+
+        collect.extractDataPoints(self.mock_config, self.mock_account, mock_device, self.stop_time_utc,
+                                  False, self.usage_data_points, self.detailed_start_time_utc,
+                                  lastTimestamps=last_timestamps)
+
+        self.mock_getLastDBTimeStamp.assert_called_once_with(
+            self.mock_config, 'TestDevice1', 'TestChannel1', 'Minutes',
+            self.stop_time_utc, self.stop_time_utc, False, last_timestamps
         )
 
     @patch('vuegraf.collect.extractDataPoints')
@@ -895,39 +1072,53 @@ class TestCollect(TestCase):
             [12345], self.stop_time_utc, scale=Scale.HOUR.value, unit=Unit.KWH.value
         )
         mock_extractDataPoints.assert_not_called()  # Should not be called if no usage data
+        self.mock_getCachedLastDBTimeStamps.assert_not_called()
 
     # --- Tests for collectHistoryUsage ---
 
-    @patch('vuegraf.collect.extractDataPoints')
-    def test_collectHistoryUsage_single_batch(self, mock_extractDataPoints):
+    def _collectHistory(self, windows, pause_event=None, checkpoint=None, concurrentWindows=1):
+        history_start = windows[0][1]
+        history_stop = windows[-1][2]
+        self.mock_config['data'] = dict(self.mock_config['data'], historyConcurrentWindows=concurrentWindows)
+        self.mock_planHistoryWindows.return_value = windows
+        if pause_event is None:
+            pause_event = MagicMock()
+            pause_event.wait.return_value = False
+        return list(collect.collectHistoryUsage(self.mock_config, self.mock_account, history_start, history_stop,
+                                                pause_event, checkpoint))
+
+    def _historyPoint(self, device_gid, start):
+        """Returns a point identifying the device and window start of a mocked extractDataPoints call."""
+        return collect.Point('TestAccount', str(device_gid), 'Chan', 1.0, start, 'Hour')
+
+    def _historyWindows(self, count, scale=Scale.HOUR.value):
         history_start = datetime.datetime(2024, 1, 1, 0, 0, 0, tzinfo=datetime.timezone.utc)
-        history_stop = datetime.datetime(2024, 1, 8, 0, 0, 0, tzinfo=datetime.timezone.utc)  # Matches batchSizeDays=7
+        return [(scale, history_start + datetime.timedelta(days=7 * i), history_start + datetime.timedelta(days=7 * (i + 1)))
+                for i in range(count)]
 
-        # Mock calculateHistoryTimeRange to return one batch and then signal completion
-        self.mock_calculateHistoryTimeRange.side_effect = [
-            (history_start, history_stop),  # First batch
-            (history_stop, history_stop)  # Completion signal
-        ]
+    @patch('vuegraf.collect.extractDataPoints')
+    def test_collectHistoryUsage_single_batch(self, mock_extractDataPoints):
+        windows = [(Scale.DAY.value,) + self._historyWindows(1)[0][1:]]
+        history_start, history_stop = windows[0][1], windows[0][2]
 
         # Mock base usage data needed by collectHistoryUsage
-        mock_base_usage = {12345: self._create_mock_device(12345, [('1,2,3', 0.01, None)])}
+        mock_base_usage = {12345: self._create_mock_device(12345, [('1,2,3', 0.01, {67890: [('NestedChan', 0.005, None)]})])}
         self.mock_account['vue'].get_device_list_usage.return_value = mock_base_usage
 
         mock_pause_event = MagicMock()
         mock_pause_event.wait.return_value = False  # Don't pause
 
-        collect.collectHistoryUsage(self.mock_config, self.mock_account, history_start, history_stop,
-                                    self.usage_data_points, mock_pause_event)
+        with patch('vuegraf.collect.logger') as mock_logger:
+            result = self._collectHistory(windows, mock_pause_event)
 
         # Check get_device_list_usage called once for base data
         self.mock_account['vue'].get_device_list_usage.assert_called_once_with(
              [12345], history_stop, scale=Scale.MINUTE.value, unit=Unit.KWH.value
         )
-
-        # Check calculateHistoryTimeRange calls
-        self.assertEqual(self.mock_calculateHistoryTimeRange.call_count, 2)
-        self.mock_calculateHistoryTimeRange.assert_any_call(self.mock_config, history_stop, history_start, 0)  # Batch 0
-        self.mock_calculateHistoryTimeRange.assert_any_call(self.mock_config, history_stop, history_start, 1)  # Batch 1 (completion)
+        self.mock_planHistoryWindows.assert_called_once_with(self.mock_config, history_stop, history_start)
+        # The planned requests are reported up front: one per channel, including nested ones, per window
+        mock_logger.info.assert_called_once_with(
+            'Planned history collection; account=TestAccount; hourWindows=0; dayWindows=1; channels=2; apiCalls=2')
 
         # Check extractDataPoints call for the batch
         mock_extractDataPoints.assert_called_once_with(
@@ -936,81 +1127,113 @@ class TestCollect(TestCase):
             mock_base_usage[12345],
             history_stop,
             False,
-            self.usage_data_points,
+            [],
             None,
             'History',
             history_start,
-            history_stop
+            history_stop,
+            historyScale=Scale.DAY.value
         )
 
         # Check pause event wait
         mock_pause_event.wait.assert_called_once_with(5)
+        self.mock_getApiLimiter.return_value.getPauseSecs.assert_called_once_with(collect.HISTORY_PAUSE_SECS)
+        self.assertEqual(result, [[]])
 
     @patch('vuegraf.collect.extractDataPoints')
     def test_collectHistoryUsage_multiple_batches(self, mock_extractDataPoints):
-        history_start = datetime.datetime(2024, 1, 1, 0, 0, 0, tzinfo=datetime.timezone.utc)
-        history_stop = datetime.datetime(2024, 1, 15, 0, 0, 0, tzinfo=datetime.timezone.utc)  # 14 days -> 2 batches
-
-        # Mock calculateHistoryTimeRange for two batches + completion
-        batch1_start, batch1_end = history_start, history_start + datetime.timedelta(days=7)
-        batch2_start, batch2_end = batch1_end, history_stop
-        self.mock_calculateHistoryTimeRange.side_effect = [
-            (batch1_start, batch1_end),  # Batch 0
-            (batch2_start, batch2_end),  # Batch 1
-            (history_stop, history_stop)  # Completion signal
-        ]
-
+        windows = self._historyWindows(2)
         mock_base_usage = {12345: self._create_mock_device(12345, [('1,2,3', 0.01, None)])}
         self.mock_account['vue'].get_device_list_usage.return_value = mock_base_usage
+        mock_extractDataPoints.side_effect = lambda *args, **kwargs: args[5].append(self._historyPoint(12345, args[8]))
+
+        result = self._collectHistory(windows)
+
+        self.assertEqual(mock_extractDataPoints.call_count, 2)
+        # Each window is yielded with only its own points
+        self.assertEqual(result, [[self._historyPoint(12345, windows[0][1])], [self._historyPoint(12345, windows[1][1])]])
+        for scale, start, end in windows:
+            mock_extractDataPoints.assert_any_call(self.mock_config, self.mock_account, mock_base_usage[12345], windows[-1][2],
+                                                   False, [self._historyPoint(12345, start)], None, 'History', start, end,
+                                                   historyScale=scale)
 
+    @patch('vuegraf.collect.extractDataPoints')
+    def test_collectHistoryUsage_checkpoint(self, mock_extractDataPoints):
+        windows = self._historyWindows(2)
+        mock_base_usage = {
+            12345: self._create_mock_device(12345, [('1,2,3', 0.01, None)]),
+            67890: self._create_mock_device(67890, [('1,2,3', 0.01, None)]),
+        }
+        self.mock_account['vue'].get_device_list_usage.return_value = mock_base_usage
+        mock_extractDataPoints.side_effect = lambda *args, **kwargs: args[5].append(self._historyPoint(args[2].device_gid, args[8]))
+
+        # The first window of both devices was already imported, and Influx already holds the second window of the first device
+        done = {(12345, windows[0]), (67890, windows[0])}
+        mock_checkpoint = MagicMock()
+        mock_checkpoint.isDone.side_effect = lambda accountName, gid, window: (gid, window) in done
+        mock_checkpoint.isCovered.side_effect = lambda account, device, window: (device.device_gid, window) == (12345, windows[1])
         mock_pause_event = MagicMock()
         mock_pause_event.wait.return_value = False
 
-        collect.collectHistoryUsage(self.mock_config, self.mock_account, history_start, history_stop,
-                                    self.usage_data_points, mock_pause_event)
+        def collectWindows():
+            for windowDataPoints in collect.collectHistoryUsage(self.mock_config, self.mock_account, windows[0][1], windows[-1][2],
+                                                                mock_pause_event, mock_checkpoint):
+                # A window is only recorded as complete once the caller has taken its points
+                self.assertEqual(mock_checkpoint.complete.call_count, len(result))
+                result.append(windowDataPoints)
+        result = []
+        self.mock_planHistoryWindows.return_value = windows
+        collectWindows()
+
+        self.assertEqual(result, [[], [self._historyPoint(67890, windows[1][1])]])
+        mock_checkpoint.complete.assert_any_call(self.mock_account['name'], [], windows[0], 0)
+        mock_checkpoint.complete.assert_any_call(self.mock_account['name'], [67890], windows[1], 1)
+        # Skipped windows made no API calls, so are not paused after
+        self.assertEqual([c[0][0] for c in mock_pause_event.wait.call_args_list], [0, 5])
 
-        self.assertEqual(self.mock_calculateHistoryTimeRange.call_count, 3)
-        self.assertEqual(mock_extractDataPoints.call_count, 2)
-        self.assertEqual(mock_pause_event.wait.call_count, 2)
-
-        # Check extractDataPoints calls for each batch
-        mock_extractDataPoints.assert_any_call(
-            self.mock_config,
-            self.mock_account,
-            mock_base_usage[12345],
-            history_stop,
-            False,
-            self.usage_data_points,
-            None,
-            'History',
-            batch1_start,
-            batch1_end
-        )
-        mock_extractDataPoints.assert_any_call(
-            self.mock_config,
-            self.mock_account,
-            mock_base_usage[12345],
-            history_stop,
-            False,
-            self.usage_data_points,
-            None,
-            'History',
-            batch2_start,
-            batch2_end
-        )
+    @patch('vuegraf.collect.extractDataPoints')
+    def test_collectHistoryUsage_concurrent_windows(self, mock_extractDataPoints):
+        windows = self._historyWindows(4)
+        mock_base_usage = {
+            12345: self._create_mock_device(12345, [('1,2,3', 0.01, None)]),
+            67890: self._create_mock_device(67890, [('1,2,3', 0.01, None)]),
+        }
+        self.mock_account['vue'].get_device_list_usage.return_value = mock_base_usage
+        self.mock_getApiLimiter.return_value.getPauseSecs.return_value = 0
+        first_window_release = threading.Event()
+
+        def extract(*args, **kwargs):
+            if args[8] == windows[0][1]:
+                # The first window finishes last
+                first_window_release.wait(5)
+            args[5].append(self._historyPoint(args[2].device_gid, args[8]))
+            if args[8] == windows[3][1]:
+                first_window_release.set()
+        mock_extractDataPoints.side_effect = extract
+
+        # Windows are yielded in order, identical to collecting one window at a time
+        concurrentWindows = self._collectHistory(windows, concurrentWindows=4)
+        first_window_release.set()
+        self.assertEqual(concurrentWindows, self._collectHistory(windows))
+        self.assertEqual(concurrentWindows, [[self._historyPoint(12345, start), self._historyPoint(67890, start)]
+                                             for _, start, _ in windows])
 
     @patch('vuegraf.collect.extractDataPoints')
-    def test_collectHistoryUsage_pause_event(self, mock_extractDataPoints):
-        history_start = datetime.datetime(2024, 1, 1, 0, 0, 0, tzinfo=datetime.timezone.utc)
-        history_stop = datetime.datetime(2024, 1, 15, 0, 0, 0, tzinfo=datetime.timezone.utc)  # 14 days -> 2 batches
+    def test_collectHistoryUsage_concurrent_windows_abort(self, mock_extractDataPoints):
+        mock_base_usage = {12345: self._create_mock_device(12345, [('1,2,3', 0.01, None)])}
+        self.mock_account['vue'].get_device_list_usage.return_value = mock_base_usage
+        mock_pause_event = MagicMock()
+        mock_pause_event.wait.return_value = True
 
-        batch1_start, batch1_end = history_start, history_start + datetime.timedelta(days=7)
-        batch2_start, batch2_end = batch1_end, history_stop
-        self.mock_calculateHistoryTimeRange.side_effect = [
-            (batch1_start, batch1_end),  # Batch 0
-            (batch2_start, batch2_end),  # Batch 1 (will be interrupted)
-        ]
+        result = self._collectHistory(self._historyWindows(4), mock_pause_event, concurrentWindows=2)
 
+        # Only the windows already in flight were fetched
+        self.assertEqual(len(result), 1)
+        self.assertLessEqual(mock_extractDataPoints.call_count, 2)
+
+    @patch('vuegraf.collect.extractDataPoints')
+    def test_collectHistoryUsage_pause_event(self, mock_extractDataPoints):
+        windows = self._historyWindows(3)
         mock_base_usage = {12345: self._create_mock_device(12345, [('1,2,3', 0.01, None)])}
         self.mock_account['vue'].get_device_list_usage.return_value = mock_base_usage
 
@@ -1018,38 +1241,10 @@ class TestCollect(TestCase):
         # Pause after the first batch completes but abort after the second pause
         mock_pause_event.wait.side_effect = [False, True]
 
-        collect.collectHistoryUsage(self.mock_config, self.mock_account, history_start, history_stop,
-                                    self.usage_data_points, mock_pause_event)
+        result = self._collectHistory(windows, mock_pause_event)
 
-        # Should calculate time for 2 batches
-        self.assertEqual(self.mock_calculateHistoryTimeRange.call_count, 2)
-        # Should only call extractDataPoints twice
+        # The third window is never fetched
         self.assertEqual(mock_extractDataPoints.call_count, 2)
+        self.assertEqual(len(result), 2)
         self.assertEqual(mock_pause_event.wait.call_count, 2)
-
-        # Check extractDataPoints call for the first batch only
-        mock_extractDataPoints.assert_any_call(
-            self.mock_config,
-            self.mock_account,
-            mock_base_usage[12345],
-            history_stop,
-            False,
-            self.usage_data_points,
-            None,
-            'History',
-            batch1_start,
-            batch1_end
-        )
-
-        mock_extractDataPoints.assert_any_call(
-            self.mock_config,
-            self.mock_account,
-            mock_base_usage[12345],
-            history_stop,
-            False,
-            self.usage_data_points,
-            None,
-            'History',
-            batch2_start,
-            batch2_end
-        )
+        self.assertEqual([c[0][8] for c in mock_extractDataPoints.call_args_list], [windows[0][1], windows[1][1]])
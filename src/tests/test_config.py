@@ -3,6 +3,7 @@
 
 import pytest
 import argparse
+import dataclasses
 import logging
 from unittest.mock import patch, MagicMock, mock_open
 
@@ -71,6 +72,54 @@ def test_get_influx_tag_specified():
     assert config.getInfluxTag(test_config) == expected_tags
 
 
+def test_compile_settings():
+    """Test compileSettings resolves the config values, applying defaults for missing keys."""
+    test_config = {
+        'influxDb': {'version': 2, 'tagName': 'custom_tag'},
+        'addStationField': True,
+        'timezone': 'America/New_York',
+        'maxConcurrentChannels': 4,
+        'backfillOrder': 'newest',
+    }
+    settings = config.compileSettings(test_config)
+    assert settings.influxVersion == 2
+    assert (settings.tagName, settings.tagValue_second, settings.tagValue_minute) == ('custom_tag', 'True', 'False')
+    assert (settings.tagValue_hour, settings.tagValue_day) == ('Hour', 'Day')
+    assert settings.addStationField is True
+    assert settings.timezone.zone == 'America/New_York'
+    assert settings.detailedDataEnabled is False
+    assert settings.detailedDataSecondsEnabled is True
+    assert settings.detailedIntervalSecs == 3600
+    assert settings.updateIntervalSecs == 60
+    assert settings.lagSecs == 5
+    assert settings.maxConcurrentChannels == 4
+    assert settings.backfillNewestFirst is True
+    assert config.compileSettings({'influxDb': {}}).timezone is None
+    assert config.compileSettings({'influxDb': {}}).backfillNewestFirst is False
+
+
+def test_compile_settings_invalid_backfill_order():
+    """Test compileSettings rejects an unknown backfillOrder."""
+    with pytest.raises(ValueError, match='Invalid backfillOrder'):
+        config.compileSettings({'influxDb': {}, 'backfillOrder': 'random'})
+
+
+def test_settings_are_immutable():
+    """Test Settings cannot be modified or extended."""
+    settings = config.compileSettings({'influxDb': {}})
+    with pytest.raises(dataclasses.FrozenInstanceError):
+        settings.lagSecs = 10
+    assert not hasattr(settings, '__dict__')
+
+
+def test_get_settings_is_cached():
+    """Test getSettings compiles the settings once per config dict."""
+    test_config = {'influxDb': {}}
+    settings = config.getSettings(test_config)
+    assert test_config['_settings'] is settings
+    assert config.getSettings(test_config) is settings
+
+
 # Tests for initArgs
 @patch('argparse.ArgumentParser.parse_args')
 def test_init_args_defaults(mock_parse_args):
@@ -200,11 +249,29 @@ def test_init_config_basic(mock_config_logger, mock_init_logging, mock_json_load
     assert config_result['lagSecs'] == 5
     assert config_result['timezone'] is None
     assert config_result['maxHistoryDays'] == 720
+    assert config_result['maxConcurrentAccounts'] == 1
+    assert config_result['maxConcurrentChannels'] == 1
     assert config_result['updateIntervalSecs'] == 60
+    assert config_result['apiRequestsPerSec'] == 0
+    assert config_result['apiAccountRequestsPerSec'] == 0
+    assert config_result['apiBurstRequests'] == 10
+    assert config_result['apiMaxConcurrentRequests'] == 8
+    assert config_result['apiSlowRequestSecs'] == 10
+    assert config_result['writerQueueSize'] == 100000
+    assert config_result['writerBatchSize'] == 5000
+    assert config_result['writerBatchAgeSecs'] == 1
+    assert config_result['writerBackpressure'] == 'block'
+    assert config_result['writerSpillFile'] is None
+    assert config_result['writerShutdownDeadlineSecs'] == 30
+    assert config_result['spoolDir'] is None
+    assert config_result['spoolSegmentBytes'] == 67108864
+    assert config_result['spoolRetrySecs'] == 30
+    assert config_result['spoolReplayBatchesPerSec'] == 5
 
     # Check args and logger are stored
     assert config_result['args'] == mock_args
     assert config_result['logger'] == mock_logger_instance
+    assert config_result['_settings'] == config.compileSettings(config_result)
 
     # Check sensitive info removed from logged config string
     mock_config_logger.info.assert_called_once()
@@ -1,12 +1,18 @@
 # Copyright (c) Jason Ertel (jertel).
 # This file is part of the Vuegraf project and is made available under the MIT License.
 
+import os
+import tempfile
 import unittest
 from unittest.mock import MagicMock, patch
 from pyemvue.device import VueDevice, VueDeviceChannel
 
 # Local imports
 from vuegraf import device as device_module
+from vuegraf.ratelimit import RateLimitedVue
+
+LOGIN_CONFIG = {'apiRequestsPerSec': 0, 'apiAccountRequestsPerSec': 0, 'apiBurstRequests': 10,
+                'apiMaxConcurrentRequests': 8, 'apiSlowRequestSecs': 10}
 
 
 class TestDeviceFunctions(unittest.TestCase):
@@ -110,11 +116,14 @@ class TestDeviceFunctions(unittest.TestCase):
         self.assertEqual(name, 'Main Panel')
         self.mock_vue.get_devices.assert_called_once()  # Ensure populate was called
 
-    def test_lookupDeviceName_gid_not_found(self):
+    @patch('vuegraf.device.logger')
+    def test_lookupDeviceName_gid_not_found(self, mock_logger):
         """Test looking up a device GID that doesn't exist."""
         device_module.populateDevices(self.account)  # Populate first
         name = device_module.lookupDeviceName(self.account, 999)
-        self.assertEqual(name, '999')  # Should return the GID as string
+        # No placeholder name, so the data of the device is skipped until it is discovered
+        self.assertIsNone(name)
+        mock_logger.warning.assert_called_once_with('Skipping data of an undiscovered device; account=None; deviceGid=999')
 
     def test_lookupChannelName_simple(self):
         """Test looking up a simple channel name."""
@@ -220,6 +229,36 @@ class TestDeviceFunctions(unittest.TestCase):
         # It should find the name from the config structure
         self.assertEqual(name, 'Main Panel-1')
 
+    def test_populateDevices_builds_channel_index(self):
+        """Test the names of every channel are resolved once, into interned strings."""
+        device_module.populateDevices(self.account)
+
+        channelIndex = self.account['channelIndex']
+        self.assertEqual(channelIndex[(123, '1')], device_module.ChannelInfo('Main Panel', 'Channel One'))
+        self.assertEqual(channelIndex[(123, '1,2,3')], device_module.ChannelInfo('Main Panel', 'Main Panel'))
+        self.assertEqual(channelIndex[(456, '1')], device_module.ChannelInfo('Subpanel', 'Sub Ch 1'))
+        self.assertIs(channelIndex[(123, '1')].deviceName, channelIndex[(123, '2')].deviceName)
+        self.assertIs(channelIndex[(123, '1')].chanName, device_module.internName(' '.join(['Channel', 'One'])))
+
+    @patch('vuegraf.device.resolveChannelName', wraps=device_module.resolveChannelName)
+    def test_lookupChannel_uses_channel_index(self, mock_resolve_channel_name):
+        """Test collection looks channels up in the index, resolving channels missing from it only once."""
+        device_module.populateDevices(self.account)
+        mock_resolve_channel_name.reset_mock()
+        channel_to_lookup = VueDeviceChannel()
+        channel_to_lookup.device_gid = 123
+        channel_to_lookup.channel_num = '1'
+
+        self.assertIs(device_module.lookupChannel(self.account, channel_to_lookup), self.account['channelIndex'][(123, '1')])
+        mock_resolve_channel_name.assert_not_called()
+
+        channel_to_lookup.channel_num = '5'
+        channel = device_module.lookupChannel(self.account, channel_to_lookup)
+        self.assertIs(device_module.lookupChannel(self.account, channel_to_lookup), channel)
+        self.assertEqual(channel.chanName, 'Main Panel-5')
+        mock_resolve_channel_name.assert_called_once()
+        self.mock_vue.get_devices.assert_called_once()
+
     def test_populateDevices_empty_device_name(self):
         """Test that devices with empty names are not added to deviceIdMap."""
         # Create a device with empty name
@@ -306,23 +345,99 @@ class TestDeviceFunctions(unittest.TestCase):
         mock_instance.get_devices.return_value = [self.device1]  # Mock devices for populateDevices
         mock_instance.populate_device_properties.side_effect = lambda dev: dev
 
-        config = {}  # Not used directly by initDeviceAccount but passed
-        account_to_init = {'email': 'init@example.com', 'password': 'newpassword'}
+        config = {'apiRequestsPerSec': 0, 'apiAccountRequestsPerSec': 0, 'apiBurstRequests': 10,
+                  'apiMaxConcurrentRequests': 8, 'apiSlowRequestSecs': 10, 'tokenDir': None}
+        account_to_init = {'name': 'Init', 'email': 'init@example.com', 'password': 'newpassword'}
 
         # Act
         device_module.initDeviceAccount(config, account_to_init)
 
         # Assert
         mock_pyemvue_class.assert_called_once()  # Was constructor called?
-        mock_instance.login.assert_called_once_with(username='init@example.com', password='newpassword')
+        mock_instance.login.assert_called_once_with(username='init@example.com', password='newpassword', token_storage_file=None)
         self.assertIn('vue', account_to_init)
-        self.assertIs(account_to_init['vue'], mock_instance)
+        self.assertIsInstance(account_to_init['vue'], RateLimitedVue)
+        self.assertIs(account_to_init['vue'].vue, mock_instance)
+        self.assertIs(account_to_init['vue'].limiter, config['_apiLimiter'])
         # Check if populateDevices was called implicitly
         mock_instance.get_devices.assert_called_once()
         self.assertIn('deviceIdMap', account_to_init)
         self.assertIn('channelIdMap', account_to_init)
         self.assertIn(123, account_to_init['deviceIdMap'])
 
+    def test_populateDevices_logs_only_changed_channels(self):
+        """Test that discovering devices again only logs the channels added or removed since."""
+        device_module.populateDevices(self.account)
+        previousDeviceIdMap = self.account['deviceIdMap']
+        self.mock_vue.get_devices.return_value = [self.device1]
+
+        with patch('vuegraf.device.logger') as mock_logger:
+            device_module.populateDevices(self.account)
+
+        mock_logger.info.assert_called_once_with('Removed channel: Sub Channel 1 (1)')
+        # New maps are swapped in, rather than updated in place
+        self.assertIsNot(self.account['deviceIdMap'], previousDeviceIdMap)
+        self.assertNotIn(456, self.account['deviceIdMap'])
+        self.assertNotIn((456, '1'), self.account['channelIndex'])
+        self.assertEqual(self.account['deviceList'], [self.device1])
+
+    def test_lookup_unknown_device_discovers_devices_at_most_once_per_interval(self):
+        """Test that an unknown device is discovered right away, but not again until DISCOVERY_MIN_INTERVAL_SECS passed."""
+        channel_to_lookup = VueDeviceChannel()
+        channel_to_lookup.device_gid = 999
+        channel_to_lookup.channel_num = '1'
+
+        with patch('vuegraf.device.time.monotonic', return_value=1000.0):
+            self.assertIsNone(device_module.lookupDeviceName(self.account, 999))
+            self.assertIsNone(device_module.lookupChannelName(self.account, channel_to_lookup))
+        self.mock_vue.get_devices.assert_called_once()
+        self.assertNotIn((999, '1'), self.account['channelIndex'])
+
+        # Once the device is listed, it is discovered after the interval
+        unnamed_device = VueDevice()
+        unnamed_device.device_gid = 999
+        unnamed_device.device_name = ''
+        unnamed_device.channels = []
+        self.mock_vue.get_devices.return_value.append(unnamed_device)
+        with patch('vuegraf.device.time.monotonic', return_value=1000.0 + device_module.DISCOVERY_MIN_INTERVAL_SECS):
+            self.assertEqual(device_module.lookupChannelName(self.account, channel_to_lookup), '999-1')
+            self.assertEqual(device_module.lookupDeviceName(self.account, 999), '999')
+        self.assertEqual(self.mock_vue.get_devices.call_count, 2)
+
+    @patch('vuegraf.device.logger')
+    def test_lookup_unknown_device_discovery_failure(self, mock_logger):
+        """Test that a failed discovery skips the unknown device."""
+        device_module.populateDevices(self.account)
+        self.account['name'] = 'Home'
+        self.account['lastDiscoverySecs'] = None
+        self.mock_vue.get_devices.side_effect = Exception('unavailable')
+
+        self.assertIsNone(device_module.lookupDeviceName(self.account, 999))
+
+        mock_logger.warning.assert_called_once_with('Failed to discover devices; account=Home; error=unavailable')
+        self.assertIn(123, self.account['deviceIdMap'])
+
+    def test_lookup_device_discovered_by_another_thread(self):
+        """Test that a device discovered while waiting for the discovery lock is not discovered again."""
+        with patch('vuegraf.device.isDeviceKnown', side_effect=[False, True]):
+            self.assertTrue(device_module.isDeviceDiscovered(self.account, 123))
+        self.mock_vue.get_devices.assert_not_called()
+
+    @patch('vuegraf.device.PyEmVue')  # Patch the class in the device module
+    def test_initDeviceAccount_cached_devices(self, mock_pyemvue_class):
+        """Test initializing the device account from cached devices, without discovering them."""
+        mock_instance = mock_pyemvue_class.return_value
+        config = {'apiRequestsPerSec': 0, 'apiAccountRequestsPerSec': 0, 'apiBurstRequests': 10,
+                  'apiMaxConcurrentRequests': 8, 'apiSlowRequestSecs': 10, 'tokenDir': None}
+        account_to_init = {'name': 'Init', 'email': 'init@example.com', 'password': 'newpassword'}
+
+        device_module.initDeviceAccount(config, account_to_init, [self.device1])
+
+        mock_instance.login.assert_called_once_with(username='init@example.com', password='newpassword', token_storage_file=None)
+        mock_instance.get_devices.assert_not_called()
+        self.assertEqual(account_to_init['deviceList'], [self.device1])
+        self.assertIn(123, account_to_init['deviceIdMap'])
+
     @patch('vuegraf.device.PyEmVue')  # Patch the class in the device module
     def test_initDeviceAccount_reinit(self, mock_pyemvue_class):
         """Test initializing the device account."""
@@ -335,6 +450,88 @@ class TestDeviceFunctions(unittest.TestCase):
         mock_pyemvue_class.assert_not_called()
         self.assertEqual(account_already_initted['vue'], 1)
 
+    @patch('vuegraf.device.PyEmVue')
+    def test_initDeviceAccount_saves_tokens(self, mock_pyemvue_class):
+        """Test that a password login saves the tokens to a file only the owner may read."""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            config = dict(LOGIN_CONFIG, tokenDir=os.path.join(tmp_dir, 'tokens'))
+            account_to_init = {'name': 'My Home/Cabin', 'email': 'init@example.com', 'password': 'newpassword'}
+
+            device_module.initDeviceAccount(config, account_to_init)
+
+            token_file = os.path.join(tmp_dir, 'tokens', 'My_Home_Cabin.json')
+            mock_pyemvue_class.return_value.login.assert_called_once_with(
+                username='init@example.com', password='newpassword', token_storage_file=token_file)
+            self.assertEqual(os.stat(token_file).st_mode & 0o777, 0o600)
+
+    @patch('vuegraf.device.PyEmVue')
+    def test_initDeviceAccount_saved_tokens(self, mock_pyemvue_class):
+        """Test that saved tokens are used instead of a password login."""
+        mock_instance = mock_pyemvue_class.return_value
+        mock_instance.login.return_value = True
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            config = dict(LOGIN_CONFIG, tokenDir=tmp_dir)
+            token_file = os.path.join(tmp_dir, 'Init.json')
+            with open(token_file, 'w') as f:
+                f.write('{}')
+            account_to_init = {'name': 'Init', 'email': 'init@example.com', 'password': 'newpassword'}
+
+            device_module.initDeviceAccount(config, account_to_init, [self.device1])
+
+        mock_instance.login.assert_called_once_with(token_storage_file=token_file)
+
+    @patch('vuegraf.device.logger')
+    @patch('vuegraf.device.PyEmVue')
+    def test_initDeviceAccount_saved_tokens_rejected(self, mock_pyemvue_class, mock_logger):
+        """Test that a password login follows when the saved tokens are rejected or unusable."""
+        for login_result, error in [(False, 'login rejected'), (Exception('expired'), 'expired')]:
+            mock_instance = mock_pyemvue_class.return_value
+            mock_instance.login.reset_mock()
+            mock_instance.login.side_effect = [login_result, True]
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                config = dict(LOGIN_CONFIG, tokenDir=tmp_dir)
+                token_file = os.path.join(tmp_dir, 'Init.json')
+                with open(token_file, 'w') as f:
+                    f.write('{}')
+                account_to_init = {'name': 'Init', 'email': 'init@example.com', 'password': 'newpassword'}
+
+                device_module.initDeviceAccount(config, account_to_init, [self.device1])
+
+            self.assertEqual(mock_instance.login.call_args_list[1].kwargs,
+                             {'username': 'init@example.com', 'password': 'newpassword', 'token_storage_file': token_file})
+            mock_logger.warning.assert_called_with(
+                'Unable to log in with saved tokens, logging in with password; account=Init; error={}'.format(error))
+
+    @patch('vuegraf.device.random.random', return_value=0.5)
+    @patch('vuegraf.device.time.sleep')
+    @patch('vuegraf.device.initDeviceAccount')
+    def test_initDeviceAccounts_staggers_password_logins(self, mock_init_device_account, mock_sleep, _mock_random):
+        """Test that accounts with saved tokens log in first, and password logins are staggered with jitter."""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with open(os.path.join(tmp_dir, 'Saved.json'), 'w') as f:
+                f.write('{}')
+            accounts = [{'name': 'First'}, {'name': 'Second'}, {'name': 'Saved'}, {'name': 'Ready', 'vue': MagicMock()}]
+            config = {'accounts': accounts, 'tokenDir': tmp_dir, 'loginStaggerSecs': 2}
+
+            device_module.initDeviceAccounts(config, {'Second': [self.device1]})
+
+        self.assertEqual([call.args[1]['name'] for call in mock_init_device_account.call_args_list],
+                         ['Saved', 'First', 'Second', 'Ready'])
+        mock_init_device_account.assert_any_call(config, accounts[1], [self.device1])
+        # Only the second password login waits
+        mock_sleep.assert_called_once_with(3.0)
+
+    @patch('vuegraf.device.time.sleep')
+    @patch('vuegraf.device.initDeviceAccount')
+    def test_initDeviceAccounts_without_stagger(self, mock_init_device_account, mock_sleep):
+        """Test that password logins are not staggered when loginStaggerSecs is 0."""
+        config = {'accounts': [{'name': 'First'}, {'name': 'Second'}], 'tokenDir': None, 'loginStaggerSecs': 0}
+
+        device_module.initDeviceAccounts(config, {})
+
+        self.assertEqual(mock_init_device_account.call_count, 2)
+        mock_sleep.assert_not_called()
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -3,12 +3,16 @@
 
 import copy
 import datetime
+import influxdb
 import influxdb_client
+import pytest
+import threading
 from unittest.mock import MagicMock, patch
 
 # Local imports
 from vuegraf import influx
 from vuegraf.collect import Point
+from vuegraf.points import PointBatch
 from vuegraf.time import getTimeNow
 
 # Sample config for testing
@@ -143,11 +147,10 @@ def test_get_last_db_timestamp_v1_no_data_minute(mock_influx_client):
         config, 'device', 'channel', '1m', start_time_initial, stop_time_initial, fill_in_missing_data_initial
     )
 
-    # Expect backfill for 7 days, batched to 12 hours
+    # Expect backfill for 7 days, with the stop time unchanged
     expected_start_time = start_time_initial - datetime.timedelta(days=7)
-    expected_stop_time = expected_start_time + datetime.timedelta(hours=12)
     assert start_time == expected_start_time
-    assert stop_time == expected_stop_time
+    assert stop_time == stop_time_initial
     assert fill_in_missing_data is True
     mock_influx_client.query.assert_called_once()
     assert "device_name = 'channel'" in mock_influx_client.query.call_args[0][0]
@@ -171,11 +174,10 @@ def test_get_last_db_timestamp_v1_no_data_second(mock_influx_client):
         config, 'device', 'channel', '1s', start_time_initial, stop_time_initial, fill_in_missing_data_initial
     )
 
-    # Expect backfill for 3 hours, batched to 1 hour
+    # Expect backfill for 3 hours, with the stop time unchanged
     expected_start_time = start_time_initial - datetime.timedelta(hours=3)
-    expected_stop_time = expected_start_time + datetime.timedelta(hours=1)
     assert start_time == expected_start_time
-    assert stop_time == expected_stop_time
+    assert stop_time == stop_time_initial
     assert fill_in_missing_data is True
     mock_influx_client.query.assert_called_once()
     assert "detail = '1s'" in mock_influx_client.query.call_args[0][0]
@@ -210,8 +212,8 @@ def test_get_last_db_timestamp_v1_recent_data_minute(mock_influx_client):
 
 
 @patch('influxdb.InfluxDBClient')
-def test_get_last_db_timestamp_v1_old_data_minute_batching(mock_influx_client):
-    """Test getLastDBTimeStamp for v1 with old minute data requiring batching."""
+def test_get_last_db_timestamp_v1_old_data_minute_whole_gap(mock_influx_client):
+    """Test getLastDBTimeStamp for v1 with old minute data, backfilling the whole gap."""
     config = copy.deepcopy(SAMPLE_CONFIG_V1)
     config['influx'] = mock_influx_client
     now = getTimeNow(datetime.UTC)
@@ -230,12 +232,11 @@ def test_get_last_db_timestamp_v1_old_data_minute_batching(mock_influx_client):
         config, 'device', 'channel', '1m', start_time_initial, stop_time_initial, fill_in_missing_data_initial
     )
 
-    # Expect start time 1 min after last record, stop time batched to 12 hours later
+    # Expect start time 1 min after last record, stop time unchanged
     expected_start_time = datetime.datetime.strptime(last_record_time_str, '%Y-%m-%dT%H:%M:%SZ')
     expected_start_time = expected_start_time.replace(tzinfo=datetime.timezone.utc) + datetime.timedelta(minutes=1)
-    expected_stop_time = expected_start_time + datetime.timedelta(hours=12)
     assert start_time == expected_start_time
-    assert stop_time == expected_stop_time
+    assert stop_time == stop_time_initial
     assert fill_in_missing_data is True
 
 
@@ -260,11 +261,10 @@ def test_get_last_db_timestamp_v1_very_old_data_minute_7_day_limit(mock_influx_c
         config, 'device', 'channel', '1m', start_time_initial, stop_time_initial, fill_in_missing_data_initial
     )
 
-    # Expect start time to be limited to 7 days ago, stop time batched to 12 hours later
+    # Expect start time to be limited to 7 days ago, stop time unchanged
     expected_start_time = stop_time_initial - datetime.timedelta(minutes=10080)  # 7 days
-    expected_stop_time = expected_start_time + datetime.timedelta(hours=12)
     assert start_time == expected_start_time
-    assert stop_time == expected_stop_time
+    assert stop_time == stop_time_initial
     assert fill_in_missing_data is True
 
 
@@ -327,8 +327,8 @@ def test_get_last_db_timestamp_v1_recent_data_second_no_batching(mock_influx_cli
 
 
 @patch('influxdb.InfluxDBClient')
-def test_get_last_db_timestamp_v1_old_data_second_batching(mock_influx_client):
-    """Test getLastDBTimeStamp for v1 with old second data requiring batching."""
+def test_get_last_db_timestamp_v1_old_data_second_whole_gap(mock_influx_client):
+    """Test getLastDBTimeStamp for v1 with old second data, backfilling the whole gap."""
     config = copy.deepcopy(SAMPLE_CONFIG_V1)
     config['influx'] = mock_influx_client
     now = getTimeNow(datetime.UTC)
@@ -347,12 +347,11 @@ def test_get_last_db_timestamp_v1_old_data_second_batching(mock_influx_client):
         config, 'device', 'channel', '1s', start_time_initial, stop_time_initial, fill_in_missing_data_initial
     )
 
-    # Expect start time 1 sec after last record, stop time batched to 1 hour later
+    # Expect start time 1 sec after last record, stop time unchanged
     expected_start_time = datetime.datetime.strptime(last_record_time_str, '%Y-%m-%dT%H:%M:%SZ')
     expected_start_time = expected_start_time.replace(tzinfo=datetime.timezone.utc) + datetime.timedelta(seconds=1)
-    expected_stop_time = expected_start_time + datetime.timedelta(hours=1)
     assert start_time == expected_start_time.replace(microsecond=0)
-    assert stop_time == expected_stop_time.replace(microsecond=0)
+    assert stop_time == stop_time_initial
     assert fill_in_missing_data is True
 
 
@@ -377,11 +376,10 @@ def test_get_last_db_timestamp_v1_very_old_data_second_3_hour_limit(mock_influx_
         config, 'device', 'channel', '1s', start_time_initial, stop_time_initial, fill_in_missing_data_initial
     )
 
-    # Expect start time limited to 3 hours ago, stop time batched to 1 hour later
+    # Expect start time limited to 3 hours ago, stop time unchanged
     expected_start_time = stop_time_initial - datetime.timedelta(hours=3)
-    expected_stop_time = expected_start_time + datetime.timedelta(hours=1)
     assert start_time == expected_start_time.replace(microsecond=0)
-    assert stop_time == expected_stop_time.replace(microsecond=0)
+    assert stop_time == stop_time_initial
     assert fill_in_missing_data is True
 
 
@@ -452,11 +450,10 @@ def test_get_last_db_timestamp_v2_no_data_minute(mock_influx_client_class):
         config, 'device', 'channel', '1m', start_time_initial, stop_time_initial, fill_in_missing_data_initial
     )
 
-    # Expect backfill for 7 days, batched to 12 hours
+    # Expect backfill for 7 days, with the stop time unchanged
     expected_start_time = start_time_initial - datetime.timedelta(days=7)
-    expected_stop_time = expected_start_time + datetime.timedelta(hours=12)
     assert start_time == expected_start_time
-    assert stop_time == expected_stop_time
+    assert stop_time == stop_time_initial
     assert fill_in_missing_data is True
     mock_query_api.query.assert_called_once()
     query_str = mock_query_api.query.call_args[0][0]
@@ -486,11 +483,10 @@ def test_get_last_db_timestamp_v2_no_data_second(mock_influx_client_class):
         config, 'device', 'channel', '1s', start_time_initial, stop_time_initial, fill_in_missing_data_initial
     )
 
-    # Expect backfill for 3 hours, batched to 1 hour
+    # Expect backfill for 3 hours, with the stop time unchanged
     expected_start_time = start_time_initial - datetime.timedelta(hours=3)
-    expected_stop_time = expected_start_time + datetime.timedelta(hours=1)
     assert start_time == expected_start_time
-    assert stop_time == expected_stop_time
+    assert stop_time == stop_time_initial
     assert fill_in_missing_data is True
     mock_query_api.query.assert_called_once()
     query_str = mock_query_api.query.call_args[0][0]
@@ -529,8 +525,8 @@ def test_get_last_db_timestamp_v2_recent_data_minute(mock_influx_client_class):
 
 
 @patch('influxdb_client.InfluxDBClient')
-def test_get_last_db_timestamp_v2_old_data_minute_batching(mock_influx_client_class):
-    """Test getLastDBTimeStamp for v2 with old minute data requiring batching."""
+def test_get_last_db_timestamp_v2_old_data_minute_whole_gap(mock_influx_client_class):
+    """Test getLastDBTimeStamp for v2 with old minute data, backfilling the whole gap."""
     config = copy.deepcopy(SAMPLE_CONFIG_V2)
     mock_influx_instance = MagicMock()
     mock_query_api = MagicMock()
@@ -553,11 +549,10 @@ def test_get_last_db_timestamp_v2_old_data_minute_batching(mock_influx_client_cl
         config, 'device', 'channel', '1m', start_time_initial, stop_time_initial, fill_in_missing_data_initial
     )
 
-    # Expect start time 1 min after last record, stop time batched to 12 hours later
+    # Expect start time 1 min after last record, stop time unchanged
     expected_start_time = last_record_time.replace(tzinfo=datetime.timezone.utc) + datetime.timedelta(minutes=1)
-    expected_stop_time = expected_start_time + datetime.timedelta(hours=12)
     assert start_time == expected_start_time
-    assert stop_time == expected_stop_time
+    assert stop_time == stop_time_initial
     assert fill_in_missing_data is True
 
 
@@ -586,11 +581,10 @@ def test_get_last_db_timestamp_v2_very_old_data_minute_7_day_limit(mock_influx_c
         config, 'device', 'channel', '1m', start_time_initial, stop_time_initial, fill_in_missing_data_initial
     )
 
-    # Expect start time to be limited to 7 days ago, stop time batched to 12 hours later
+    # Expect start time to be limited to 7 days ago, stop time unchanged
     expected_start_time = stop_time_initial - datetime.timedelta(minutes=10080)  # 7 days
-    expected_stop_time = expected_start_time + datetime.timedelta(hours=12)
     assert start_time == expected_start_time
-    assert stop_time == expected_stop_time
+    assert stop_time == stop_time_initial
     assert fill_in_missing_data is True
 
 
@@ -681,8 +675,8 @@ def test_get_last_db_timestamp_v2_recent_1s_data(mock_influx_client_class):
 
 
 @patch('influxdb_client.InfluxDBClient')
-def test_get_last_db_timestamp_v2_old_data_second_batching(mock_influx_client_class):
-    """Test getLastDBTimeStamp for v2 with old second data requiring batching."""
+def test_get_last_db_timestamp_v2_old_data_second_whole_gap(mock_influx_client_class):
+    """Test getLastDBTimeStamp for v2 with old second data, backfilling the whole gap."""
     config = copy.deepcopy(SAMPLE_CONFIG_V2)
     config['detailedIntervalSecs'] = 1800
     mock_influx_instance = MagicMock()
@@ -706,17 +700,16 @@ def test_get_last_db_timestamp_v2_old_data_second_batching(mock_influx_client_cl
         config, 'device', 'channel', '1s', start_time_initial, stop_time_initial, fill_in_missing_data_initial
     )
 
-    # Expect start time 1 sec after last record, stop time batched to 1 hour later
+    # Expect start time 1 sec after last record, stop time unchanged
     expected_start_time = last_record_time.replace(tzinfo=datetime.timezone.utc) + datetime.timedelta(seconds=1)
-    expected_stop_time = expected_start_time + datetime.timedelta(hours=1)
     assert start_time == expected_start_time.replace(microsecond=0)
-    assert stop_time == expected_stop_time.replace(microsecond=0)
+    assert stop_time == stop_time_initial
     assert fill_in_missing_data is True
 
 
 @patch('influxdb_client.InfluxDBClient')
 def test_get_last_db_timestamp_v2_very_old_data_second_3_hour_limit(mock_influx_client_class):
-    """Test getLastDBTimeStamp for v2 with very old second data hitting 3-hour limit."""
+    """Test getLastDBTimeStamp for v2 with very old second data hitting 3-hour limit, even with a long detailedIntervalSecs."""
     config = copy.deepcopy(SAMPLE_CONFIG_V2)
     config['detailedIntervalSecs'] = 7200
     mock_influx_instance = MagicMock()
@@ -740,11 +733,10 @@ def test_get_last_db_timestamp_v2_very_old_data_second_3_hour_limit(mock_influx_
         config, 'device', 'channel', '1s', start_time_initial, stop_time_initial, fill_in_missing_data_initial
     )
 
-    # Expect start time limited to 1 hours ago due to detailedIntervalSecs>=3600
-    expected_start_time = stop_time_initial - datetime.timedelta(hours=1)
-    expected_stop_time = expected_start_time + datetime.timedelta(hours=1)
+    # Expect start time limited to 3 hours ago, every hour Emporia still keeps
+    expected_start_time = stop_time_initial - datetime.timedelta(hours=3)
     assert start_time == expected_start_time.replace(microsecond=0)
-    assert stop_time == expected_stop_time.replace(microsecond=0)
+    assert stop_time == stop_time_initial
     assert fill_in_missing_data is True
 
 
@@ -803,6 +795,297 @@ def test_get_last_db_timestamp_v2_unsupported_pointtype(mock_influx_client_class
     assert f'r.detail == "{unsupported_point_type}"' in query_str
 
 
+# --- Test getLastDBTimeStamps ---
+
+def _mock_v1_result_set(series):
+    """Builds a mock InfluxDB v1 ResultSet containing one group per (tags, time) entry."""
+    result = MagicMock()
+    result.items.return_value = [(('energy_usage', tags), iter([{'time': timeStr, 'last': 1.0}])) for tags, timeStr in series]
+    return result
+
+
+@patch('influxdb.InfluxDBClient')
+def test_get_last_db_timestamps_v1(mock_influx_client):
+    """Test getLastDBTimeStamps for v1 returns one entry per grouped series from a single query."""
+    config = copy.deepcopy(SAMPLE_CONFIG_V1)
+    config['influx'] = mock_influx_client
+    mock_influx_client.query.return_value = _mock_v1_result_set([
+        ({'device_name': 'channel1', 'detail': '1m'}, '2024-01-01T10:00:00Z'),
+        ({'device_name': 'channel2', 'detail': '1s'}, '2024-01-01T10:00:05.123456Z'),
+    ])
+
+    last_timestamps = influx.getLastDBTimeStamps(config, ['1m', '1s'])
+
+    mock_influx_client.query.assert_called_once()
+    query = mock_influx_client.query.call_args[0][0]
+    assert "detail = '1m' OR detail = '1s'" in query
+    assert query.endswith('group by device_name, detail')
+    assert last_timestamps == {
+        (None, 'channel1', '1m'): datetime.datetime(2024, 1, 1, 10, 0, 0, tzinfo=datetime.timezone.utc),
+        (None, 'channel2', '1s'): datetime.datetime(2024, 1, 1, 10, 0, 5, tzinfo=datetime.timezone.utc),
+    }
+
+
+@patch('influxdb.InfluxDBClient')
+def test_get_last_db_timestamps_v1_with_station(mock_influx_client):
+    """Test getLastDBTimeStamps for v1 groups by station when the station field is enabled."""
+    config = copy.deepcopy(SAMPLE_CONFIG_V1)
+    config['addStationField'] = True
+    config['influx'] = mock_influx_client
+    mock_influx_client.query.return_value = _mock_v1_result_set([
+        ({'device_name': 'channel1', 'detail': '1m', 'station_name': 'device'}, '2024-01-01T10:00:00Z'),
+    ])
+
+    last_timestamps = influx.getLastDBTimeStamps(config, ['1m'])
+
+    assert mock_influx_client.query.call_args[0][0].endswith('group by device_name, detail, station_name')
+    assert last_timestamps == {
+        ('device', 'channel1', '1m'): datetime.datetime(2024, 1, 1, 10, 0, 0, tzinfo=datetime.timezone.utc),
+    }
+
+
+def _mock_flux_table(records):
+    table = MagicMock()
+    table.records = records
+    return table
+
+
+@patch('influxdb_client.InfluxDBClient')
+def test_get_last_db_timestamps_v2(mock_influx_client_class):
+    """Test getLastDBTimeStamps for v2 returns one entry per grouped table from a single query."""
+    config = copy.deepcopy(SAMPLE_CONFIG_V2)
+    mock_query_api = MagicMock()
+    config['influx'] = mock_influx_client_class
+    config['influx'].query_api.return_value = mock_query_api
+    last_time = datetime.datetime(2024, 1, 1, 10, 0, 0, tzinfo=datetime.timezone.utc)
+    mock_query_api.query.return_value = [
+        _mock_flux_table([{'_time': last_time, 'device_name': 'channel1', 'detail': '1m'}]),
+        _mock_flux_table([{'_time': last_time, 'device_name': 'channel2', 'detail': '1m'}]),
+    ]
+
+    last_timestamps = influx.getLastDBTimeStamps(config, ['1m', '1s'])
+
+    mock_query_api.query.assert_called_once()
+    query = mock_query_api.query.call_args[0][0]
+    assert '(r.detail == "1m" or r.detail == "1s")' in query
+    assert '|> group(columns: ["device_name", "detail"])' in query
+    assert last_timestamps == {
+        (None, 'channel1', '1m'): last_time,
+        (None, 'channel2', '1m'): last_time,
+    }
+
+
+@patch('influxdb_client.InfluxDBClient')
+def test_get_last_db_timestamps_v2_with_station(mock_influx_client_class):
+    """Test getLastDBTimeStamps for v2 groups by station when the station field is enabled."""
+    config = copy.deepcopy(SAMPLE_CONFIG_V2)
+    config['addStationField'] = True
+    mock_query_api = MagicMock()
+    config['influx'] = mock_influx_client_class
+    config['influx'].query_api.return_value = mock_query_api
+    last_time = datetime.datetime(2024, 1, 1, 10, 0, 0, tzinfo=datetime.timezone.utc)
+    mock_query_api.query.return_value = [
+        _mock_flux_table([{'_time': last_time, 'device_name': 'channel1', 'detail': '1s', 'station_name': 'device'}]),
+    ]
+
+    last_timestamps = influx.getLastDBTimeStamps(config, ['1s'])
+
+    assert '|> group(columns: ["device_name", "detail", "station_name"])' in mock_query_api.query.call_args[0][0]
+    assert last_timestamps == {('device', 'channel1', '1s'): last_time}
+
+
+@patch('influxdb.InfluxDBClient')
+def test_get_history_coverage_v1(mock_influx_client):
+    """Test getHistoryCoverage for v1 counts the points of each series by local day in a single query."""
+    config = copy.deepcopy(SAMPLE_CONFIG_V1)
+    config['addStationField'] = True
+    config['timezone'] = 'America/New_York'
+    config['influx'] = mock_influx_client
+    result = MagicMock()
+    result.items.return_value = [
+        (('energy_usage', {'device_name': 'channel1', 'detail': '1h', 'station_name': 'device'}),
+         iter([{'time': '2024-01-01T00:00:00-05:00', 'count': 24}, {'time': '2024-01-02T00:00:00-05:00', 'count': 3}])),
+        (('energy_usage', {'device_name': 'channel1', 'detail': '1d', 'station_name': 'device'}),
+         iter([{'time': '2024-01-01T00:00:00-05:00', 'count': 1}])),
+    ]
+    mock_influx_client.query.return_value = result
+    start = datetime.datetime(2024, 1, 1, 5, 0, 0, tzinfo=datetime.timezone.utc)
+    stop = datetime.datetime(2024, 1, 3, 4, 59, 59, tzinfo=datetime.timezone.utc)
+
+    coverage = influx.getHistoryCoverage(config, start, stop)
+
+    mock_influx_client.query.assert_called_once()
+    query = mock_influx_client.query.call_args[0][0]
+    assert "(detail = '1h' OR detail = '1d')" in query
+    assert "time >= '2024-01-01T05:00:00Z' and time <= '2024-01-03T04:59:59Z'" in query
+    assert query.endswith("group by time(1d), device_name, detail, station_name fill(none) tz('America/New_York')")
+    assert coverage == {
+        ('device', 'channel1', '1h'): {datetime.date(2024, 1, 1): 24, datetime.date(2024, 1, 2): 3},
+        ('device', 'channel1', '1d'): {datetime.date(2024, 1, 1): 1},
+    }
+
+
+@patch('influxdb_client.InfluxDBClient')
+def test_get_history_coverage_v2(mock_influx_client_class):
+    """Test getHistoryCoverage for v2 counts the points of each series by day in a single query, in UTC by default."""
+    config = copy.deepcopy(SAMPLE_CONFIG_V2)
+    mock_query_api = MagicMock()
+    config['influx'] = mock_influx_client_class
+    config['influx'].query_api.return_value = mock_query_api
+    day_start = datetime.datetime(2024, 1, 1, 0, 0, 0, tzinfo=datetime.timezone.utc)
+    mock_query_api.query.return_value = [
+        _mock_flux_table([{'_time': day_start, '_value': 24, 'device_name': 'channel1', 'detail': '1h'},
+                          {'_time': day_start + datetime.timedelta(days=1), '_value': 20, 'device_name': 'channel1', 'detail': '1h'}]),
+        _mock_flux_table([{'_time': day_start, '_value': 1, 'device_name': 'channel2', 'detail': '1d'}]),
+    ]
+
+    coverage = influx.getHistoryCoverage(config, day_start, day_start + datetime.timedelta(days=2, seconds=-1))
+
+    mock_query_api.query.assert_called_once()
+    query = mock_query_api.query.call_args[0][0]
+    assert 'option location = timezone.location(name: "UTC")' in query
+    assert '|> range(start: 2024-01-01T00:00:00Z, stop: 2024-01-03T00:00:00Z)' in query
+    assert '(r.detail == "1h" or r.detail == "1d")' in query
+    assert '|> group(columns: ["device_name", "detail"])' in query
+    assert '|> aggregateWindow(every: 1d, fn: count, timeSrc: "_start", createEmpty: false)' in query
+    assert coverage == {
+        (None, 'channel1', '1h'): {datetime.date(2024, 1, 1): 24, datetime.date(2024, 1, 2): 20},
+        (None, 'channel2', '1d'): {datetime.date(2024, 1, 1): 1},
+    }
+
+
+def test_get_last_db_timestamp_uses_last_timestamps():
+    """Test getLastDBTimeStamp reads the bulk lookup instead of querying Influx."""
+    config = copy.deepcopy(SAMPLE_CONFIG_V2)
+    config['influx'] = MagicMock()
+    now = getTimeNow(datetime.UTC)
+    last_record = now - datetime.timedelta(hours=1)
+    last_timestamps = {(None, 'channel', '1m'): last_record}
+
+    start_time, stop_time, fill_in_missing_data = influx.getLastDBTimeStamp(
+        config, 'device', 'channel', '1m', now, now, False, last_timestamps
+    )
+
+    config['influx'].query_api.assert_not_called()
+    assert fill_in_missing_data is True
+    assert start_time == last_record.replace(microsecond=0) + datetime.timedelta(minutes=1)
+    assert stop_time == now
+
+
+def test_get_last_db_timestamp_uses_last_timestamps_missing_series():
+    """Test getLastDBTimeStamp treats a series absent from the bulk lookup as having no data."""
+    config = copy.deepcopy(SAMPLE_CONFIG_V1)
+    config['addStationField'] = True
+    config['influx'] = MagicMock()
+    now = getTimeNow(datetime.UTC)
+    last_timestamps = {(None, 'channel', '1s'): now}
+
+    start_time, stop_time, fill_in_missing_data = influx.getLastDBTimeStamp(
+        config, 'device', 'channel', '1s', now, now, False, last_timestamps
+    )
+
+    config['influx'].query.assert_not_called()
+    assert fill_in_missing_data is True
+    assert start_time == now - datetime.timedelta(hours=3)
+    assert stop_time == now
+
+
+# --- Test watermark cache ---
+
+@patch('vuegraf.influx.getLastDBTimeStamps')
+def test_get_cached_last_db_timestamps_seeds_once(mock_get_last_db_timestamps):
+    """Test the watermark cache only queries Influx for detail tags it has not seeded yet."""
+    config = copy.deepcopy(SAMPLE_CONFIG_V1)
+    seeded_time = datetime.datetime(2024, 1, 1, 10, 0, 0, tzinfo=datetime.timezone.utc)
+    mock_get_last_db_timestamps.return_value = {(None, 'channel', '1m'): seeded_time}
+
+    assert influx.getCachedLastDBTimeStamps(config, ['1m']) == {(None, 'channel', '1m'): seeded_time}
+    assert influx.getCachedLastDBTimeStamps(config, ['1m']) == {(None, 'channel', '1m'): seeded_time}
+    mock_get_last_db_timestamps.assert_called_once_with(config, ['1m'])
+
+    mock_get_last_db_timestamps.return_value = {}
+    influx.getCachedLastDBTimeStamps(config, ['1m', '1s'])
+    mock_get_last_db_timestamps.assert_called_with(config, ['1s'])
+    assert mock_get_last_db_timestamps.call_count == 2
+
+
+@pytest.mark.parametrize('asBatch', [False, True])
+def test_update_watermarks_keeps_newest_per_series(asBatch):
+    """Test written points advance the watermark of their series but never move it backwards."""
+    config = copy.deepcopy(SAMPLE_CONFIG_V1)
+    config['addStationField'] = True
+    older = datetime.datetime(2024, 1, 1, 10, 0, 0, tzinfo=datetime.timezone.utc)
+    newer = older + datetime.timedelta(minutes=1)
+    influx.getWatermarks(config)['timestamps'][('device', 'channel2', '1m')] = newer
+
+    points = [
+        Point('account', 'device', 'channel1', 1, newer, '1m'),
+        Point('account', 'device', 'channel1', 1, older, '1m'),
+        Point('account', 'device', 'channel2', 1, older, '1m'),
+    ]
+    influx.updateWatermarks(config, PointBatch(points) if asBatch else points)
+
+    assert influx.getWatermarks(config)['timestamps'] == {
+        ('device', 'channel1', '1m'): newer,
+        ('device', 'channel2', '1m'): newer,
+    }
+
+
+@patch('vuegraf.influx.getLastDBTimeStamps')
+def test_write_influx_points_advances_watermarks(mock_get_last_db_timestamps):
+    """Test a successful write feeds the watermark cache, so the next cycle does not query Influx."""
+    config = copy.deepcopy(SAMPLE_CONFIG_V1)
+    config['influx'] = MagicMock()
+    mock_get_last_db_timestamps.return_value = {}
+    influx.getCachedLastDBTimeStamps(config, ['1m'])
+    timestamp = datetime.datetime(2024, 1, 1, 10, 0, 0, tzinfo=datetime.timezone.utc)
+
+    influx.writeInfluxPoints(config, [Point('account', 'device', 'channel', 1, timestamp, '1m')])
+
+    assert influx.getCachedLastDBTimeStamps(config, ['1m']) == {(None, 'channel', '1m'): timestamp}
+    mock_get_last_db_timestamps.assert_called_once()
+
+
+def test_write_influx_points_failure_invalidates_watermarks():
+    """Test a failed write clears the watermark cache and propagates the error."""
+    config = copy.deepcopy(SAMPLE_CONFIG_V1)
+    config['influx'] = MagicMock()
+    config['influx'].write_points.side_effect = ConnectionError('influx down')
+    watermarks = influx.getWatermarks(config)
+    watermarks['pointTypes'].add('1m')
+    lastTimestamp = getTimeNow(datetime.UTC)
+    watermarks['timestamps'][(None, 'channel', '1m')] = lastTimestamp
+    # As held by collection still running while the writer thread writes
+    lastTimestamps = watermarks['timestamps']
+
+    with pytest.raises(ConnectionError):
+        influx.writeInfluxPoints(config, [Point('account', 'device', 'channel', 1, getTimeNow(datetime.UTC), '1m')])
+
+    assert watermarks['pointTypes'] == set()
+    assert watermarks['timestamps'] == {}
+    # Collection still running keeps its watermarks, rather than backfilling every series from scratch
+    assert lastTimestamps == {(None, 'channel', '1m'): lastTimestamp}
+
+
+@patch('vuegraf.influx.getLastDBTimeStamps')
+def test_get_cached_last_db_timestamps_seeds_once_in_parallel(mock_get_last_db_timestamps):
+    """Test parallel lookups on a cold start query Influx only once."""
+    config = copy.deepcopy(SAMPLE_CONFIG_V1)
+    querying = threading.Event()
+    release = threading.Event()
+    mock_get_last_db_timestamps.side_effect = lambda config, pointTypes: querying.set() or release.wait(5) and {}
+
+    threads = [threading.Thread(target=influx.getCachedLastDBTimeStamps, args=(config, ['1m'])) for _ in range(2)]
+    threads[0].start()
+    assert querying.wait(5)
+    threads[1].start()
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    mock_get_last_db_timestamps.assert_called_once_with(config, ['1m'])
+
+
 # --- Test initInfluxConnection ---
 
 @patch('influxdb.InfluxDBClient')
@@ -975,6 +1258,10 @@ def test_init_influx_connection_v2_reset(mock_get_time_now, mock_influx_client_c
 
 # --- Test writeInfluxPoints ---
 
+WRITE_TIMESTAMP = datetime.datetime(2024, 1, 1, 10, 0, 0, tzinfo=datetime.timezone.utc)
+WRITE_LINE = 'energy_usage,account_name=account,detail=1m,device_name=channel usage=1i 1704103200000000000'
+
+
 @patch('vuegraf.influx.dumpPoints')
 @patch('influxdb.InfluxDBClient')
 def test_write_influx_points_v1(mock_influx_client_class, mock_dump_points):
@@ -982,23 +1269,11 @@ def test_write_influx_points_v1(mock_influx_client_class, mock_dump_points):
     config = copy.deepcopy(SAMPLE_CONFIG_V1)
     mock_influx_instance = MagicMock()
     config['influx'] = mock_influx_instance
-    points = [Point('account', 'device', 'channel', 1, 'time', '1m')]
-    influx_points = [
-      {
-        'measurement': 'energy_usage',
-        'tags': {
-          'account_name': 'account',
-          'device_name': 'channel',
-          'detail': '1m'
-        },
-        'fields': {'usage': 1},
-        'time': 'time'
-      }
-    ]
+    points = [Point('account', 'device', 'channel', 1, WRITE_TIMESTAMP, '1m')]
 
     influx.writeInfluxPoints(config, points)
 
-    mock_influx_instance.write_points.assert_called_once_with(influx_points, batch_size=5000)
+    mock_influx_instance.write_points.assert_called_once_with([WRITE_LINE], batch_size=5000, protocol='line')
     mock_dump_points.assert_not_called()
 
 
@@ -1012,17 +1287,17 @@ def test_write_influx_points_v2(mock_influx_client_class, mock_dump_points):
     mock_write_api = MagicMock()
     mock_influx_instance.write_api.return_value = mock_write_api
     config['influx'] = mock_influx_instance
-    # Create input capture.Point and output influx Point v2 objects.
+    # Create input capture.Point objects and the equivalent line protocol produced by influxdb_client.
     points = [
-      Point('account', 'device', 'channel1', 1, 'time', '1m'),
-      Point('account', 'device', 'channel2', 2, 'time', '1m'),
+      Point('account', 'device', 'channel1', 1, WRITE_TIMESTAMP, '1m'),
+      Point('account', 'device', 'channel2', 2.5, WRITE_TIMESTAMP, '1m'),
     ]
-    influx_points = [influx.createDataPoint(config, pt) for pt in points]
+    record = '\n'.join(influx.createDataPoint(config, pt).to_line_protocol() for pt in points).encode('utf-8')
 
     influx.writeInfluxPoints(config, points)
 
     mock_influx_instance.write_api.assert_called_once_with(write_options='SYNCHRONOUS')
-    mock_write_api.write.assert_called_once_with(bucket='vuegraf', record=influx_points)
+    mock_write_api.write.assert_called_once_with(bucket='vuegraf', record=record)
     mock_dump_points.assert_not_called()
 
 
@@ -1036,7 +1311,7 @@ def test_write_influx_points_dryrun(mock_influx_v2, mock_influx_v1, mock_dump_po
     config_v1['args'] = MagicMock(debug=False, dryrun=True, resetdatabase=False)
     mock_influx_instance_v1 = MagicMock()
     config_v1['influx'] = mock_influx_instance_v1
-    points = [Point('account', 'device', 'channel', 1, 'time', '1m')]
+    points = [Point('account', 'device', 'channel', 1, WRITE_TIMESTAMP, '1m')]
     influx.writeInfluxPoints(config_v1, points)
     mock_influx_instance_v1.write_points.assert_not_called()
 
@@ -1062,64 +1337,35 @@ def test_write_influx_points_debug(mock_influx_client_class, mock_dump_points):
     config['args'] = MagicMock(debug=True, dryrun=False, resetdatabase=False)  # Enable debug
     mock_influx_instance = MagicMock()
     config['influx'] = mock_influx_instance
-    points = [Point('account', 'device', 'channel', 1, 'time', '1m')]
-    influx_points = [
-      {
-        'measurement': 'energy_usage',
-        'tags': {
-          'account_name': 'account',
-          'device_name': 'channel',
-          'detail': '1m'
-        },
-        'fields': {'usage': 1},
-        'time': 'time'
-      }
-    ]
+    points = [Point('account', 'device', 'channel', 1, WRITE_TIMESTAMP, '1m')]
 
     influx.writeInfluxPoints(config, points)
 
-    mock_influx_instance.write_points.assert_called_once_with(influx_points, batch_size=5000)
-    mock_dump_points.assert_called_once_with(config, "Sending to database", influx_points)
+    mock_influx_instance.write_points.assert_called_once_with([WRITE_LINE], batch_size=5000, protocol='line')
+    mock_dump_points.assert_called_once_with("Sending to database", [WRITE_LINE])
 
 
 # --- Test dumpPoints ---
 
 @patch('vuegraf.influx.logger')
-@patch('pprint.pformat')
-def test_dump_points_v1(mock_pformat, mock_logger):
-    """Test dumpPoints for v1."""
-    config = copy.deepcopy(SAMPLE_CONFIG_V1)
-    points = [
-        {'measurement': 'm1', 'fields': {'f1': 1}},
-        {'measurement': 'm2', 'tags': {'t1': 'v1'}, 'fields': {'f2': 2.0}}
-    ]
-    mock_pformat.side_effect = lambda p: f"formatted_{p['measurement']}"  # Simulate pformat output
-
-    influx.dumpPoints(config, "Test Label V1", points)
-
-    mock_logger.debug.assert_any_call("Test Label V1")
-    mock_logger.debug.assert_any_call("  formatted_m1")
-    mock_logger.debug.assert_any_call("  formatted_m2")
-    assert mock_logger.debug.call_count == 3
-    mock_pformat.assert_any_call(points[0])
-    mock_pformat.assert_any_call(points[1])
-
-
-@patch('vuegraf.influx.logger')
-def test_dump_points_v2(mock_logger):
-    """Test dumpPoints for v2."""
-    config = copy.deepcopy(SAMPLE_CONFIG_V2)
-    mock_point1 = MagicMock(spec=influxdb_client.Point)
-    mock_point1.to_line_protocol.return_value = "point1_line_protocol"
-    mock_point2 = MagicMock(spec=influxdb_client.Point)
-    mock_point2.to_line_protocol.return_value = "point2_line_protocol"
-    points = [mock_point1, mock_point2]
-
-    influx.dumpPoints(config, "Test Label V2", points)
+def test_dump_points(mock_logger):
+    """Test dumpPoints logs each line."""
+    influx.dumpPoints("Test Label", ["point1_line_protocol", "point2_line_protocol"])
 
-    mock_logger.debug.assert_any_call("Test Label V2")
+    mock_logger.debug.assert_any_call("Test Label")
     mock_logger.debug.assert_any_call("  point1_line_protocol")
     mock_logger.debug.assert_any_call("  point2_line_protocol")
     assert mock_logger.debug.call_count == 3
-    mock_point1.to_line_protocol.assert_called_once()
-    mock_point2.to_line_protocol.assert_called_once()
+
+
+@pytest.mark.parametrize('exc, rejected', [
+    (influxdb_client.rest.ApiException(status=400), True),
+    (influxdb_client.rest.ApiException(status=429), False),
+    (influxdb_client.rest.ApiException(status=503), False),
+    (influxdb_client.rest.ApiException(), False),
+    (influxdb.exceptions.InfluxDBClientError('not found', 404), True),
+    (influxdb.exceptions.InfluxDBServerError('unavailable'), False),
+    (ConnectionError('influx down'), False),
+])
+def test_is_rejected_write(exc, rejected):
+    assert influx.isRejectedWrite(exc) is rejected
@@ -0,0 +1,112 @@
+# Copyright (c) Jason Ertel (jertel).
+# This file is part of the Vuegraf project and is made available under the MIT License.
+
+import datetime
+
+import numpy
+import pytest
+
+from vuegraf import influx
+from vuegraf.collect import Point
+from vuegraf.lineprotocol import LineProtocolEncoder, getLineProtocolEncoder
+from vuegraf.points import PointBatch, fromNanoseconds, toNanoseconds
+
+
+TIMESTAMP = datetime.datetime(2024, 1, 1, 10, 0, 0, 123456, tzinfo=datetime.timezone.utc)
+
+
+SAMPLE_CONFIG = {
+    'influxDb': {'version': 2},
+    'addStationField': False,
+}
+
+
+@pytest.mark.parametrize('addStationField', [False, True])
+@pytest.mark.parametrize('pt', [
+    Point('account', 'device', 'channel', 100.5, TIMESTAMP, 'False'),
+    Point('account', 'device', 'channel', 100.0, TIMESTAMP, 'True'),
+    Point('account', 'device', 'channel', 7, TIMESTAMP, 'Hour'),
+    Point('my account', 'garage, west', 'a=b\\', 1e-07, TIMESTAMP, 'Day'),
+    Point('account', 'device', 'line\nbreak\ttab\r', -3.25, TIMESTAMP.replace(tzinfo=None), 'False'),
+    Point('account', '', 'channel', 1.5, TIMESTAMP.astimezone(datetime.timezone(datetime.timedelta(hours=-5))), 'False'),
+])
+def test_encode_lines_matches_influxdb_client(addStationField, pt):
+    config = dict(SAMPLE_CONFIG, addStationField=addStationField)
+    expected = influx.createDataPoint(config, pt).to_line_protocol()
+
+    assert LineProtocolEncoder('detailed', addStationField).encodeLines([pt]) == [expected]
+
+
+@pytest.mark.parametrize('watts', [float('nan'), float('inf')])
+def test_encode_lines_skips_unstorable_values(watts):
+    encoder = LineProtocolEncoder('detailed', False)
+    points = [Point('account', 'device', 'channel', watts, TIMESTAMP, 'False'),
+              Point('account', 'device', 'channel', 2.0, TIMESTAMP, 'False')]
+
+    assert encoder.encodeLines(points) == [
+        'energy_usage,account_name=account,detailed=False,device_name=channel usage=2 1704103200123456000'
+    ]
+
+
+def test_encode_lines_boolean_usage():
+    encoder = LineProtocolEncoder('detailed', False)
+    pt = Point('account', 'device', 'channel', True, TIMESTAMP, 'False')
+
+    assert encoder.encodeLines([pt]) == [influx.createDataPoint(dict(SAMPLE_CONFIG), pt).to_line_protocol()]
+
+
+def test_encode_lines_caches_series():
+    encoder = LineProtocolEncoder('detailed', False)
+    points = [Point('account', 'device1', 'channel', 1.5, TIMESTAMP, 'False'),
+              Point('account', 'device2', 'channel', 2.5, TIMESTAMP, 'False'),
+              Point('account', 'device1', 'channel', 3.5, TIMESTAMP, 'True')]
+
+    lines = encoder.encodeLines(points)
+
+    # Without the station field both devices' channels belong to the same series
+    assert len(encoder.seriesPrefixes) == 2
+    assert lines[0].startswith(encoder.seriesPrefixes[('account', None, 'channel', 'False')])
+    assert lines[1].startswith(encoder.seriesPrefixes[('account', None, 'channel', 'False')])
+
+
+def test_get_line_protocol_encoder_is_cached():
+    config = dict(SAMPLE_CONFIG, addStationField=True, influxDb={'tagName': 'detail'})
+
+    encoder = getLineProtocolEncoder(config)
+
+    assert encoder.tagName == 'detail'
+    assert encoder.addStationField is True
+    assert getLineProtocolEncoder(config) is encoder
+
+
+@pytest.mark.parametrize('asArrays', [False, True])
+def test_encode_batch_of_series_matches_encode_lines(asArrays):
+    encoder = LineProtocolEncoder('detailed', True)
+    nanoseconds = [toNanoseconds(TIMESTAMP), toNanoseconds(TIMESTAMP) + 1_000_000_000, toNanoseconds(TIMESTAMP) + 2_000_000_000]
+    watts = [100.5, float('nan'), 7.0]
+    points = [Point('account', 'garage, west', 'channel', value, fromNanoseconds(timestamp), 'True')
+              for timestamp, value in zip(nanoseconds, watts)]
+    if asArrays:
+        nanoseconds, watts = numpy.array(nanoseconds), numpy.array(watts)
+    batch = PointBatch()
+    batch.addSeries('account', 'garage, west', 'channel', 'True', nanoseconds, watts)
+
+    assert encoder.encodeBatch(batch) == encoder.encodeLines(points)
+
+
+def test_encode_batch_matches_encode_lines():
+    encoder = LineProtocolEncoder('detailed', True)
+    points = [Point('account', 'garage, west', 'channel1', 100.5, TIMESTAMP, 'True'),
+              Point('account', 'device', 'channel2', float('inf'), TIMESTAMP, 'False'),
+              Point('account', 'garage, west', 'channel1', 7.0, TIMESTAMP, 'True')]
+
+    assert encoder.encodePoints(PointBatch(points)) == encoder.encodeLines(points)
+
+
+def test_encode_points_keeps_list_values():
+    encoder = LineProtocolEncoder('detailed', False)
+    points = [Point('account', 'device', 'channel', 7, TIMESTAMP, 'Hour')]
+
+    # Lists of points are encoded as before, while a batch stores every value as a float
+    assert encoder.encodePoints(points) == encoder.encodeLines(points)
+    assert encoder.encodePoints(PointBatch(points)) == [encoder.encodeLines(points)[0].replace('usage=7i', 'usage=7')]
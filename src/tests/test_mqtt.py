@@ -9,11 +9,13 @@ import pytest
 # Local imports
 from vuegraf import mqtt
 from vuegraf.collect import Point
+from vuegraf.points import PointBatch
 
 TIMESTAMP = datetime.datetime(2024, 1, 10, 12, 0, 30, tzinfo=datetime.timezone.utc)
 
 # Minimal valid config for MQTT
 CONFIG = {
+    "influxDb": {},
     "mqtt": {
         "host": "unittest.mqtt.host",
     }
@@ -78,33 +80,40 @@ def test_retain_only_latest_keeps_single():
     assert retained == [point]
 
 
-def test_retain_only_latest_keeps_latest_in_one_channel():
+def retainOnlyLatest(points, asBatch):
+    return mqtt._retainOnlyLatestPointPerChannel(PointBatch(points) if asBatch else points)
+
+
+@pytest.mark.parametrize('asBatch', [False, True])
+def test_retain_only_latest_keeps_latest_in_one_channel(asBatch):
     """Makes sure the max by timestamp is working right."""
     early = Point("account", "device", "chan", 9.0, TIMESTAMP, "Minute")
     mid = Point("account", "device", "chan", 9.0, TIMESTAMP + datetime.timedelta(hours=1), "Minute")
     late = Point("account", "device", "chan", 9.0, TIMESTAMP + datetime.timedelta(hours=2), "Minute")
-    retained = mqtt._retainOnlyLatestPointPerChannel([early, late, mid])
+    retained = retainOnlyLatest([early, late, mid], asBatch)
     assert retained == [late]
 
 
-def test_retain_only_latest_keeps_unique_channels():
+@pytest.mark.parametrize('asBatch', [False, True])
+def test_retain_only_latest_keeps_unique_channels(asBatch):
     """Makes sure the definition of what makes a unique channel is right."""
-    retained = mqtt._retainOnlyLatestPointPerChannel([
+    retained = retainOnlyLatest([
         Point("account", "device", "chan", 9.0, TIMESTAMP, "Minute"),
         Point("account2", "device", "chan", 9.0, TIMESTAMP, "Minute"),
         Point("account", "device2", "chan", 9.0, TIMESTAMP, "Minute"),
         Point("account", "device", "chan2", 9.0, TIMESTAMP, "Minute"),
-    ])
+    ], asBatch)
     assert len(retained) == 4
 
 
-def test_retain_only_latest_keeps_latest_in_two_channels():
+@pytest.mark.parametrize('asBatch', [False, True])
+def test_retain_only_latest_keeps_latest_in_two_channels(asBatch):
     """Makes sure max is correctly taken across two channels."""
     early_a = Point("account", "device", "chan_a", 9.0, TIMESTAMP, "Minute")
     late_a = Point("account", "device", "chan_a", 9.0, TIMESTAMP + datetime.timedelta(hours=2), "Minute")
     early_b = Point("account", "device", "chan_b", 9.0, TIMESTAMP, "Minute")
     late_b = Point("account", "device", "chan_b", 9.0, TIMESTAMP + datetime.timedelta(hours=2), "Minute")
-    retained = mqtt._retainOnlyLatestPointPerChannel([early_a, late_a, early_b, late_b])
+    retained = retainOnlyLatest([early_a, late_a, early_b, late_b], asBatch)
     assert len(retained) == 2
     assert late_a in retained
     assert late_b in retained
@@ -0,0 +1,88 @@
+# Copyright (c) Jason Ertel (jertel).
+# This file is part of the Vuegraf project and is made available under the MIT License.
+
+import datetime
+
+import numpy
+
+from vuegraf.points import Point, PointBatch, fromNanoseconds, toNanoseconds, toPointBatch
+
+
+TIMESTAMP = datetime.datetime(2024, 1, 1, 10, 0, 0, 123456, tzinfo=datetime.timezone.utc)
+LATER = TIMESTAMP + datetime.timedelta(seconds=1)
+
+
+def newPoints():
+    return [Point('account', 'device', 'channel1', 1.5, TIMESTAMP, 'Minute'),
+            Point('account', 'device', 'channel2', 2.5, TIMESTAMP, 'Second'),
+            Point('account', 'device', 'channel1', 3.5, LATER, 'Minute')]
+
+
+def test_to_nanoseconds():
+    assert toNanoseconds(datetime.datetime(1970, 1, 1, 0, 0, 1, 5)) == 1_000_005_000
+    assert toNanoseconds(datetime.datetime(1969, 12, 31, 23, 59, 59, tzinfo=datetime.timezone.utc)) == -1_000_000_000
+
+
+def test_from_nanoseconds():
+    assert fromNanoseconds(toNanoseconds(TIMESTAMP)) == TIMESTAMP
+    assert fromNanoseconds(1_000_005_999) == datetime.datetime(1970, 1, 1, 0, 0, 1, 5, tzinfo=datetime.timezone.utc)
+
+
+def test_batch_keeps_point_api():
+    points = newPoints()
+    batch = PointBatch(points)
+
+    assert len(batch) == 3
+    assert list(batch) == points
+    assert batch[-1] == points[-1]
+    # Each series is only stored once
+    assert batch.series == [('account', 'device', 'channel1', 'Minute'), ('account', 'device', 'channel2', 'Second')]
+    assert list(batch.seriesColumn) == [0, 1, 0]
+
+
+def test_batch_add_series():
+    batch = PointBatch()
+    nanoseconds = numpy.array([toNanoseconds(TIMESTAMP), toNanoseconds(LATER)])
+    batch.addSeries('account', 'device', 'channel1', 'Minute', nanoseconds, numpy.array([1.5, 3.5]))
+    batch.addSeries('account', 'device', 'channel2', 'Second', [toNanoseconds(TIMESTAMP)], [2.5])
+
+    assert list(batch) == [newPoints()[0], newPoints()[2], newPoints()[1]]
+
+
+def test_batch_extend_merges_series():
+    first = PointBatch(newPoints()[1:2])
+    second = PointBatch(newPoints())
+
+    first.extend(second)
+
+    assert list(first) == newPoints()[1:2] + newPoints()
+    assert len(first.series) == 2
+    assert list(first.seriesColumn) == [0, 1, 0, 1]
+
+
+def test_batch_select():
+    batch = PointBatch(newPoints())
+
+    assert list(batch[1:]) == newPoints()[1:]
+    assert list(batch.select([0, 2])) == [newPoints()[0], newPoints()[2]]
+    # A selection is independent of the batch it was taken from
+    selected = batch[:1]
+    selected.append(Point('account', 'device', 'channel3', 4.5, LATER, 'Minute'))
+    assert len(batch.series) == 2
+
+
+def test_to_point_batch():
+    batch = PointBatch(newPoints())
+
+    assert toPointBatch(batch) is batch
+    assert list(toPointBatch(newPoints())) == newPoints()
+
+
+def test_batch_equality():
+    batch = PointBatch(newPoints())
+
+    assert batch == newPoints()
+    assert batch == PointBatch(newPoints())
+    assert batch != newPoints()[:2]
+    assert batch != tuple(newPoints())
+    assert repr(PointBatch(newPoints()[:1])) == 'PointBatch({!r})'.format(newPoints()[:1])
@@ -0,0 +1,199 @@
+# Copyright (c) Jason Ertel (jertel).
+# This file is part of the Vuegraf project and is made available under the MIT License.
+
+import threading
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from vuegraf import ratelimit
+from vuegraf.ratelimit import ApiLimiter, ConcurrencyGovernor, RateLimitedVue, TokenBucket
+
+
+def httpError(statusCode):
+    error = Exception('HTTP {}'.format(statusCode))
+    error.response = MagicMock(status_code=statusCode)
+    return error
+
+
+@patch('vuegraf.ratelimit.time')
+def test_token_bucket_disabled(mock_time):
+    bucket = TokenBucket(0, 1)
+    for _ in range(5):
+        assert bucket.acquire() == 0
+    mock_time.sleep.assert_not_called()
+
+
+@patch('vuegraf.ratelimit.time')
+def test_token_bucket_burst_then_paced(mock_time):
+    mock_time.monotonic.return_value = 100.0
+    bucket = TokenBucket(2, 2)
+
+    assert bucket.acquire() == 0
+    assert bucket.acquire() == 0
+    # Bucket is empty; the next two callers reserve future tokens in order
+    assert bucket.acquire() == pytest.approx(0.5)
+    assert bucket.acquire() == pytest.approx(1.0)
+    assert mock_time.sleep.call_count == 2
+
+    # After the reserved tokens have been paid back, the bucket refills up to its capacity only
+    mock_time.monotonic.return_value = 200.0
+    assert bucket.acquire() == 0
+    assert bucket.acquire() == 0
+    assert bucket.acquire() == pytest.approx(0.5)
+
+
+def test_governor_additive_increase_multiplicative_decrease():
+    governor = ConcurrencyGovernor(4)
+    assert governor.limit == 4
+
+    governor.acquire()
+    governor.release(False)
+    assert governor.limit == 2
+    governor.acquire()
+    governor.release(False)
+    governor.acquire()
+    governor.release(False)
+    assert governor.limit == 1
+
+    # Grows by one after as many healthy requests as the current limit
+    governor.acquire()
+    governor.release(True)
+    assert governor.limit == 2
+    governor.acquire()
+    governor.release(True)
+    assert governor.limit == 2
+    governor.acquire()
+    governor.release(True)
+    assert governor.limit == 3
+
+    for _ in range(20):
+        governor.acquire()
+        governor.release(True)
+    assert governor.limit == 4
+    assert governor.inFlight == 0
+
+
+def test_governor_blocks_at_limit():
+    governor = ConcurrencyGovernor(1)
+    governor.acquire()
+    acquired = threading.Event()
+
+    def waiter():
+        governor.acquire()
+        acquired.set()
+
+    thread = threading.Thread(target=waiter)
+    thread.start()
+    assert not acquired.wait(0.1)
+    governor.release(True)
+    assert acquired.wait(5)
+    thread.join()
+    assert governor.inFlight == 1
+
+
+def test_is_throttled():
+    assert ratelimit.isThrottled(httpError(429))
+    assert ratelimit.isThrottled(httpError(503))
+    assert not ratelimit.isThrottled(httpError(404))
+    assert not ratelimit.isThrottled(ValueError('no response'))
+
+
+def test_api_limiter_counts_calls_per_account():
+    limiter = ApiLimiter(0, 0, 10, 4, 0)
+    fn = MagicMock(return_value='result')
+
+    assert limiter.call('first', fn, 1, scale='1MIN') == 'result'
+    assert limiter.call('first', fn, 2) == 'result'
+    assert limiter.call('second', fn, 3) == 'result'
+    fn.assert_any_call(1, scale='1MIN')
+
+    counters = limiter.takeCounters()
+    assert counters['first']['calls'] == 2
+    assert counters['second']['calls'] == 1
+    assert counters['first']['errors'] == 0
+    assert limiter.takeCounters() == {}
+    assert limiter.governor.limit == 4
+
+
+def test_api_limiter_backs_off_when_throttled():
+    limiter = ApiLimiter(0, 0, 10, 4, 0)
+
+    with pytest.raises(Exception):
+        limiter.call('first', MagicMock(side_effect=httpError(429)))
+    assert limiter.governor.limit == 2
+
+    # Client errors are counted but do not reduce concurrency
+    with pytest.raises(ValueError):
+        limiter.call('first', MagicMock(side_effect=ValueError('bad request')))
+    assert limiter.governor.limit == 2
+
+    counters = limiter.takeCounters()['first']
+    assert counters['calls'] == 2
+    assert counters['throttled'] == 1
+    assert counters['errors'] == 2
+
+
+def test_api_limiter_pause_grows_with_backoff():
+    limiter = ApiLimiter(0, 0, 10, 8, 0)
+    # A healthy API needs no pause
+    assert limiter.getPauseSecs(5) == 0
+
+    pauses = []
+    for _ in range(3):
+        with pytest.raises(Exception):
+            limiter.call('first', MagicMock(side_effect=httpError(429)))
+        pauses.append(limiter.getPauseSecs(5))
+    assert pauses == [5, 10, 15]
+
+
+@patch('vuegraf.ratelimit.time')
+def test_api_limiter_backs_off_when_slow(mock_time):
+    mock_time.monotonic.side_effect = [0.0, 0.0, 0.0, 30.0]
+    limiter = ApiLimiter(0, 0, 10, 4, 10)
+
+    limiter.call('first', MagicMock())
+
+    assert limiter.governor.limit == 2
+    assert limiter.takeCounters()['first']['latencySecs'] == 30.0
+
+
+def test_rate_limited_vue_wraps_api_calls_only():
+    vue = MagicMock()
+    vue.get_chart_usage.return_value = ([1.0], 'start')
+    limiter = ApiLimiter(0, 0, 10, 4, 0)
+    limitedVue = RateLimitedVue(vue, limiter, 'first')
+
+    assert limitedVue.get_chart_usage('chan', scale='1S') == ([1.0], 'start')
+    vue.get_chart_usage.assert_called_once_with('chan', scale='1S')
+    assert limitedVue.username is vue.username
+    assert limiter.takeCounters()['first']['calls'] == 1
+
+
+def test_get_api_limiter_cached_in_config():
+    config = {'apiRequestsPerSec': 5, 'apiAccountRequestsPerSec': 1, 'apiBurstRequests': 3,
+              'apiMaxConcurrentRequests': 6, 'apiSlowRequestSecs': 10}
+
+    limiter = ratelimit.getApiLimiter(config)
+
+    assert ratelimit.getApiLimiter(config) is limiter
+    assert limiter.globalBucket.ratePerSec == 5
+    assert limiter.globalBucket.capacity == 3
+    assert limiter.accountRequestsPerSec == 1
+    assert limiter.governor.maxLimit == 6
+    assert limiter.slowRequestSecs == 10
+
+
+@patch('vuegraf.ratelimit.logger')
+def test_log_api_usage(mock_logger):
+    ratelimit.logApiUsage({})
+    mock_logger.info.assert_not_called()
+
+    limiter = ApiLimiter(0, 0, 10, 4, 0)
+    limiter.call('first', MagicMock())
+    ratelimit.logApiUsage({'_apiLimiter': limiter})
+
+    mock_logger.info.assert_called_once()
+    message = mock_logger.info.call_args[0][0]
+    assert message.startswith('Emporia API usage; account=first; calls=1; throttled=0; errors=0;')
+    assert message.endswith('concurrencyLimit=4')
@@ -0,0 +1,175 @@
+# Copyright (c) Jason Ertel (jertel).
+# This file is part of the Vuegraf project and is made available under the MIT License.
+
+import json
+import threading
+from unittest.mock import MagicMock, patch
+import pytest
+
+# Local imports
+from vuegraf import registry
+from vuegraf.device import populateDevices
+
+
+SAMPLE_CONFIG = {
+    'deviceCacheFile': None,
+    'deviceRefreshIntervalSecs': 0,
+    'accounts': [],
+}
+
+
+def newAccount(name='Home', devices=None):
+    vue = MagicMock()
+    vue.get_devices.return_value = devices if devices is not None else [
+        registry.newDevice(123, 'Panel', [['1,2,3', None], ['1', 'Kitchen']]),
+    ]
+    return {'name': name, 'vue': vue}
+
+
+def test_save_device_cache_noop_if_not_configured():
+    registry.saveDeviceCache(dict(SAMPLE_CONFIG, accounts=[newAccount()]))
+
+
+def test_load_device_cache_noop_if_not_configured():
+    assert registry.loadDeviceCache(dict(SAMPLE_CONFIG)) == {}
+
+
+def test_save_and_load_device_cache_round_trip(tmp_path):
+    cacheFile = tmp_path / 'devices.json'
+    account = newAccount()
+    populateDevices(account)
+    # Accounts not yet logged into are left out of the cache
+    config = dict(SAMPLE_CONFIG, deviceCacheFile=str(cacheFile), accounts=[account, {'name': 'Pending'}])
+
+    registry.saveDeviceCache(config)
+
+    accountsDevices = registry.loadDeviceCache(config)
+    assert list(accountsDevices) == ['Home']
+    restored = {'name': 'Home'}
+    populateDevices(restored, accountsDevices['Home'])
+    assert list(restored['deviceIdMap']) == [123]
+    assert restored['channelIdMap']['123-1,2,3'].name == 'Panel'
+    assert restored['channelIdMap']['123-1'].name == 'Kitchen'
+    assert restored['channelIndex'] == account['channelIndex']
+
+
+@patch('vuegraf.registry.logger')
+def test_load_device_cache_missing_file(mock_logger, tmp_path):
+    assert registry.loadDeviceCache(dict(SAMPLE_CONFIG, deviceCacheFile=str(tmp_path / 'devices.json'))) == {}
+    assert 'No device cache file found' in mock_logger.info.call_args[0][0]
+
+
+@pytest.mark.parametrize('content', [
+    'not json',
+    json.dumps({'version': registry.DEVICE_CACHE_FILE_VERSION + 1, 'accounts': {}}),
+    json.dumps({'version': registry.DEVICE_CACHE_FILE_VERSION, 'accounts': {'Home': [[123]]}}),
+])
+@patch('vuegraf.registry.logger')
+def test_load_device_cache_unreadable_file(mock_logger, tmp_path, content):
+    cacheFile = tmp_path / 'devices.json'
+    cacheFile.write_text(content)
+    assert registry.loadDeviceCache(dict(SAMPLE_CONFIG, deviceCacheFile=str(cacheFile))) == {}
+    assert 'Ignoring unreadable device cache file' in mock_logger.warning.call_args[0][0]
+
+
+def test_registry_discovers_cached_devices_on_start(tmp_path):
+    cacheFile = tmp_path / 'devices.json'
+    account = newAccount()
+    populateDevices(account, [])
+    discovered = threading.Event()
+    account['vue'].get_devices.side_effect = lambda: discovered.set() or account['vue'].get_devices.return_value
+    config = dict(SAMPLE_CONFIG, deviceCacheFile=str(cacheFile), accounts=[account])
+
+    deviceRegistry = registry.DeviceRegistry(config)
+    deviceRegistry.start(True)
+    assert discovered.wait(5)
+    deviceRegistry.shutdown()
+
+    assert list(account['deviceIdMap']) == [123]
+    assert list(registry.loadDeviceCache(config)) == ['Home']
+
+
+def test_registry_saves_discovered_devices_on_start(tmp_path):
+    cacheFile = tmp_path / 'devices.json'
+    account = newAccount()
+    populateDevices(account)
+    account['vue'].get_devices.reset_mock()
+    config = dict(SAMPLE_CONFIG, deviceCacheFile=str(cacheFile), accounts=[account])
+
+    deviceRegistry = registry.DeviceRegistry(config)
+    deviceRegistry.start(False)
+    deviceRegistry.shutdown()
+
+    # Devices were just discovered at login, so no discovery is due yet
+    account['vue'].get_devices.assert_not_called()
+    assert list(registry.loadDeviceCache(config)) == ['Home']
+
+
+@patch('vuegraf.registry.time.monotonic', return_value=1000.0)
+def test_registry_wait_secs(_mock_monotonic):
+    deviceRegistry = registry.DeviceRegistry(dict(SAMPLE_CONFIG, deviceRefreshIntervalSecs=3600))
+    deviceRegistry.lastRefreshSecs = 900.0
+    assert deviceRegistry.getWaitSecs() == 3500.0
+
+    deviceRegistry.lastRefreshSecs = -3000.0
+    assert deviceRegistry.getWaitSecs() == 0
+
+    deviceRegistry.lastRefreshSecs = None
+    assert deviceRegistry.getWaitSecs() == 0
+
+    # Without a refresh interval, devices are only discovered when due right away
+    deviceRegistry.refreshIntervalSecs = 0
+    deviceRegistry.lastRefreshSecs = 900.0
+    assert deviceRegistry.getWaitSecs() is None
+
+
+def test_registry_refresh_stops_between_accounts():
+    first, second = newAccount('First'), newAccount('Second')
+    deviceRegistry = registry.DeviceRegistry(dict(SAMPLE_CONFIG, accounts=[first, second]))
+    first['vue'].get_devices.side_effect = lambda: setattr(deviceRegistry, 'stopping', True) or []
+
+    deviceRegistry.refresh()
+
+    first['vue'].get_devices.assert_called_once()
+    second['vue'].get_devices.assert_not_called()
+
+
+def test_registry_shutdown_deadline():
+    account = newAccount()
+    discovering = threading.Event()
+    release = threading.Event()
+    account['vue'].get_devices.side_effect = lambda: discovering.set() or release.wait(5) and []
+    deviceRegistry = registry.DeviceRegistry(dict(SAMPLE_CONFIG, accounts=[account]))
+
+    deviceRegistry.start(True)
+    assert discovering.wait(5)
+    deviceRegistry.shutdown(0.1)
+
+    # The discovery in progress is left to finish in the background
+    assert deviceRegistry.thread.is_alive()
+    release.set()
+    deviceRegistry.thread.join(5)
+    assert not deviceRegistry.thread.is_alive()
+
+
+@patch('vuegraf.registry.logger')
+def test_registry_refresh_failure_keeps_devices(mock_logger):
+    account = newAccount()
+    populateDevices(account)
+    account['vue'].get_devices.side_effect = Exception('unavailable')
+    deviceRegistry = registry.DeviceRegistry(dict(SAMPLE_CONFIG, accounts=[account]))
+
+    deviceRegistry.refresh()
+
+    mock_logger.warning.assert_called_once_with('Failed to discover devices; account=Home; error=unavailable')
+    assert list(account['deviceIdMap']) == [123]
+
+
+@patch('vuegraf.registry.logger')
+@patch('vuegraf.registry.saveDeviceCache', side_effect=OSError('disk full'))
+def test_registry_save_failure_is_logged(_mock_save, mock_logger):
+    deviceRegistry = registry.DeviceRegistry(dict(SAMPLE_CONFIG))
+
+    deviceRegistry.saveCache()
+
+    mock_logger.warning.assert_called_once_with('Failed to save device cache; error=disk full')
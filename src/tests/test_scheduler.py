@@ -0,0 +1,248 @@
+# Copyright (c) Jason Ertel (jertel).
+# This file is part of the Vuegraf project and is made available under the MIT License.
+
+import datetime
+import threading
+from unittest.mock import MagicMock, patch
+
+
+from vuegraf import scheduler
+from vuegraf.points import Point
+from vuegraf.scheduler import Job, JobScheduler
+
+
+NOW_UTC = datetime.datetime(2025, 4, 1, 12, 0, 0, tzinfo=datetime.timezone.utc)
+
+
+SAMPLE_CONFIG = {
+    'accounts': [{'name': 'first'}, {'name': 'second'}],
+    'maxConcurrentAccounts': 1,
+}
+
+
+def newPoint(chanName):
+    return Point('Account', 'Device', chanName, 1.0, NOW_UTC, 'False')
+
+
+def newSaver(saved):
+    """Returns a savePoints function recording the channel names of each saved batch."""
+    return lambda usageDataPoints: saved.append([pt.chanName for pt in usageDataPoints])
+
+
+def waitForJobs(jobScheduler):
+    for job in jobScheduler.jobs:
+        job.executor.submit(lambda: None).result()
+
+
+def test_initAccountCollector():
+    config = dict(SAMPLE_CONFIG, maxConcurrentAccounts=2)
+    collectAccounts, shutdown = scheduler.initAccountCollector(config)
+
+    # Results come back in account order, across repeated use
+    assert collectAccounts(lambda account: account['name']) == ['first', 'second']
+    assert collectAccounts(lambda account: account['name'].upper()) == ['FIRST', 'SECOND']
+    shutdown()
+
+
+def test_dispatch_runs_due_jobs_in_priority_order():
+    saved = []
+    jobScheduler = JobScheduler(dict(SAMPLE_CONFIG), newSaver(saved))
+    order = []
+
+    def newJob(name, priority, due):
+        def collect(account, arg):
+            order.append(name)
+            return [newPoint('{}-{}-{}'.format(name, account['name'], arg))]
+        return Job(name, priority, lambda nowUTC: due, collect)
+
+    jobScheduler.addJob(newJob('slow', 2, ('b',)))
+    jobScheduler.addJob(newJob('fast', 1, ('a',)))
+    jobScheduler.addJob(newJob('idle', 0, None))
+
+    assert [job.name for job in jobScheduler.jobs] == ['idle', 'fast', 'slow']
+    jobScheduler.dispatch(NOW_UTC)
+    waitForJobs(jobScheduler)
+    jobScheduler.shutdown()
+
+    assert sorted(saved) == [['fast-first-a', 'fast-second-a'], ['slow-first-b', 'slow-second-b']]
+    assert 'idle' not in order
+
+
+@patch('vuegraf.scheduler.logger')
+def test_dispatch_coalesces_runs_in_progress(mock_logger):
+    release = threading.Event()
+    saved = []
+    jobScheduler = JobScheduler(dict(SAMPLE_CONFIG), newSaver(saved))
+
+    def collect(account, nowUTC):
+        release.wait(5)
+        return [newPoint(nowUTC.isoformat())]
+
+    jobScheduler.addJob(Job('minute', 0, lambda nowUTC: (nowUTC,), collect))
+    jobScheduler.dispatch(NOW_UTC)
+    jobScheduler.dispatch(NOW_UTC + datetime.timedelta(minutes=1))
+    release.set()
+    waitForJobs(jobScheduler)
+    jobScheduler.shutdown()
+
+    assert saved == [[NOW_UTC.isoformat()] * 2]
+    mock_logger.warning.assert_called_once_with('Skipping job run since the previous run is still in progress; job=minute')
+
+
+def test_dispatch_queues_runs_when_not_coalescing():
+    release = threading.Event()
+    saved = []
+    jobScheduler = JobScheduler(dict(SAMPLE_CONFIG), newSaver(saved))
+
+    def collect(account, nowUTC):
+        release.wait(5)
+        return [newPoint(nowUTC.isoformat())]
+
+    jobScheduler.addJob(Job('hour', 0, lambda nowUTC: (nowUTC,), collect, coalesce=False))
+    jobScheduler.dispatch(NOW_UTC)
+    jobScheduler.dispatch(NOW_UTC + datetime.timedelta(hours=1))
+    release.set()
+    waitForJobs(jobScheduler)
+    jobScheduler.shutdown()
+
+    assert saved == [[NOW_UTC.isoformat()] * 2, [(NOW_UTC + datetime.timedelta(hours=1)).isoformat()] * 2]
+
+
+@patch('vuegraf.scheduler.logger')
+def test_shutdown_cancels_queued_runs_and_abandons_runs_in_progress(mock_logger):
+    started = threading.Event()
+    release = threading.Event()
+    saved = []
+    jobScheduler = JobScheduler(dict(SAMPLE_CONFIG), newSaver(saved))
+
+    def collect(account, nowUTC):
+        started.set()
+        release.wait(5)
+        return [newPoint(nowUTC.isoformat())]
+
+    jobScheduler.addJob(Job('hour', 0, lambda nowUTC: (nowUTC,), collect, coalesce=False))
+    jobScheduler.dispatch(NOW_UTC)
+    jobScheduler.dispatch(NOW_UTC + datetime.timedelta(hours=1))
+    assert started.wait(5)
+    jobScheduler.shutdown(0.1)
+
+    mock_logger.warning.assert_called_once_with('Abandoning job runs still in progress; runs=1')
+
+    # The abandoned run still finishes, but the queued run never starts
+    release.set()
+    jobScheduler.jobs[0].executor.shutdown()
+    assert saved == [[NOW_UTC.isoformat()] * 2]
+    assert jobScheduler.futures == set()
+
+
+def test_shutdown_stops_streaming_run():
+    saved = []
+    jobScheduler = JobScheduler(dict(SAMPLE_CONFIG), saved.append)
+    job = Job('history', 0, lambda nowUTC: (), lambda account: iter([['w1'], ['w2']]), stream=True)
+    jobScheduler.stopEvent.set()
+
+    assert jobScheduler.collectAccount(job, {'name': 'first'}, ()) == []
+    assert saved == [['w1']]
+
+
+@patch('vuegraf.scheduler.logger')
+def test_collect_account_retries(mock_logger):
+    saved = []
+    jobScheduler = JobScheduler(dict(SAMPLE_CONFIG), newSaver(saved))
+    collect = MagicMock(side_effect=[ValueError('first fails'), [newPoint('first')], [newPoint('second')]])
+
+    jobScheduler.addJob(Job('hour', 0, lambda nowUTC: (), collect, maxRetries=2, retryDelaySecs=0))
+    jobScheduler.dispatch(NOW_UTC)
+    waitForJobs(jobScheduler)
+    jobScheduler.shutdown()
+
+    assert saved == [['first', 'second']]
+    assert collect.call_count == 3
+    mock_logger.warning.assert_called_once()
+    assert 'retrying; job=hour; attempt=1' in mock_logger.warning.call_args[0][0]
+    mock_logger.error.assert_not_called()
+
+
+@patch('vuegraf.scheduler.logger')
+@patch('traceback.print_exc')
+def test_collect_account_gives_up_after_retries(mock_print_exc, mock_logger):
+    saved = []
+    jobScheduler = JobScheduler(dict(SAMPLE_CONFIG), newSaver(saved))
+    collect = MagicMock(side_effect=ValueError('always fails'))
+
+    jobScheduler.addJob(Job('day', 0, lambda nowUTC: (), collect, maxRetries=1, retryDelaySecs=0))
+    jobScheduler.dispatch(NOW_UTC)
+    waitForJobs(jobScheduler)
+    jobScheduler.shutdown()
+
+    assert saved == [[]]
+    assert collect.call_count == 4  # Two attempts for each account
+    assert mock_logger.error.call_count == 2
+    assert 'Failed to record new usage data; job=day' in mock_logger.error.call_args[0][0]
+    assert mock_print_exc.call_count == 2
+
+
+@patch('vuegraf.scheduler.logger')
+@patch('traceback.print_exc')
+def test_shutdown_abandons_retries(_mock_print_exc, mock_logger):
+    failed = threading.Event()
+    saved = []
+    config = dict(SAMPLE_CONFIG)
+    config['accounts'] = [{'name': 'first'}]
+    jobScheduler = JobScheduler(config, newSaver(saved))
+
+    def collect(account):
+        failed.set()
+        raise ValueError('fails')
+
+    jobScheduler.addJob(Job('day', 0, lambda nowUTC: (), collect, maxRetries=5, retryDelaySecs=60))
+    jobScheduler.dispatch(NOW_UTC)
+    assert failed.wait(5)
+    jobScheduler.shutdown()
+
+    assert saved == [[]]
+    mock_logger.error.assert_not_called()
+
+    # A failure while stopping is not retried
+    jobScheduler.collectAccount(jobScheduler.jobs[0], config['accounts'][0], ())
+    mock_logger.error.assert_called_once()
+
+
+@patch('vuegraf.scheduler.logger')
+@patch('traceback.print_exc')
+def test_run_job_logs_save_failures(mock_print_exc, mock_logger):
+    jobScheduler = JobScheduler(dict(SAMPLE_CONFIG), MagicMock(side_effect=ValueError('write failed')))
+
+    jobScheduler.addJob(Job('minute', 0, lambda nowUTC: (), lambda account: [newPoint(account['name'])]))
+    jobScheduler.dispatch(NOW_UTC)
+    waitForJobs(jobScheduler)
+
+    mock_logger.error.assert_called_once()
+    assert 'Failed to save job data; job=minute' in mock_logger.error.call_args[0][0]
+    mock_print_exc.assert_called_once()
+    assert jobScheduler.jobs[0].pendingRuns == 0
+
+    # The job is not stuck behind the failed run
+    jobScheduler.dispatch(NOW_UTC)
+    waitForJobs(jobScheduler)
+    jobScheduler.shutdown()
+    assert mock_logger.error.call_count == 2
+
+
+def test_streaming_job_saves_each_batch():
+    saved = []
+    jobScheduler = JobScheduler(dict(SAMPLE_CONFIG), saved.append)
+
+    def collect(account):
+        for window in ['w1', 'w2']:
+            yield ['{}-{}'.format(account['name'], window)]
+            # The batch is saved before the next one is produced
+            assert saved[-1] == ['{}-{}'.format(account['name'], window)]
+
+    jobScheduler.addJob(Job('history', 0, lambda nowUTC: (), collect, stream=True))
+    jobScheduler.dispatch(NOW_UTC)
+    waitForJobs(jobScheduler)
+    jobScheduler.shutdown()
+
+    # No final batch of the whole run is saved
+    assert saved == [['first-w1'], ['first-w2'], ['second-w1'], ['second-w2']]
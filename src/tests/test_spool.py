@@ -0,0 +1,238 @@
+# Copyright (c) Jason Ertel (jertel).
+# This file is part of the Vuegraf project and is made available under the MIT License.
+
+import datetime
+import os
+import threading
+from unittest.mock import MagicMock, patch
+
+import influxdb
+import influxdb_client
+import pytest
+
+from vuegraf.collect import Point
+from vuegraf.influx import getWatermarks
+from vuegraf.spool import Spool, SpoolReplayer, spoolPoints
+
+
+TIMESTAMP = datetime.datetime(2024, 1, 1, 10, 0, 0, tzinfo=datetime.timezone.utc)
+
+
+SAMPLE_CONFIG = {
+    'influxDb': {},
+    'args': MagicMock(debug=False, dryrun=False),
+    'spoolRetrySecs': 0,
+    'spoolReplayBatchesPerSec': 0,
+}
+
+
+def drain(spool):
+    batches = []
+    while True:
+        record = spool.peek()
+        if record is None:
+            return batches
+        position, lines = record
+        batches.append(lines)
+        spool.ack(position)
+
+
+def test_spool_roundtrip_and_resume(tmp_path):
+    spool = Spool(str(tmp_path / 'spool'), 1024)
+    assert spool.peek() is None
+
+    spool.append(['a 1', 'b 2'])
+    spool.append(['c 3'])
+    assert spool.backlog == 2
+
+    # Peeking does not consume a batch until it is acknowledged
+    position, lines = spool.peek()
+    assert lines == ['a 1', 'b 2']
+    assert spool.peek() == (position, lines)
+    spool.ack(position)
+    assert spool.backlog == 1
+
+    # A new spool resumes after the acknowledged batch
+    spool = Spool(str(tmp_path / 'spool'), 1024)
+    assert spool.backlog == 1
+    assert drain(spool) == [['c 3']]
+    assert Spool(str(tmp_path / 'spool'), 1024).backlog == 0
+
+
+def test_spool_rolls_and_deletes_segments(tmp_path):
+    spoolDir = tmp_path / 'spool'
+    spool = Spool(str(spoolDir), 1)
+    for batch in ['a 1', 'b 2', 'c 3']:
+        spool.append([batch])
+    assert sorted(os.listdir(spoolDir)) == ['0000000000000000.seg', '0000000000000001.seg', '0000000000000002.seg']
+
+    assert drain(spool) == [['a 1'], ['b 2'], ['c 3']]
+
+    # Acknowledged segments are deleted, except the one being appended to
+    assert sorted(os.listdir(spoolDir)) == ['0000000000000002.seg', 'ack']
+    spool.append(['d 4'])
+    assert drain(Spool(str(spoolDir), 1)) == [['d 4']]
+    assert sorted(os.listdir(spoolDir)) == ['0000000000000003.seg', 'ack']
+
+
+@pytest.mark.parametrize('tail', [b'12', b'x\n', b'12\nshort', b'3\nabcd'])
+@patch('vuegraf.spool.logger')
+def test_spool_discards_incomplete_record(mock_logger, tail, tmp_path):
+    spoolDir = tmp_path / 'spool'
+    Spool(str(spoolDir), 1024).append(['a 1'])
+    segmentFile = spoolDir / '0000000000000000.seg'
+    size = os.path.getsize(segmentFile)
+    with open(segmentFile, 'ab') as f:
+        f.write(tail)
+
+    spool = Spool(str(spoolDir), 1024)
+
+    assert spool.backlog == 1
+    assert os.path.getsize(segmentFile) == size
+    assert 'Discarding incomplete spooled batch' in mock_logger.warning.call_args[0][0]
+    spool.append(['b 2'])
+    assert drain(spool) == [['a 1'], ['b 2']]
+
+
+def test_spool_ignores_stale_segments(tmp_path):
+    spoolDir = tmp_path / 'spool'
+    spool = Spool(str(spoolDir), 1)
+    spool.append(['a 1'])
+    spool.append(['b 2'])
+    spool.ack(spool.peek()[0])
+    position, _ = spool.peek()
+    spool.ack(position)
+    # A segment older than the acknowledged one is left behind, as if a crash interrupted its deletion
+    (spoolDir / '0000000000000000.seg').write_bytes(b'3\nold\n')
+
+    spool = Spool(str(spoolDir), 1)
+
+    assert spool.backlog == 0
+    assert not (spoolDir / '0000000000000000.seg').exists()
+
+
+def test_spool_ack_of_deleted_segment(tmp_path):
+    spoolDir = tmp_path / 'spool'
+    spoolDir.mkdir()
+    (spoolDir / 'ack').write_text('[1, 100]')
+    (spoolDir / '0000000000000002.seg').write_bytes(b'3\na 1\n')
+
+    spool = Spool(str(spoolDir), 1024)
+
+    assert spool.head == (2, 0)
+    assert drain(spool) == [['a 1']]
+
+
+@patch('vuegraf.spool.writeInfluxLines')
+def test_replayer_writes_batches(mock_write, tmp_path):
+    written = threading.Event()
+    mock_write.side_effect = lambda config, lines: written.set()
+    config = dict(SAMPLE_CONFIG)
+    spool = Spool(str(tmp_path), 1024)
+    replayer = SpoolReplayer(config, spool)
+    assert not replayer.recovering
+    replayer.start()
+
+    spool.append(['a 1'])
+    replayer.notify()
+
+    assert written.wait(5)
+    replayer.shutdown(5)
+    mock_write.assert_called_once_with(config, ['a 1'])
+    assert spool.backlog == 0
+    assert not replayer.thread.is_alive()
+
+
+@patch('vuegraf.spool.logger')
+@patch('traceback.print_exc')
+@patch('vuegraf.spool.writeInfluxLines')
+def test_replayer_retries_and_paces_backlog(mock_write, mock_print_exc, mock_logger, tmp_path):
+    mock_write.side_effect = [ConnectionError('influx down'), None, None]
+    config = dict(SAMPLE_CONFIG, spoolReplayBatchesPerSec=1000)
+    spool = Spool(str(tmp_path), 1024)
+    spool.append(['a 1'])
+    spool.append(['b 2'])
+
+    replayer = SpoolReplayer(config, Spool(str(tmp_path), 1024))
+    assert replayer.recovering
+    replayer.start()
+    replayer.shutdown(5)
+
+    assert [c[0][1] for c in mock_write.call_args_list] == [['a 1'], ['a 1'], ['b 2']]
+    assert replayer.spool.backlog == 0
+    assert 'Failed to write spooled points to the database, retrying; backlog=2' in mock_logger.error.call_args[0][0]
+    mock_print_exc.assert_called_once()
+    mock_logger.info.assert_called_with('Finished replaying spooled batches')
+
+
+@patch('vuegraf.spool.logger')
+@patch('traceback.print_exc')
+@patch('vuegraf.spool.writeInfluxLines')
+def test_replayer_shutdown_leaves_backlog(mock_write, _mock_print_exc, mock_logger, tmp_path):
+    failed = threading.Event()
+
+    def fail(config, lines):
+        failed.set()
+        raise ConnectionError('influx down')
+    mock_write.side_effect = fail
+    spool = Spool(str(tmp_path), 1024)
+    spool.append(['a 1'])
+    replayer = SpoolReplayer(dict(SAMPLE_CONFIG, spoolRetrySecs=60), spool)
+    replayer.start()
+    assert failed.wait(5)
+
+    replayer.shutdown(0.05)
+    replayer.thread.join(5)
+
+    assert not replayer.thread.is_alive()
+    assert spool.backlog == 1
+    mock_logger.info.assert_called_once_with('Leaving spooled batches for the next start; backlog=1')
+
+
+@patch('vuegraf.spool.logger')
+@patch('traceback.print_exc')
+@patch('vuegraf.spool.writeInfluxLines')
+def test_replayer_quarantines_rejected_batches(mock_write, mock_print_exc, mock_logger, tmp_path):
+    mock_write.side_effect = [
+        influxdb_client.rest.ApiException(status=400, reason='field type conflict'),
+        influxdb.exceptions.InfluxDBClientError('unable to parse', 400),
+        None,
+    ]
+    spool = Spool(str(tmp_path), 1024)
+    spool.append(['a 1', 'a 2'])
+    spool.append(['b 2'])
+    spool.append(['c 3'])
+
+    replayer = SpoolReplayer(dict(SAMPLE_CONFIG, spoolRetrySecs=60), Spool(str(tmp_path), 1024))
+    replayer.start()
+    replayer.shutdown(5)
+
+    # Rejected batches do not hold up the batches behind them, and are kept for inspection
+    assert not replayer.thread.is_alive()
+    assert [c[0][1] for c in mock_write.call_args_list] == [['a 1', 'a 2'], ['b 2'], ['c 3']]
+    assert replayer.spool.backlog == 0
+    assert (tmp_path / 'quarantine.lp').read_text() == 'a 1\na 2\nb 2\n'
+    assert 'Database rejected spooled points, moving them to quarantine; lines=2' in mock_logger.error.call_args_list[0][0][0]
+    mock_print_exc.assert_not_called()
+
+
+@pytest.mark.parametrize('debug', [False, True])
+@patch('vuegraf.spool.dumpPoints')
+def test_spool_points(mock_dump_points, debug, tmp_path):
+    config = dict(SAMPLE_CONFIG, args=MagicMock(debug=debug, dryrun=False), addStationField=False)
+    spool = Spool(str(tmp_path), 1024)
+    points = [Point('account', 'device', 'channel', 1.5, TIMESTAMP, 'False'),
+              Point('account', 'device', 'channel', float('nan'), TIMESTAMP, 'False')]
+    line = 'energy_usage,account_name=account,detailed=False,device_name=channel usage=1.5 1704103200000000000'
+
+    spoolPoints(config, spool, points)
+    # A batch without storable values is not spooled
+    spoolPoints(config, spool, points[1:])
+
+    assert drain(spool) == [[line]]
+    # Spooled points will reach the database, so they advance the watermarks right away
+    assert getWatermarks(config)['timestamps'] == {(None, 'channel', 'False'): TIMESTAMP}
+    if debug:
+        mock_dump_points.assert_any_call("Spooling for database", [line])
+    else:
+        mock_dump_points.assert_not_called()
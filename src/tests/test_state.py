@@ -0,0 +1,93 @@
+# Copyright (c) Jason Ertel (jertel).
+# This file is part of the Vuegraf project and is made available under the MIT License.
+
+import datetime
+import json
+from unittest.mock import MagicMock, patch
+import pytest
+
+# Local imports
+from vuegraf import state
+from vuegraf.influx import getWatermarks
+
+NOW = datetime.datetime(2024, 1, 10, 12, 0, 0, tzinfo=datetime.timezone.utc)
+LAST_MINUTE = datetime.datetime(2024, 1, 10, 11, 59, 0, tzinfo=datetime.timezone.utc)
+
+SAMPLE_CONFIG = {
+    'stateFile': None,
+    'args': MagicMock(resetdatabase=False),
+}
+
+
+def writeState(stateFile, savedAt=NOW, version=state.STATE_FILE_VERSION):
+    stateFile.write_text(json.dumps({
+        'version': version,
+        'savedAt': savedAt.isoformat(),
+        'pointTypes': ['1m'],
+        'watermarks': [[None, 'channel', '1m', LAST_MINUTE.isoformat()]],
+    }))
+
+
+def test_save_state_noop_if_not_configured():
+    config = dict(SAMPLE_CONFIG)
+    state.saveState(config)
+    assert '_watermarks' not in config
+
+
+@patch('vuegraf.state.getTimeNow', return_value=NOW)
+def test_save_and_load_state_round_trip(_mock_now, tmp_path):
+    stateFile = tmp_path / 'state.json'
+    config = dict(SAMPLE_CONFIG, stateFile=str(stateFile))
+    watermarks = getWatermarks(config)
+    watermarks['pointTypes'].update(['1m', '1s'])
+    watermarks['timestamps'][('station', 'channel', '1m')] = LAST_MINUTE
+
+    state.saveState(config)
+
+    restored = dict(SAMPLE_CONFIG, stateFile=str(stateFile))
+    assert state.loadState(restored) is True
+    assert getWatermarks(restored)['pointTypes'] == {'1m', '1s'}
+    assert getWatermarks(restored)['timestamps'] == {('station', 'channel', '1m'): LAST_MINUTE}
+
+
+def test_load_state_noop_if_not_configured():
+    config = dict(SAMPLE_CONFIG)
+    assert state.loadState(config) is False
+    assert '_watermarks' not in config
+
+
+def test_load_state_ignored_when_resetting_database(tmp_path):
+    stateFile = tmp_path / 'state.json'
+    writeState(stateFile)
+    config = dict(SAMPLE_CONFIG, stateFile=str(stateFile), args=MagicMock(resetdatabase=True))
+    assert state.loadState(config) is False
+    assert '_watermarks' not in config
+
+
+def test_load_state_missing_file(tmp_path):
+    config = dict(SAMPLE_CONFIG, stateFile=str(tmp_path / 'missing.json'))
+    assert state.loadState(config) is False
+    assert '_watermarks' not in config
+
+
+@pytest.mark.parametrize('content', [
+    'not json',
+    '{"version": 1}',
+    '{"version": 99, "savedAt": "2024-01-10T12:00:00+00:00", "pointTypes": [], "watermarks": []}',
+    '{"version": 1, "savedAt": "yesterday", "pointTypes": [], "watermarks": []}',
+])
+def test_load_state_corrupt_file(tmp_path, content):
+    stateFile = tmp_path / 'state.json'
+    stateFile.write_text(content)
+    config = dict(SAMPLE_CONFIG, stateFile=str(stateFile))
+    assert state.loadState(config) is False
+    assert '_watermarks' not in config
+
+
+@patch('vuegraf.state.getTimeNow', return_value=NOW)
+def test_load_state_stale_file(_mock_now, tmp_path):
+    stateFile = tmp_path / 'state.json'
+    writeState(stateFile, savedAt=NOW - datetime.timedelta(seconds=state.STATE_FILE_MAX_AGE_SEC + 1))
+    config = dict(SAMPLE_CONFIG, stateFile=str(stateFile))
+    assert state.loadState(config) is False
+    assert '_watermarks' not in config
@@ -1,45 +1,43 @@
 # Copyright (c) Jason Ertel (jertel).
 # This file is part of the Vuegraf project and is made available under the MIT License.
 
+import copy
 import datetime
 from unittest.mock import patch
 import pytest
 import pytz
+from pyemvue.enums import Scale
 
 # Local imports
 from vuegraf import time
 
 # Sample config for testing
-SAMPLE_CONFIG_VALID_TZ = {'timezone': 'America/New_York'}
-SAMPLE_CONFIG_NO_TZ = {}
-SAMPLE_CONFIG_INVALID_TZ = {'timezone': 'Invalid/Timezone'}
+SAMPLE_CONFIG_VALID_TZ = {'influxDb': {}, 'timezone': 'America/New_York'}
+SAMPLE_CONFIG_NO_TZ = {'influxDb': {}}
+SAMPLE_CONFIG_INVALID_TZ = {'influxDb': {}, 'timezone': 'Invalid/Timezone'}
 
 
 # --- Tests for getTimezone ---
 
 def test_getTimezone_valid():
     """Test getTimezone with a valid timezone string."""
-    with patch('vuegraf.time.getConfigValue', return_value='America/New_York') as mock_get_config:
-        tz = time.getTimezone(SAMPLE_CONFIG_VALID_TZ)
-        mock_get_config.assert_called_once_with(SAMPLE_CONFIG_VALID_TZ, 'timezone')
-        assert isinstance(tz, pytz.tzinfo.DstTzInfo)
-        assert tz.zone == 'America/New_York'
+    config = copy.deepcopy(SAMPLE_CONFIG_VALID_TZ)
+    tz = time.getTimezone(config)
+    assert isinstance(tz, pytz.tzinfo.DstTzInfo)
+    assert tz.zone == 'America/New_York'
+    # The timezone is resolved once, with the rest of the settings
+    assert time.getTimezone(config) is tz
 
 
 def test_getTimezone_none():
     """Test getTimezone when timezone is not configured."""
-    with patch('vuegraf.time.getConfigValue', return_value=None) as mock_get_config:
-        tz = time.getTimezone(SAMPLE_CONFIG_NO_TZ)
-        mock_get_config.assert_called_once_with(SAMPLE_CONFIG_NO_TZ, 'timezone')
-        assert tz is None
+    assert time.getTimezone(copy.deepcopy(SAMPLE_CONFIG_NO_TZ)) is None
 
 
 def test_getTimezone_invalid():
     """Test getTimezone with an invalid timezone string."""
-    with patch('vuegraf.time.getConfigValue', return_value='Invalid/Timezone') as mock_get_config:
-        with pytest.raises(pytz.UnknownTimeZoneError):
-            time.getTimezone(SAMPLE_CONFIG_INVALID_TZ)
-        mock_get_config.assert_called_once_with(SAMPLE_CONFIG_INVALID_TZ, 'timezone')
+    with pytest.raises(pytz.UnknownTimeZoneError):
+        time.getTimezone(copy.deepcopy(SAMPLE_CONFIG_INVALID_TZ))
 
 
 # --- Tests for getCurrentHourUTC ---
@@ -91,6 +89,33 @@ def test_convertToLocalDayInUTC(mock_getTimezone):
     assert result == expected_ts_utc
 
 
+# --- Tests for getLocalMidnightUTC ---
+
+def test_getLocalMidnightUTC():
+    """Test getLocalMidnightUTC uses the UTC offset of midnight, not of the rest of the day."""
+    timezone = pytz.timezone('America/New_York')
+    # Daylight saving time starts at 2 AM on 2024-03-10
+    assert time.getLocalMidnightUTC(timezone, datetime.date(2024, 3, 10)) == datetime.datetime(2024, 3, 10, 5, 0, 0, tzinfo=pytz.UTC)
+    assert time.getLocalMidnightUTC(timezone, datetime.date(2024, 3, 11)) == datetime.datetime(2024, 3, 11, 4, 0, 0, tzinfo=pytz.UTC)
+
+
+# --- Tests for planBackfillChunks ---
+
+def test_planBackfillChunks():
+    """Test planBackfillChunks covers the whole range, with a shorter last chunk."""
+    start = datetime.datetime(2024, 1, 1, 0, 0, 0, tzinfo=pytz.UTC)
+    stop = start + datetime.timedelta(hours=30)
+    chunkSize = datetime.timedelta(hours=12)
+
+    assert time.planBackfillChunks(start, stop, chunkSize) == [
+        (start, start + chunkSize),
+        (start + chunkSize, start + 2 * chunkSize),
+        (start + 2 * chunkSize, stop),
+    ]
+    assert time.planBackfillChunks(start, start + chunkSize, chunkSize) == [(start, start + chunkSize)]
+    assert time.planBackfillChunks(stop, stop, chunkSize) == []
+
+
 # --- Tests for calculateHistoryTimeRange ---
 
 @patch('vuegraf.time.getTimezone', return_value=pytz.timezone('America/New_York'))
@@ -159,3 +184,38 @@ def test_calculateHistoryTimeRange_stop_limited_by_now(mock_getTimezone):
 
     assert start_result == expected_start_utc
     assert stop_result == expected_stop_utc
+
+
+def test_getNextTickSecs():
+    # Ticks fall 5 seconds past each minute
+    assert time.getNextTickSecs(1000.0, 60, 5) == 1025
+    assert time.getNextTickSecs(1024.9, 60, 5) == 1025
+    # A time exactly on a tick schedules the following one
+    assert time.getNextTickSecs(1025.0, 60, 5) == 1085
+    assert time.getNextTickSecs(1150.0, 60, 5) == 1205
+    assert time.getNextTickSecs(1150.0, 300, 0) == 1200
+
+
+# --- Tests for planHistoryWindows ---
+
+@patch('vuegraf.time.getTimezone', return_value=pytz.UTC)
+def test_planHistoryWindows(mock_getTimezone):
+    """Test planHistoryWindows covers the history with the largest window of each scale."""
+    now_lag_utc = datetime.datetime(2024, 12, 31, 12, 0, 0, tzinfo=pytz.UTC)
+    start_time_utc = now_lag_utc - datetime.timedelta(days=400)
+
+    windows = time.planHistoryWindows(SAMPLE_CONFIG_VALID_TZ, now_lag_utc, start_time_utc)
+
+    dayWindows = [window for window in windows if window[0] == Scale.DAY.value]
+    hourWindows = [window for window in windows if window[0] == Scale.HOUR.value]
+    assert len(windows) == len(dayWindows) + len(hourWindows)
+    # 401 calendar days need two day windows, but 21 hour windows
+    assert len(dayWindows) == 2
+    assert len(hourWindows) == 21
+    for scaleWindows, windowDays in [(dayWindows, 365), (hourWindows, 20)]:
+        assert scaleWindows[0][1] == datetime.datetime(2023, 11, 27, 0, 0, 0, tzinfo=pytz.UTC)
+        assert scaleWindows[-1][2] == now_lag_utc
+        # Windows are contiguous, and each spans at most its scale's window of days
+        for (_, _, stop), (_, nextStart, _) in zip(scaleWindows, scaleWindows[1:]):
+            assert nextStart - stop == datetime.timedelta(seconds=1)
+        assert all(stop - start < datetime.timedelta(days=windowDays) for _, start, stop in scaleWindows)
@@ -0,0 +1,46 @@
+# Copyright (c) Jason Ertel (jertel).
+# This file is part of the Vuegraf project and is made available under the MIT License.
+
+import datetime
+import importlib
+import sys
+from unittest.mock import patch
+
+import numpy
+import pytest
+
+from vuegraf import usage
+from vuegraf.points import toNanoseconds
+
+
+START = datetime.datetime(2024, 1, 1, 10, 0, 0, tzinfo=datetime.timezone.utc)
+USAGE = [0.001, None, 0.0025, float('nan'), 1, None]
+
+
+@pytest.mark.parametrize('withNumpy', [True, False])
+def test_convert_usage(withNumpy):
+    with patch('vuegraf.usage.numpy', numpy if withNumpy else None):
+        nanoseconds, watts = usage.convertUsage(USAGE, START, 60, 60000.0)
+
+    assert isinstance(nanoseconds, numpy.ndarray) == withNumpy
+    # Values without data, and values that cannot be stored, are dropped
+    startNanoseconds = toNanoseconds(START)
+    assert list(nanoseconds) == [startNanoseconds, startNanoseconds + 120_000_000_000, startNanoseconds + 240_000_000_000]
+    assert list(watts) == [0.001 * 60000.0, 0.0025 * 60000.0, 60000.0]
+
+
+@pytest.mark.parametrize('withNumpy', [True, False])
+def test_convert_empty_usage(withNumpy):
+    with patch('vuegraf.usage.numpy', numpy if withNumpy else None):
+        nanoseconds, watts = usage.convertUsage([None, None], START, 1, 3600000.0)
+
+    assert list(nanoseconds) == []
+    assert list(watts) == []
+
+
+def test_numpy_is_optional():
+    with patch.dict(sys.modules, {'numpy': None}):
+        importlib.reload(usage)
+        assert usage.numpy is None
+    importlib.reload(usage)
+    assert usage.numpy is numpy
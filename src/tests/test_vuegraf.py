@@ -12,6 +12,9 @@ import pytest
 
 # Local imports
 from vuegraf import vuegraf
+from vuegraf.points import Point
+from vuegraf.scheduler import JobScheduler
+from pyemvue.enums import Scale
 
 # Import the module under test *before* mocking sys.modules if they depend on it
 # In this case, vuegraf itself might import pyemvue, so mock first.
@@ -25,30 +28,55 @@ sys.modules['pyemvue.enums'] = MagicMock()
 # Define a dummy config for tests - simplified as getConfigValue will be mocked
 DUMMY_CONFIG = {
     'args': MagicMock(historydays=0),
-    'accounts': [{'email': 'test@example.com'}],
+    'accounts': [{'name': 'Test', 'email': 'test@example.com'}],
     'influx': {'host': 'localhost', 'port': 8086},
     'vue': {'connectTimeoutSecs': 5, 'readTimeoutSecs': 15},
-    'system': {'timezone': 'UTC'}  # Only timezone needed directly by getCurrentDayLocal mock
+    'system': {'timezone': 'UTC'},  # Only timezone needed directly by getCurrentDayLocal mock
+    'maxConcurrentAccounts': 1,
+    'stateFile': None
 }
 
+DISPATCH = JobScheduler.dispatch
+
+
+def dispatch_and_wait(scheduler, now_utc):
+    """Dispatches due jobs and waits for their runs, so loops in a test never overlap job runs."""
+    DISPATCH(scheduler, now_utc)
+    for job in scheduler.jobs:
+        job.executor.submit(lambda: None).result()
+
 
 class TestVuegraf(unittest.TestCase):
     """Test suite for the main vuegraf application logic."""
 
+    def setUp(self):
+        # Devices are discovered by initDeviceAccounts, which the tests mock, so there is nothing to refresh or cache
+        patcher = patch('vuegraf.vuegraf.DeviceRegistry')
+        self.mock_device_registry = patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch('vuegraf.vuegraf.loadDeviceCache', return_value={})
+        self.mock_load_device_cache = patcher.start()
+        self.addCleanup(patcher.stop)
+        # Shutdown cancels job runs not yet started, so every loop waits for the runs it dispatched
+        patcher = patch.object(JobScheduler, 'dispatch', autospec=True, side_effect=dispatch_and_wait)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
     @patch('vuegraf.vuegraf.initConfig')
     @patch('vuegraf.vuegraf.initInfluxConnection')
-    @patch('vuegraf.vuegraf.initDeviceAccount')
+    @patch('vuegraf.vuegraf.initDeviceAccounts')
     @patch('vuegraf.vuegraf.collectUsage')
-    @patch('vuegraf.vuegraf.writeInfluxPoints')
+    @patch('vuegraf.vuegraf.PointWriter')
     @patch('vuegraf.vuegraf.getTimeNow')
     @patch('vuegraf.vuegraf.getCurrentHourUTC')
     @patch('vuegraf.vuegraf.getCurrentDayLocal')
     @patch('vuegraf.vuegraf.pauseEvent')  # Patch the specific pauseEvent instance
     @patch('vuegraf.vuegraf.logger')
     @patch('vuegraf.vuegraf.getConfigValue')  # Mock getConfigValue directly
-    def test_run_single_loop(self, mock_get_config_value, mock_logger,
+    @patch('vuegraf.vuegraf.time')
+    def test_run_single_loop(self, mock_time, mock_get_config_value, mock_logger,
                              mock_pause_event, mock_get_day, mock_get_hour,
-                             mock_get_time, mock_write_points, mock_collect_usage,
+                             mock_get_time, mock_point_writer, mock_collect_usage,
                              mock_init_device, mock_init_influx, mock_init_config):
         """Test a single loop of the run function without history or detailed data."""
 
@@ -60,7 +88,7 @@ class TestVuegraf(unittest.TestCase):
             'detailedDataEnabled': False,
             'detailedDataDaysEnabled': False,
             'detailedDataHoursEnabled': False,
-            'lagSecs': 60
+            'lagSecs': 60, 'writerShutdownDeadlineSecs': 30
         }
 
         def get_config_side_effect(_config, key):
@@ -81,40 +109,50 @@ class TestVuegraf(unittest.TestCase):
         )
         mock_get_hour.return_value = 12
         mock_get_day.return_value = datetime.date(2025, 4, 1)
+        # Jobs are dispatched at 12:00:04
+        mock_time.time.return_value = 1743508804.0
+        mock_time.monotonic.return_value = 0.0
 
         vuegraf.run()
 
         mock_init_config.assert_called_once()
         mock_init_influx.assert_called_once_with(DUMMY_CONFIG)
-        mock_init_device.assert_called_once_with(DUMMY_CONFIG, DUMMY_CONFIG['accounts'][0])
-        mock_collect_usage.assert_called_once()  # Called once for the main interval
-        mock_write_points.assert_called_once()
-        # Check that pauseEvent.wait was called with the correct interval
-        mock_pause_event.wait.assert_called_once_with(config_values['updateIntervalSecs'])
+        mock_init_device.assert_called_once_with(DUMMY_CONFIG, {})
+        self.mock_device_registry.return_value.start.assert_called_once_with(False)
+        self.mock_device_registry.return_value.shutdown.assert_called_once()
+        # Only the minute job is enabled
+        mock_collect_usage.assert_called_once_with(
+            DUMMY_CONFIG, DUMMY_CONFIG['accounts'][0], None,
+            datetime.datetime(2025, 4, 1, 11, 59, 0, tzinfo=datetime.timezone.utc), False, [], None, Scale.MINUTE.value)
+        mock_point_writer.return_value.submit.assert_called_once_with([])
+        # Check that pauseEvent.wait sleeps until lagSecs past the next interval boundary, at 12:01:00
+        mock_pause_event.wait.assert_called_once_with(56.0)
         mock_logger.info.assert_any_call(f'Starting Vuegraf version {vuegraf.__version__}')
         mock_logger.info.assert_any_call('Finished')
 
     @patch('vuegraf.vuegraf.initConfig')
     @patch('vuegraf.vuegraf.initInfluxConnection')
-    @patch('vuegraf.vuegraf.initDeviceAccount')
+    @patch('vuegraf.vuegraf.initDeviceAccounts')
+    @patch('vuegraf.vuegraf.collectUsage')
     @patch('vuegraf.vuegraf.collectHistoryUsage')  # Mock history collection
-    @patch('vuegraf.vuegraf.writeInfluxPoints')
+    @patch('vuegraf.vuegraf.loadHistoryCheckpoint')
+    @patch('vuegraf.vuegraf.PointWriter')
     @patch('vuegraf.vuegraf.getTimeNow')
-    @patch('vuegraf.vuegraf.getCurrentHourUTC')
-    @patch('vuegraf.vuegraf.getCurrentDayLocal')
     @patch('vuegraf.vuegraf.pauseEvent')
     @patch('vuegraf.vuegraf.logger')
     @patch('vuegraf.vuegraf.getConfigValue')
     def test_run_history_collection(self, mock_get_config_value, mock_logger,  # pylint: disable=too-many-locals
-                                    mock_pause_event, mock_get_day, mock_get_hour,
-                                    mock_get_time, mock_write_points,
-                                    mock_collect_history, mock_init_device,
+                                    mock_pause_event, mock_get_time, mock_point_writer, mock_load_checkpoint,
+                                    mock_collect_history, mock_collect_usage, mock_init_device,
                                     mock_init_influx, mock_init_config):
-        """Test the run function when history collection is enabled."""
+        """Test the run function runs a history job, once, alongside the minute job."""
         history_days = 7
         # Modify args mock for this test
         history_config = DUMMY_CONFIG.copy()
         history_config['args'] = MagicMock(historydays=history_days)
+        # The account was cached by a previous run, so is discovered again in the background
+        cached_devices = [MagicMock()]
+        self.mock_load_device_cache.return_value = {'Test': cached_devices, 'Removed': []}
 
         config_values = {
             'maxHistoryDays': 30,
@@ -123,7 +161,7 @@ class TestVuegraf(unittest.TestCase):
             'detailedDataEnabled': False,
             'detailedDataDaysEnabled': False,
             'detailedDataHoursEnabled': False,
-            'lagSecs': 60
+            'lagSecs': 60, 'writerShutdownDeadlineSecs': 30
         }
 
         def get_config_side_effect(_config, key):
@@ -131,65 +169,62 @@ class TestVuegraf(unittest.TestCase):
 
         mock_get_config_value.side_effect = get_config_side_effect
         mock_init_config.return_value = history_config  # Use modified config
-
-        # Stop after one loop
-        mock_pause_event.wait.side_effect = lambda _: setattr(vuegraf, 'running', False)
+        mock_collect_history.return_value = iter([['window1'], ['window2']])
+        mock_checkpoint = mock_load_checkpoint.return_value
+        # A resumed import keeps the start time it was recorded with
+        resumed_history_start = datetime.datetime(2025, 3, 20, 0, 0, 0, tzinfo=datetime.timezone.utc)
+        mock_checkpoint.begin.return_value = resumed_history_start
+
+        # Stop after two loops
+        mock_pause_event.wait.side_effect = lambda _: setattr(vuegraf, 'running', mock_pause_event.wait.call_count < 2)
         start_time = datetime.datetime(2025, 4, 1, 12, 0, 0, tzinfo=datetime.timezone.utc)
         mock_get_time.return_value = start_time
-        mock_get_hour.return_value = 12
-        mock_get_day.return_value = datetime.date(2025, 4, 1)
 
         vuegraf.run()
 
-        mock_init_config.assert_called_once()
         mock_init_influx.assert_called_once_with(history_config)
-        mock_init_device.assert_called_once_with(history_config, history_config['accounts'][0])
-        # Check history collection was called
-        mock_collect_history.assert_called_once()
-        # Check args passed to collectHistoryUsage
-        call_args = mock_collect_history.call_args[0]
-        self.assertEqual(call_args[0], history_config)  # config
-        self.assertEqual(call_args[1], history_config['accounts'][0])  # account
-        # historyStartTimeUTC = nowLagUTC - datetime.timedelta(historyDays)
-        expected_start = (start_time
-                          - datetime.timedelta(seconds=config_values['lagSecs'])
-                          - datetime.timedelta(days=history_days))
-        self.assertEqual(call_args[2], expected_start)  # historyStartTimeUTC
+        mock_init_device.assert_called_once_with(history_config, {'Test': cached_devices, 'Removed': []})
+        self.mock_device_registry.return_value.start.assert_called_once_with(True)
         expected_now_lag = start_time - datetime.timedelta(seconds=config_values['lagSecs'])
-        self.assertEqual(call_args[3], expected_now_lag)  # nowLagUTC
-        self.assertIsInstance(call_args[4], list)  # usageDataPoints
-        self.assertEqual(call_args[5], mock_pause_event)  # pauseEvent
-
-        mock_write_points.assert_called_once()
-        mock_pause_event.wait.assert_called_once_with(config_values['updateIntervalSecs'])
+        expected_history_start = expected_now_lag - datetime.timedelta(days=history_days)
+        mock_load_checkpoint.assert_called_once_with(history_config, mock_point_writer.return_value.flush)
+        mock_checkpoint.begin.assert_called_once_with(history_days, expected_history_start, expected_now_lag, 1)
+        mock_collect_history.assert_called_once_with(
+            history_config, history_config['accounts'][0], resumed_history_start, expected_now_lag, mock_pause_event, mock_checkpoint
+        )
+        self.assertEqual(mock_collect_usage.call_count, 2)
+        # One write per minute job run, and one per history window
+        self.assertEqual(mock_point_writer.return_value.submit.call_count, 4)
+        mock_point_writer.return_value.submit.assert_any_call(['window1'])
+        mock_point_writer.return_value.submit.assert_any_call(['window2'])
         mock_logger.info.assert_any_call(f'Loading historical data; historyDays={history_days}')
 
     @patch('vuegraf.vuegraf.initConfig')
     @patch('vuegraf.vuegraf.initInfluxConnection')
-    @patch('vuegraf.vuegraf.initDeviceAccount')
+    @patch('vuegraf.vuegraf.initDeviceAccounts')
     @patch('vuegraf.vuegraf.collectUsage')
-    @patch('vuegraf.vuegraf.writeInfluxPoints')
+    @patch('vuegraf.vuegraf.PointWriter')
     @patch('vuegraf.vuegraf.getTimeNow')
     @patch('vuegraf.vuegraf.getCurrentHourUTC')
     @patch('vuegraf.vuegraf.getCurrentDayLocal')
     @patch('vuegraf.vuegraf.pauseEvent')
     @patch('vuegraf.vuegraf.logger')
     @patch('vuegraf.vuegraf.getConfigValue')
-    def test_run_hourly_daily_collection(  # pylint: disable=too-many-arguments,too-many-locals,too-many-statements
+    def test_run_hourly_daily_collection(  # pylint: disable=too-many-arguments,too-many-locals
         self, mock_get_config_value, _mock_logger, mock_pause_event,
-        mock_get_day, mock_get_hour, mock_get_time, mock_write_points,
+        mock_get_day, mock_get_hour, mock_get_time, mock_point_writer,
         mock_collect_usage, mock_init_device, mock_init_influx,
         mock_init_config
     ):
-        """Test the run function triggers hourly and daily collection when the hour/day changes."""
+        """Test the hour and day jobs run when the hour/day changes, alongside the minute job."""
         test_config = DUMMY_CONFIG.copy()
         test_config['args'] = MagicMock(historydays=0)  # No history
 
         config_values = {
             'maxHistoryDays': 30, 'updateIntervalSecs': 1,  # Short interval for test
-            'detailedIntervalSecs': 300, 'detailedDataEnabled': True,  # Enable detailed for variety
+            'detailedIntervalSecs': 0, 'detailedDataEnabled': True,  # No second job
             'detailedDataDaysEnabled': True, 'detailedDataHoursEnabled': True,  # Enable hour/day
-            'lagSecs': 60
+            'lagSecs': 60, 'writerShutdownDeadlineSecs': 30
         }
 
         def get_config_side_effect(_config, key):
@@ -200,115 +235,65 @@ class TestVuegraf(unittest.TestCase):
 
         # Simulate time passing and hour/day changing across calls
         start_time = datetime.datetime(2025, 4, 1, 11, 59, 58, tzinfo=datetime.timezone.utc)
-        time_calls = [
-            start_time,  # Initial call
+        mock_get_time.side_effect = [
             start_time + datetime.timedelta(seconds=1),  # Loop 1 time
             start_time + datetime.timedelta(seconds=2)  # Loop 2 time (hour/day change)
         ]
-        hour_calls = [11, 11, 12]  # Initial, Loop 1, Loop 2 (hour changes)
-        # Return timezone-aware datetime objects for daily check
+        mock_get_hour.side_effect = [11, 11, 12]  # Job creation, Loop 1, Loop 2 (hour changes)
         day_calls = [
-            datetime.datetime(2025, 4, 1, 0, 0, 0,
-                              tzinfo=datetime.timezone.utc),  # Initial (use UTC for simplicity)
-            datetime.datetime(2025, 4, 1, 0, 0, 0,
-                              tzinfo=datetime.timezone.utc),  # Loop 1
-            datetime.datetime(2025, 4, 2, 0, 0, 0,
-                              tzinfo=datetime.timezone.utc)  # Loop 2 (day changes)
+            datetime.datetime(2025, 4, 1, 0, 0, 0, tzinfo=datetime.timezone.utc),  # Job creation
+            datetime.datetime(2025, 4, 1, 0, 0, 0, tzinfo=datetime.timezone.utc),  # Loop 1
+            datetime.datetime(2025, 4, 2, 0, 0, 0, tzinfo=datetime.timezone.utc)  # Loop 2 (day changes)
         ]
-        mock_get_time.side_effect = time_calls
-        mock_get_hour.side_effect = hour_calls
-        mock_get_day.side_effect = day_calls  # Now returns datetime objects
+        mock_get_day.side_effect = day_calls
 
         # Stop after the second loop iteration
-        run_count = 0
+        mock_pause_event.wait.side_effect = lambda _: setattr(vuegraf, 'running', mock_pause_event.wait.call_count < 2)
 
-        def wait_side_effect(_timeout):
-            nonlocal run_count
-            run_count += 1
-            if run_count >= 2:
-                setattr(vuegraf, 'running', False)
-            return True
-        mock_pause_event.wait.side_effect = wait_side_effect
-
-        # Mock Scale enum values needed
-        Scale = MagicMock()  # pylint: disable=invalid-name
-        Scale.MINUTE.value = '1MIN'
-        Scale.HOUR.value = '1H'
-        Scale.DAY.value = '1D'
-        with patch('vuegraf.vuegraf.Scale', Scale):
-            vuegraf.run()
+        vuegraf.run()
 
-        # Assertions
         self.assertEqual(mock_init_config.call_count, 1)
         self.assertEqual(mock_init_influx.call_count, 1)
-        # initDeviceAccount called once per loop iteration
-        self.assertEqual(mock_init_device.call_count, 2)
-        # writeInfluxPoints called once per loop iteration
-        self.assertEqual(mock_write_points.call_count, 2)
-        # pauseEvent.wait called once per loop iteration
+        mock_init_device.assert_called_once()
+        # Two minute job runs, one hour job run and one day job run
+        self.assertEqual(mock_point_writer.return_value.submit.call_count, 4)
         self.assertEqual(mock_pause_event.wait.call_count, 2)
+        self.assertEqual(mock_collect_usage.call_count, 4)
 
-        # Check collectUsage calls
-        # Loop 1: Regular minute collection (collectDetails=False)
-        # Loop 2: Regular minute collection (collectDetails=False)
-        #         + Hour collection + Day collection
-        self.assertEqual(mock_collect_usage.call_count, 4)  # 1 (Loop1) + 3 (Loop2) = 4 calls
-
-        # Call 1 (Loop 1): Minute scale
-        args_loop1 = mock_collect_usage.call_args_list[0][0]
-        self.assertEqual(args_loop1[7], Scale.MINUTE.value)  # Scale arg (index 7)
-        self.assertFalse(args_loop1[4])  # collectDetails should be False in loop 1
-
-        # Calls in Loop 2 (indices 1, 2, 3)
-        call_args_loop2 = [call[0] for call in mock_collect_usage.call_args_list[1:]]
-
-        # Find the minute, hour, and day calls within loop 2
-        minute_call_l2 = next(
-            (args for args in call_args_loop2 if args[7] == Scale.MINUTE.value), None
-        )
-        hour_call_l2 = next(
-            (args for args in call_args_loop2 if args[7] == Scale.HOUR.value), None
-        )
-        day_call_l2 = next(
-            (args for args in call_args_loop2 if args[7] == Scale.DAY.value), None
-        )
-
-        self.assertIsNotNone(minute_call_l2, "Minute scale collection call not found in loop 2")
-        self.assertIsNotNone(hour_call_l2, "Hour scale collection call not found in loop 2")
-        self.assertIsNotNone(day_call_l2, "Day scale collection call not found in loop 2")
-
-        # Check args for Minute call in Loop 2
-        self.assertFalse(minute_call_l2[4])  # collectDetails should be False
+        calls_by_scale = {}
+        for collect_call in mock_collect_usage.call_args_list:
+            calls_by_scale.setdefault(collect_call[0][7], []).append(collect_call[0])
+        self.assertEqual(len(calls_by_scale[Scale.MINUTE.value]), 2)
+        self.assertFalse(calls_by_scale[Scale.MINUTE.value][0][4])  # collectDetails should be False
 
         # Check args for Hour call (prevHourUTC should be 11)
-        self.assertEqual(hour_call_l2[2], 11)  # prevHourUTC
-        self.assertEqual(hour_call_l2[3], 11)  # prevHourUTC
-        self.assertFalse(hour_call_l2[4])  # collectDetails = False
-        self.assertIsNone(hour_call_l2[6])  # detailedStartTimeUTC = None
+        hour_call = calls_by_scale[Scale.HOUR.value][0]
+        self.assertEqual(hour_call[2], 11)  # prevHourUTC
+        self.assertEqual(hour_call[3], 11)  # prevHourUTC
+        self.assertFalse(hour_call[4])  # collectDetails = False
+        self.assertIsNone(hour_call[6])  # detailedStartTimeUTC = None
 
         # Check args for Day call (prevDayLocal should be 2025-04-01 datetime obj)
-        expected_prev_day_dt = day_calls[1]  # The day returned before the change
-        self.assertEqual(day_call_l2[2], expected_prev_day_dt)  # prevDayUTC (converted internally)
-        self.assertEqual(day_call_l2[3], expected_prev_day_dt)  # prevDayUTC (converted internally)
-        self.assertFalse(day_call_l2[4])  # collectDetails = False
-        self.assertIsNone(day_call_l2[6])  # detailedStartTimeUTC = None
+        day_call = calls_by_scale[Scale.DAY.value][0]
+        self.assertEqual(day_call[2], day_calls[1])  # prevDayUTC (converted internally)
+        self.assertEqual(day_call[3], day_calls[1])  # prevDayUTC (converted internally)
+        self.assertFalse(day_call[4])  # collectDetails = False
+        self.assertIsNone(day_call[6])  # detailedStartTimeUTC = None
 
     @patch('vuegraf.vuegraf.initConfig')
     @patch('vuegraf.vuegraf.initInfluxConnection')
-    @patch('vuegraf.vuegraf.initDeviceAccount')
+    @patch('vuegraf.vuegraf.initDeviceAccounts')
     @patch('vuegraf.vuegraf.collectUsage')  # Mock to raise exception
-    @patch('vuegraf.vuegraf.writeInfluxPoints')
+    @patch('vuegraf.vuegraf.PointWriter')
     @patch('vuegraf.vuegraf.getTimeNow')
-    @patch('vuegraf.vuegraf.getCurrentHourUTC')
-    @patch('vuegraf.vuegraf.getCurrentDayLocal')
     @patch('vuegraf.vuegraf.pauseEvent')
-    @patch('vuegraf.vuegraf.logger')
+    @patch('vuegraf.scheduler.logger')
     @patch('vuegraf.vuegraf.getConfigValue')
     @patch('traceback.print_exc')  # Mock traceback printing
     def test_run_collection_exception(  # pylint: disable=too-many-arguments,too-many-locals
-        self, mock_print_exc, mock_get_config_value, mock_logger,
-        mock_pause_event, mock_get_day, mock_get_hour, mock_get_time,
-        mock_write_points, mock_collect_usage, mock_init_device,
+        self, mock_print_exc, mock_get_config_value, mock_scheduler_logger,
+        mock_pause_event, mock_get_time,
+        mock_point_writer, mock_collect_usage, mock_init_device,
         mock_init_influx, mock_init_config
     ):
         """Test the run function handles exceptions during usage collection."""
@@ -319,7 +304,7 @@ class TestVuegraf(unittest.TestCase):
             'maxHistoryDays': 30, 'updateIntervalSecs': 60,
             'detailedIntervalSecs': 300, 'detailedDataEnabled': False,
             'detailedDataDaysEnabled': False, 'detailedDataHoursEnabled': False,
-            'lagSecs': 60
+            'lagSecs': 60, 'writerShutdownDeadlineSecs': 30
         }
         mock_get_config_value.side_effect = (
             lambda cfg, key: config_values.get(key, MagicMock())
@@ -336,8 +321,6 @@ class TestVuegraf(unittest.TestCase):
         mock_get_time.return_value = datetime.datetime(
             2025, 4, 1, 12, 0, 0, tzinfo=datetime.timezone.utc
         )
-        mock_get_hour.return_value = 12
-        mock_get_day.return_value = datetime.date(2025, 4, 1)
 
         vuegraf.run()
 
@@ -345,34 +328,29 @@ class TestVuegraf(unittest.TestCase):
         mock_init_config.assert_called_once()
         mock_init_influx.assert_called_once()
         mock_init_device.assert_called_once()
-        mock_collect_usage.assert_called_once()  # Should still be called once
+        mock_collect_usage.assert_called_once()  # The minute job is not retried
         # writeInfluxPoints should still be called, even if collection failed for one account
-        # (assuming it might have collected data before the exception or for other accounts if multiple were present)
-        # In this test setup, it's called with an empty list.
-        mock_write_points.assert_called_once_with(test_config, [])
+        mock_point_writer.return_value.submit.assert_called_once_with([])
         mock_pause_event.wait.assert_called_once()
         # Check that the error was logged and traceback printed
-        mock_logger.error.assert_called_once()
-        self.assertIn('Failed to record new usage data', mock_logger.error.call_args[0][0])
+        mock_scheduler_logger.error.assert_called_once()
+        self.assertIn('Failed to record new usage data', mock_scheduler_logger.error.call_args[0][0])
         mock_print_exc.assert_called_once()
 
     @patch('vuegraf.vuegraf.initConfig')
     @patch('vuegraf.vuegraf.initInfluxConnection')
-    @patch('vuegraf.vuegraf.initDeviceAccount')
+    @patch('vuegraf.vuegraf.initDeviceAccounts')
     @patch('vuegraf.vuegraf.collectUsage')
-    @patch('vuegraf.vuegraf.writeInfluxPoints')
+    @patch('vuegraf.vuegraf.PointWriter')
     @patch('vuegraf.vuegraf.getTimeNow')
-    @patch('vuegraf.vuegraf.getCurrentHourUTC')
-    @patch('vuegraf.vuegraf.getCurrentDayLocal')
     @patch('vuegraf.vuegraf.pauseEvent')
-    @patch('vuegraf.vuegraf.logger')
     @patch('vuegraf.vuegraf.getConfigValue')
     def test_run_detailed_collection(  # pylint: disable=too-many-arguments,too-many-locals
-            self, mock_get_config_value, mock_logger, mock_pause_event,
-            mock_get_day, mock_get_hour, mock_get_time, mock_write_points,
+            self, mock_get_config_value, mock_pause_event,
+            mock_get_time, mock_point_writer,
             mock_collect_usage, mock_init_device, mock_init_influx,
             mock_init_config):
-        """Test the run function when detailed data collection is enabled and triggered."""
+        """Test the second job runs on its own once the detailed interval has passed."""
         test_config = DUMMY_CONFIG.copy()
         test_config['args'] = MagicMock(historydays=0)
 
@@ -380,126 +358,167 @@ class TestVuegraf(unittest.TestCase):
             'maxHistoryDays': 30, 'updateIntervalSecs': 60,
             'detailedIntervalSecs': 10,  # Short interval to trigger collection
             'detailedDataEnabled': True,  # Enable detailed data
+            'detailedDataSecondsEnabled': True,
             'detailedDataDaysEnabled': False,  # Keep these false for simplicity
             'detailedDataHoursEnabled': False,
-            'lagSecs': 5  # Short lag
+            'lagSecs': 5,  # Short lag
+            'writerShutdownDeadlineSecs': 30
         }
         mock_get_config_value.side_effect = lambda cfg, key: config_values.get(key, MagicMock())
         mock_init_config.return_value = test_config
 
-        # Stop after one loop
-        mock_pause_event.wait.side_effect = lambda _: setattr(vuegraf, 'running', False)
+        # Stop after two loops
+        mock_pause_event.wait.side_effect = lambda _: setattr(vuegraf, 'running', mock_pause_event.wait.call_count < 2)
 
-        # Set time such that detailed collection should trigger
-        # detailedStartTimeUTC is initialized to nowUTC at the start
-        # collectDetails = (detailedDataEnabled and detailedIntervalSecs > 0 and
-        #                   secondsSinceLastDetailCollection >= detailedIntervalSecs)
-        # secondsSinceLastDetailCollection = (nowLagUTC - detailedStartTimeUTC).total_seconds()
-        # We need nowLagUTC >= detailedStartTimeUTC + detailedIntervalSecs
+        # The detailed start time is taken when the job is created. The first loop is within the detailed
+        # interval, the second is 20 seconds later, past it.
         initial_start_time = datetime.datetime(2025, 4, 1, 12, 0, 0, tzinfo=datetime.timezone.utc)
-        # detailedStartTimeUTC is set to the *first* call to getTimeNow
-        # nowUTC in the loop is the *second* call to getTimeNow
-        # Let the second call be 20 seconds after the first to ensure the interval is exceeded
         loop_now_utc = initial_start_time + datetime.timedelta(seconds=20)
-        mock_get_time.side_effect = [initial_start_time, loop_now_utc]
-
-        mock_get_hour.return_value = 12  # Only called once in this test setup
-        mock_get_day.return_value = datetime.date(2025, 4, 1)  # Only called once
+        mock_get_time.side_effect = [initial_start_time, initial_start_time, loop_now_utc]
 
-        # Mock Scale enum
-        Scale = MagicMock()  # pylint: disable=invalid-name
-        Scale.MINUTE.value = '1MIN'
-        with patch('vuegraf.vuegraf.Scale', Scale):
-            vuegraf.run()
+        vuegraf.run()
 
-        # Assertions
-        mock_init_config.assert_called_once()
-        mock_init_influx.assert_called_once()
         mock_init_device.assert_called_once()
-        mock_write_points.assert_called_once()
-        mock_pause_event.wait.assert_called_once()
-
-        # Check collectUsage was called with collectDetails=True
-        mock_collect_usage.assert_called_once()
-        call_args = mock_collect_usage.call_args[0]
-        self.assertTrue(call_args[4])  # collectDetails should be True
-
-        # Check logger debug message confirms detail collection
-        mock_logger.debug.assert_called_once()
-        self.assertIn('collectDetails=True', mock_logger.debug.call_args[0][0])
+        minute_calls = [c[0] for c in mock_collect_usage.call_args_list if c[0][7] == Scale.MINUTE.value]
+        second_calls = [c[0] for c in mock_collect_usage.call_args_list if c[0][7] == Scale.SECOND.value]
+        self.assertEqual(len(minute_calls), 2)
+        self.assertFalse(minute_calls[0][4])  # Minute job never collects details
+        self.assertEqual(len(second_calls), 1)
+        self.assertTrue(second_calls[0][4])  # collectDetails should be True
+        self.assertEqual(second_calls[0][3], loop_now_utc - datetime.timedelta(seconds=5))
+        self.assertEqual(second_calls[0][6], initial_start_time)  # detailedStartTimeUTC
+        self.assertEqual(mock_point_writer.return_value.submit.call_count, 3)
 
     @patch('vuegraf.vuegraf.initConfig')
     @patch('vuegraf.vuegraf.initInfluxConnection')
-    @patch('vuegraf.vuegraf.initDeviceAccount')  # Mock to trigger exit
+    @patch('vuegraf.vuegraf.initDeviceAccounts')
     @patch('vuegraf.vuegraf.collectUsage')
-    @patch('vuegraf.vuegraf.writeInfluxPoints')
+    @patch('vuegraf.vuegraf.PointWriter')
     @patch('vuegraf.vuegraf.getTimeNow')
-    @patch('vuegraf.vuegraf.getCurrentHourUTC')
-    @patch('vuegraf.vuegraf.getCurrentDayLocal')
     @patch('vuegraf.vuegraf.pauseEvent')
-    @patch('vuegraf.vuegraf.logger')
+    @patch('vuegraf.scheduler.logger')
     @patch('vuegraf.vuegraf.getConfigValue')
-    def test_run_stops_during_account_loop(  # pylint: disable=too-many-arguments
-        self, mock_get_config_value, mock_logger, mock_pause_event,
-        mock_get_day, mock_get_hour, mock_get_time, mock_write_points,
-        mock_collect_usage, mock_init_device, mock_init_influx,
-        mock_init_config
+    @patch('traceback.print_exc')
+    def test_run_concurrent_accounts(  # pylint: disable=too-many-arguments,too-many-locals
+        self, _mock_print_exc, mock_get_config_value, mock_scheduler_logger,
+        mock_pause_event, mock_get_time,
+        mock_point_writer, mock_collect_usage, mock_init_device,
+        _mock_init_influx, mock_init_config
     ):
-        """Test the run function exits loop if running becomes False during account processing."""
-        # Config with multiple accounts to ensure the loop runs more than once if not stopped
+        """Test accounts are collected on a worker pool, merged in account order, with failures isolated per account."""
         test_config = {
             'args': MagicMock(historydays=0),
-            'accounts': [{'email': 'test1@example.com'}, {'email': 'test2@example.com'}],
-            'influx': {'host': 'localhost', 'port': 8086},
-            'vue': {'connectTimeoutSecs': 5, 'readTimeoutSecs': 15},
-            'system': {'timezone': 'UTC'}
+            'accounts': [{'name': 'first'}, {'name': 'failing'}, {'name': 'last'}],
+            'stateFile': None,
+            'maxConcurrentAccounts': 3,
+        }
+        config_values = {
+            'maxHistoryDays': 30, 'updateIntervalSecs': 60,
+            'detailedIntervalSecs': 300, 'detailedDataEnabled': False,
+            'detailedDataDaysEnabled': False, 'detailedDataHoursEnabled': False,
+            'lagSecs': 60, 'writerShutdownDeadlineSecs': 30
         }
+        mock_get_config_value.side_effect = lambda cfg, key: config_values.get(key, MagicMock())
+        mock_init_config.return_value = test_config
+
+        def collect_side_effect(_config, account, *args):
+            if account['name'] == 'failing':
+                raise ValueError('Collection failed')
+            args[3].append(Point(account['name'], 'Device', 'Channel', 1.0, args[1], 'False'))
+        mock_collect_usage.side_effect = collect_side_effect
+
+        mock_pause_event.wait.side_effect = lambda _: setattr(vuegraf, 'running', False)
+        mock_get_time.return_value = datetime.datetime(2025, 4, 1, 12, 0, 0, tzinfo=datetime.timezone.utc)
+
+        vuegraf.run()
+
+        mock_init_device.assert_called_once()
+        self.assertEqual(mock_collect_usage.call_count, 3)
+        mock_point_writer.return_value.submit.assert_called_once()
+        submitted = mock_point_writer.return_value.submit.call_args[0][0]
+        self.assertEqual([pt.accountName for pt in submitted], ['first', 'last'])
+        mock_scheduler_logger.error.assert_called_once()
+        self.assertIn('Failed to record new usage data', mock_scheduler_logger.error.call_args[0][0])
 
+    @patch('vuegraf.vuegraf.initConfig')
+    @patch('vuegraf.vuegraf.initInfluxConnection')
+    @patch('vuegraf.vuegraf.initDeviceAccounts')
+    @patch('vuegraf.vuegraf.collectUsage')
+    @patch('vuegraf.vuegraf.PointWriter')
+    @patch('vuegraf.vuegraf.loadState')
+    @patch('vuegraf.vuegraf.saveState')
+    @patch('vuegraf.vuegraf.getTimeNow')
+    @patch('vuegraf.vuegraf.pauseEvent')
+    @patch('vuegraf.vuegraf.getConfigValue')
+    def test_run_persists_state(  # pylint: disable=too-many-arguments,too-many-locals
+        self, mock_get_config_value, mock_pause_event, mock_get_time,
+        mock_save_state, mock_load_state, mock_point_writer,
+        _mock_collect_usage, _mock_init_device, _mock_init_influx,
+        mock_init_config
+    ):
+        """Test the run function loads state at startup, and saves it at shutdown once queued points are written."""
+        test_config = DUMMY_CONFIG.copy()
         config_values = {
             'maxHistoryDays': 30, 'updateIntervalSecs': 60,
             'detailedIntervalSecs': 300, 'detailedDataEnabled': False,
             'detailedDataDaysEnabled': False, 'detailedDataHoursEnabled': False,
-            'lagSecs': 60
+            'lagSecs': 60, 'writerShutdownDeadlineSecs': 30
         }
         mock_get_config_value.side_effect = lambda cfg, key: config_values.get(key, MagicMock())
         mock_init_config.return_value = test_config
+        mock_pause_event.wait.side_effect = lambda _: setattr(vuegraf, 'running', False)
+        mock_get_time.return_value = datetime.datetime(2025, 4, 1, 12, 0, 0, tzinfo=datetime.timezone.utc)
 
-        # Make initDeviceAccount stop the run after the first account
-        def init_device_side_effect(_config, account):
-            if account['email'] == 'test1@example.com':
-                # Simulate signal received after processing first account
-                vuegraf.handleExitSignal(signal.SIGINT, None)
-            # Add a return value or further side effect if needed by subsequent code
-            return MagicMock()
+        vuegraf.run()
 
-        mock_init_device.side_effect = init_device_side_effect
+        mock_load_state.assert_called_once_with(test_config)
+        mock_point_writer.assert_called_once_with(test_config)
+        mock_point_writer.return_value.submit.assert_called_once()
+        # The writer saves state after each write; run saves it once more after the writer drained
+        # Stopping the jobs and the device registry takes from the same shutdown deadline
+        mock_point_writer.return_value.shutdown.assert_called_once()
+        assert 15 <= mock_point_writer.return_value.shutdown.call_args[0][0] <= config_values['writerShutdownDeadlineSecs']
+        mock_save_state.assert_called_once_with(test_config)
 
-        # pauseEvent.wait *will* be called once at the end of the main loop iteration,
-        # even though running is now False. The while condition is checked next time.
-        # Let the wait call succeed but do nothing else.
-        mock_pause_event.wait.return_value = True  # Simulate wait completing
+    @patch('vuegraf.vuegraf.initConfig')
+    @patch('vuegraf.vuegraf.initInfluxConnection')
+    @patch('vuegraf.vuegraf.initDeviceAccounts')
+    @patch('vuegraf.vuegraf.collectUsage')
+    @patch('vuegraf.vuegraf.PointWriter')
+    @patch('vuegraf.vuegraf.getTimeNow')
+    @patch('vuegraf.vuegraf.getCurrentHourUTC')
+    @patch('vuegraf.vuegraf.getCurrentDayLocal')
+    @patch('vuegraf.vuegraf.pauseEvent')
+    @patch('vuegraf.vuegraf.logger')
+    @patch('vuegraf.vuegraf.getConfigValue')
+    @patch('vuegraf.vuegraf.time')
+    def test_run_aligned_schedule(  # pylint: disable=too-many-arguments,too-many-locals
+        self, mock_time, mock_get_config_value, mock_logger, mock_pause_event,
+        _mock_get_day, _mock_get_hour, mock_get_time, _mock_point_writer,
+        _mock_collect_usage, _mock_init_device, _mock_init_influx, mock_init_config
+    ):
+        """Test jobs are dispatched on interval boundaries plus lagSecs, skipping missed ticks."""
+        config_values = {
+            'maxHistoryDays': 30, 'updateIntervalSecs': 60,
+            'detailedIntervalSecs': 300, 'detailedDataEnabled': False,
+            'detailedDataDaysEnabled': False, 'detailedDataHoursEnabled': False,
+            'lagSecs': 5, 'writerShutdownDeadlineSecs': 30
+        }
+        mock_get_config_value.side_effect = lambda cfg, key: config_values.get(key, MagicMock())
+        mock_init_config.return_value = DUMMY_CONFIG.copy()
+        mock_get_time.return_value = datetime.datetime(2025, 4, 1, 12, 0, 0, tzinfo=datetime.timezone.utc)
+        mock_pause_event.wait.side_effect = lambda _: setattr(vuegraf, 'running', mock_pause_event.wait.call_count < 3)
 
-        mock_get_time.return_value = datetime.datetime(
-            2025, 4, 1, 12, 0, 0, tzinfo=datetime.timezone.utc
-        )
-        mock_get_hour.return_value = 12
-        mock_get_day.return_value = datetime.date(2025, 4, 1)
+        # Dispatch times of three loops: an early one, one delayed past two ticks,
+        # and one woken a moment before its tick.
+        mock_time.time.side_effect = [1010.0, 1150.0, 1204.95]
+        mock_time.monotonic.return_value = 0.0
 
         vuegraf.run()
 
-        # Assertions
-        mock_init_config.assert_called_once()
-        mock_init_influx.assert_called_once()
-        # initDeviceAccount should only be called for the first account
-        mock_init_device.assert_called_once_with(test_config, test_config['accounts'][0])
-        # collectUsage should only be called for the first account
-        mock_collect_usage.assert_called_once()
-        # writeInfluxPoints should still be called once at the end of the loop iteration
-        mock_write_points.assert_called_once()
-        # pauseEvent.wait *is* called once at the end of the iteration where running became False
-        mock_pause_event.wait.assert_called_once()
-        mock_logger.error.assert_called_once_with('Caught exit signal')  # From handleExitSignal
-        mock_logger.info.assert_any_call('Finished')  # Should still log Finished
+        waits = [c[0][0] for c in mock_pause_event.wait.call_args_list]
+        self.assertEqual(waits, [pytest.approx(15.0), pytest.approx(55.0), pytest.approx(60.05)])
+        mock_logger.warning.assert_called_once_with('Scheduler overran the update interval; overrunSecs=65.0; skippedTicks=2')
 
     @patch('vuegraf.vuegraf.run')
     @patch('vuegraf.vuegraf.signal.signal')  # Keep patch to verify calls
@@ -509,7 +528,8 @@ class TestVuegraf(unittest.TestCase):
         # Verify that signal.signal was called with the correct arguments
         mock_signal_func.assert_has_calls([
             call(signal.SIGINT, vuegraf.handleExitSignal),
-            call(signal.SIGHUP, vuegraf.handleExitSignal)
+            call(signal.SIGHUP, vuegraf.handleExitSignal),
+            call(signal.SIGTERM, vuegraf.handleExitSignal)
         ], any_order=True)  # Use any_order=True as order might not be guaranteed
         mock_run.assert_called_once()
 
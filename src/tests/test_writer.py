@@ -0,0 +1,289 @@
+# Copyright (c) Jason Ertel (jertel).
+# This file is part of the Vuegraf project and is made available under the MIT License.
+
+import datetime
+import threading
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from vuegraf.collect import Point
+from vuegraf.writer import PointWriter
+
+
+TIMESTAMP = datetime.datetime(2025, 4, 1, 12, 0, 0, tzinfo=datetime.timezone.utc)
+
+
+SAMPLE_CONFIG = {
+    'influxDb': {},
+    'writerQueueSize': 100,
+    'writerBatchSize': 100,
+    'writerBatchAgeSecs': 60,
+    'writerBackpressure': 'block',
+    'writerSpillFile': None,
+    'spoolDir': None,
+}
+
+
+def newPoint(chanName, detailed='False'):
+    return Point('Account', 'Device', chanName, 100.0, TIMESTAMP, detailed)
+
+
+def queuedPoints(writer):
+    return [pt for submitSecs, batch in writer.queue for pt in batch]
+
+
+@pytest.fixture
+def mock_write():
+    with patch('vuegraf.writer.writeInfluxPoints') as mock_write, patch('vuegraf.writer.saveState'):
+        yield mock_write
+
+
+def test_invalid_backpressure():
+    with pytest.raises(ValueError):
+        PointWriter(dict(SAMPLE_CONFIG, writerBackpressure='wait'))
+    with pytest.raises(ValueError):
+        PointWriter(dict(SAMPLE_CONFIG, writerBackpressure='spill'))
+
+
+def test_batches_by_size_and_drains_on_shutdown(mock_write):
+    config = dict(SAMPLE_CONFIG, writerBatchSize=2)
+    writer = PointWriter(config)
+    points = [newPoint(str(i)) for i in range(5)]
+
+    writer.submit(points)
+    writer.start()
+    writer.shutdown(5)
+
+    assert [c[0][1] for c in mock_write.call_args_list] == [points[0:2], points[2:4], points[4:5]]
+    assert not writer.thread.is_alive()
+
+
+def test_batches_by_age(mock_write):
+    written = threading.Event()
+    mock_write.side_effect = lambda config, batch: written.set()
+    writer = PointWriter(dict(SAMPLE_CONFIG, writerBatchAgeSecs=0.05))
+    writer.start()
+
+    writer.submit([newPoint('1')])
+
+    assert written.wait(5)
+    mock_write.assert_called_once_with(writer.config, [newPoint('1')])
+    writer.shutdown(5)
+
+
+def test_block_waits_for_room(mock_write):
+    writer = PointWriter(dict(SAMPLE_CONFIG, writerQueueSize=2, writerBatchSize=2, writerBatchAgeSecs=0))
+    writer.submit([newPoint('1'), newPoint('2')])
+    submitted = threading.Event()
+
+    def submitter():
+        writer.submit([newPoint('3')])
+        submitted.set()
+
+    thread = threading.Thread(target=submitter)
+    thread.start()
+    assert not submitted.wait(0.1)
+
+    writer.start()
+    assert submitted.wait(5)
+    thread.join()
+    writer.shutdown(5)
+    assert [c[0][1] for c in mock_write.call_args_list] == [[newPoint('1'), newPoint('2')], [newPoint('3')]]
+
+
+def test_oversized_submission_accepted_when_empty(mock_write):
+    writer = PointWriter(dict(SAMPLE_CONFIG, writerQueueSize=2))
+    points = [newPoint(str(i)) for i in range(3)]
+
+    writer.submit(points)
+
+    assert queuedPoints(writer) == points
+
+
+@patch('vuegraf.writer.logger')
+def test_drop_discards_second_points_first(mock_logger, mock_write):
+    writer = PointWriter(dict(SAMPLE_CONFIG, writerQueueSize=3, writerBackpressure='drop'))
+    writer.submit([newPoint('s1', 'True'), newPoint('m1'), newPoint('s2', 'True')])
+
+    writer.submit([newPoint('m2'), newPoint('s3', 'True')])
+
+    assert [pt.chanName for pt in queuedPoints(writer)] == ['m1', 'm2', 's3']
+    mock_logger.warning.assert_called_once_with('Point queue is full, dropped second-level points; dropped=2')
+
+    # Submitted second points are dropped once the queue holds no more
+    writer.submit([newPoint('s4', 'True'), newPoint('s5', 'True')])
+    assert [pt.chanName for pt in queuedPoints(writer)] == ['m1', 'm2', 's5']
+    assert writer.queuedPoints == 3
+
+    # Empty submissions are not queued
+    writer.submit([])
+    assert len(writer.queue) == 3
+
+    # A queued submission left without points is removed
+    writer.submit([newPoint('m3')])
+    assert [[pt.chanName for pt in batch] for submitSecs, batch in writer.queue] == [['m1'], ['m2'], ['m3']]
+
+
+@patch('vuegraf.writer.logger')
+def test_spill_overflow_and_replay(mock_logger, mock_write, tmp_path):
+    spillFile = str(tmp_path / 'spill.jsonl')
+    writer = PointWriter(dict(SAMPLE_CONFIG, writerQueueSize=2, writerBatchSize=2, writerBackpressure='spill', writerSpillFile=spillFile))
+    points = [newPoint('1'), newPoint('2'), newPoint('3', 'True')]
+    replayed = threading.Event()
+    mock_write.side_effect = lambda config, batch: replayed.set() if batch == points[2:] else None
+
+    writer.submit(points)
+
+    assert queuedPoints(writer) == points[:2]
+    with open(spillFile) as f:
+        assert len(f.readlines()) == 1
+
+    # Spilled points are written once the queue drains
+    writer.start()
+    assert replayed.wait(5)
+    writer.shutdown(5)
+
+    assert [c[0][1] for c in mock_write.call_args_list] == [points[:2], points[2:]]
+    assert not (tmp_path / 'spill.jsonl').exists()
+    mock_logger.info.assert_called_once_with('Writing spilled points; points=1')
+
+
+def test_replays_spill_file_left_by_previous_run(mock_write, tmp_path):
+    spillFile = tmp_path / 'spill.jsonl'
+    spillFile.write_text('["Account", "Device", "1", 100.0, "2025-04-01T12:00:00+00:00", "False"]\n')
+    written = threading.Event()
+    mock_write.side_effect = lambda config, batch: written.set()
+
+    writer = PointWriter(dict(SAMPLE_CONFIG, writerSpillFile=str(spillFile)))
+    writer.start()
+
+    assert written.wait(5)
+    mock_write.assert_called_once_with(writer.config, [newPoint('1')])
+    writer.shutdown(5)
+
+
+@patch('vuegraf.writer.logger')
+@patch('traceback.print_exc')
+def test_write_failure_is_logged(mock_print_exc, mock_logger, mock_write):
+    mock_write.side_effect = [ValueError('database down'), None]
+    writer = PointWriter(dict(SAMPLE_CONFIG, writerBatchSize=1))
+    writer.submit([newPoint('1'), newPoint('2')])
+
+    writer.start()
+    writer.shutdown(5)
+
+    assert mock_write.call_count == 2
+    mock_logger.error.assert_called_once()
+    assert 'Failed to write points to the database; points=1' in mock_logger.error.call_args[0][0]
+    mock_print_exc.assert_called_once()
+
+
+@pytest.mark.parametrize('spill,queuedPoints', [(False, 3), (True, 3), (True, 1)])
+@patch('vuegraf.writer.logger')
+def test_shutdown_deadline(mock_logger, spill, queuedPoints, mock_write, tmp_path):
+    release = threading.Event()
+    writing = threading.Event()
+
+    def slow_write(config, batch):
+        writing.set()
+        release.wait(5)
+    mock_write.side_effect = slow_write
+
+    spillFile = str(tmp_path / 'spill.jsonl') if spill else None
+    writer = PointWriter(dict(SAMPLE_CONFIG, writerBatchSize=1, writerBatchAgeSecs=0, writerSpillFile=spillFile))
+    writer.submit([newPoint(str(i)) for i in range(queuedPoints)])
+    writer.start()
+    assert writing.wait(5)
+
+    writer.shutdown(0.05)
+    release.set()
+    writer.thread.join(5)
+
+    assert mock_write.call_count == 1
+    if spill:
+        spilledPoints = 0
+        if queuedPoints > 1:
+            with open(spillFile) as f:
+                spilledPoints = len(f.readlines())
+        assert spilledPoints == queuedPoints - 1
+        mock_logger.error.assert_not_called()
+    else:
+        mock_logger.error.assert_called_once_with('Timed out writing queued points to the database; lostPoints=2')
+
+
+@pytest.mark.parametrize('dryrun', [False, True])
+@patch('vuegraf.spool.writeInfluxLines')
+def test_spool_writes(mock_write_lines, dryrun, mock_write, tmp_path):
+    config = dict(SAMPLE_CONFIG, spoolDir=str(tmp_path / 'spool'), spoolSegmentBytes=1024, spoolRetrySecs=0, spoolReplayBatchesPerSec=0,
+                  addStationField=False, args=MagicMock(debug=False, dryrun=dryrun))
+    writer = PointWriter(config)
+    writer.submit([newPoint('1')])
+
+    writer.start()
+    writer.shutdown(5)
+
+    if dryrun:
+        # Nothing is spooled in dryrun mode
+        assert writer.spool is None
+        mock_write.assert_called_once_with(config, [newPoint('1')])
+        mock_write_lines.assert_not_called()
+    else:
+        mock_write.assert_not_called()
+        mock_write_lines.assert_called_once_with(
+            config, ['energy_usage,account_name=Account,detailed=False,device_name=1 usage=100 1743508800000000000'])
+        assert writer.spool.backlog == 0
+        assert not writer.replayer.thread.is_alive()
+
+
+def test_flush_waits_for_written_points(mock_write):
+    writing = threading.Event()
+    release = threading.Event()
+
+    def slow_write(config, batch):
+        writing.set()
+        release.wait(5)
+    mock_write.side_effect = slow_write
+    writer = PointWriter(dict(SAMPLE_CONFIG, writerBatchAgeSecs=0))
+    # Nothing is queued, so there is nothing to wait for
+    assert writer.flush()
+    writer.start()
+    writer.submit([newPoint('1')])
+    assert writing.wait(5)
+
+    flushed = []
+    flusher = threading.Thread(target=lambda: flushed.append(writer.flush()))
+    flusher.start()
+    flusher.join(0.05)
+    assert flusher.is_alive()
+
+    release.set()
+    flusher.join(5)
+    assert flushed == [True]
+    writer.shutdown(5)
+
+
+@patch('vuegraf.writer.logger')
+@patch('traceback.print_exc')
+def test_flush_reports_write_failures(_mock_print_exc, _mock_logger, mock_write):
+    release = threading.Event()
+
+    def failing_write(config, batch):
+        release.wait(5)
+        raise ValueError('database down')
+    mock_write.side_effect = failing_write
+    writer = PointWriter(dict(SAMPLE_CONFIG, writerBatchAgeSecs=0))
+    writer.start()
+    writer.submit([newPoint('1')])
+
+    flushed = []
+    flusher = threading.Thread(target=lambda: flushed.append(writer.flush()))
+    flusher.start()
+    flusher.join(0.05)
+    release.set()
+    flusher.join(5)
+    assert flushed == [False]
+    writer.shutdown(5)
+    # A stopped writer no longer holds up flushes
+    writer.queue.append((0, newPoint('2')))
+    assert writer.flush()
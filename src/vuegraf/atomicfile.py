@@ -0,0 +1,23 @@
+# Copyright (c) Jason Ertel (jertel).
+# This file is part of the Vuegraf project and is made available under the MIT License.
+
+# Contains logic relating to replacing files atomically.
+
+import json
+import os
+import tempfile
+
+
+def writeJsonAtomically(path, data, prefix):
+    """Writes data as JSON to path, through a temporary file named with prefix that is then renamed over path.
+
+    A crash or a failure mid-write never leaves a truncated file behind; the previous file remains until replaced.
+    """
+    fd, tmpFile = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix=prefix)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmpFile, path)
+    except Exception:
+        os.unlink(tmpFile)
+        raise
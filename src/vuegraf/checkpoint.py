@@ -0,0 +1,199 @@
+# Copyright (c) Jason Ertel (jertel).
+# This file is part of the Vuegraf project and is made available under the MIT License.
+
+# Contains logic relating to resuming an interrupted history import.
+
+import datetime
+import json
+import logging
+import os
+import pytz
+import threading
+import time
+
+from pyemvue.enums import Scale
+
+from vuegraf.config import getConfigValue, getSettings
+from vuegraf.device import EXCLUDED_DETAIL_CHANNEL_NUMBERS, lookupChannelName, lookupDeviceName
+from vuegraf.influx import getHistoryCoverage
+from vuegraf.time import getLocalMidnightUTC, planHistoryWindows
+
+
+logger = logging.getLogger('vuegraf.checkpoint')
+
+CHECKPOINT_FILE_VERSION = 1
+
+
+class HistoryCheckpoint:
+    """Tracks the progress of a history import, and records its completed units in the optional checkpoint file.
+
+    A unit is a history window, of a single scale, of a single device of an account. The first line of the file describes
+    the import, and each further line is a completed unit, appended once its points have been written, as
+    confirmed by the flush function. A restart with the same number of history days resumes the recorded
+    import, skipping its completed units and reusing its start time so the windows line up again. Any other
+    import starts a new file.
+
+    With historySkipExisting enabled, the points already in Influx are counted when the import begins, and
+    units whose points are all present are skipped as well, so repeating an import does not refetch it.
+    """
+
+    def __init__(self, config, checkpointFile, flush):
+        self.config = config
+        self.checkpointFile = checkpointFile
+        self.flush = flush
+        self.lock = threading.Lock()
+        self.header = None
+        self.doneUnits = set()
+        self.coverage = None
+        self.windowsTotal = 0
+        self.windowsDone = 0
+        self.windowsDoneThisRun = 0
+        self.pointsThisRun = 0
+        self.startSecs = None
+
+    def load(self):
+        """Reads the recorded import. A missing or unreadable file is treated as no import having been recorded."""
+        try:
+            with open(self.checkpointFile) as f:
+                header = json.loads(f.readline())
+                if header['version'] != CHECKPOINT_FILE_VERSION:
+                    raise ValueError('unsupported checkpoint file version {}'.format(header['version']))
+                for line in f:
+                    if not line.endswith('\n'):
+                        # A unit being recorded during a crash is redone
+                        break
+                    self.doneUnits.add(tuple(json.loads(line)))
+            self.header = header
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning('Ignoring unreadable history checkpoint file; historyCheckpointFile={}; error={}'.format(
+                self.checkpointFile, e))
+            self.doneUnits.clear()
+
+    def resume(self, historyDays, startTimeUTC):
+        """Returns the start time of the recorded import when it was for the same number of days, otherwise records a new import."""
+        if self.header is not None and self.header['historyDays'] == historyDays:
+            startTimeUTC = datetime.datetime.fromisoformat(self.header['startTimeUTC'])
+            logger.info('Resuming history import; historyCheckpointFile={}; startTimeUTC={}; completedUnits={}'.format(
+                self.checkpointFile, startTimeUTC, len(self.doneUnits)))
+            return startTimeUTC
+
+        self.header = {'version': CHECKPOINT_FILE_VERSION, 'historyDays': historyDays, 'startTimeUTC': startTimeUTC.isoformat()}
+        self.doneUnits.clear()
+        with open(self.checkpointFile, 'w') as f:
+            f.write(json.dumps(self.header) + '\n')
+        return startTimeUTC
+
+    def begin(self, historyDays, startTimeUTC, stopTimeUTC, accountCount):
+        """Starts tracking the progress of an import, returning its start time, which differs when a recorded import is resumed."""
+        if self.checkpointFile:
+            startTimeUTC = self.resume(historyDays, startTimeUTC)
+        if getConfigValue(self.config, 'historySkipExisting'):
+            self.loadCoverage(startTimeUTC, stopTimeUTC)
+
+        self.windowsTotal = len(planHistoryWindows(self.config, stopTimeUTC, startTimeUTC)) * accountCount
+        self.startSecs = time.monotonic()
+        return startTimeUTC
+
+    def loadCoverage(self, startTimeUTC, stopTimeUTC):
+        """Reads the daily point counts of the import from Influx. A failure only means that nothing is skipped."""
+        try:
+            self.coverage = getHistoryCoverage(self.config, startTimeUTC, stopTimeUTC)
+            logger.info('Skipping history already in the database; series={}'.format(len(self.coverage)))
+        except Exception as e:
+            logger.warning('Not skipping history already in the database since it could not be read; error={}'.format(e))
+
+    def unitKey(self, accountName, gid, window):
+        scale, windowStartUTC, windowStopUTC = window
+        return (accountName, gid, scale, windowStartUTC.isoformat(), windowStopUTC.isoformat())
+
+    def isDone(self, accountName, gid, window):
+        """Returns True when a (scale, startTimeUTC, stopTimeUTC) window of time.planHistoryWindows was imported for a device."""
+        return self.unitKey(accountName, gid, window) in self.doneUnits
+
+    def getExpectedCounts(self, window):
+        """Returns the number of points a channel has on each local date of a window, or None for a window ending mid-day."""
+        scale, windowStartUTC, windowStopUTC = window
+        timezone = getSettings(self.config).timezone or pytz.UTC
+        day = windowStartUTC.astimezone(timezone).date()
+        lastDay = windowStopUTC.astimezone(timezone).date()
+        dayStartUTC = getLocalMidnightUTC(timezone, day)
+        if windowStopUTC + datetime.timedelta(seconds=1) < getLocalMidnightUTC(timezone, lastDay + datetime.timedelta(days=1)):
+            # The latest day is still accumulating usage, so is always fetched again
+            return None
+
+        expectedCounts = {}
+        while day <= lastDay:
+            nextDayStartUTC = getLocalMidnightUTC(timezone, day + datetime.timedelta(days=1))
+            # Days have 23 or 25 hours when daylight saving time starts or ends
+            expectedCounts[day] = (nextDayStartUTC - dayStartUTC) // datetime.timedelta(hours=1) if scale == Scale.HOUR.value else 1
+            day += datetime.timedelta(days=1)
+            dayStartUTC = nextDayStartUTC
+        return expectedCounts
+
+    def channelsCovered(self, account, device, pointType, expectedCounts):
+        for chan in device.channels.values():
+            if chan.channel_num in EXCLUDED_DETAIL_CHANNEL_NUMBERS:
+                # Never has history points, see collect.extractChannelDataPoints
+                continue
+            stationName = lookupDeviceName(account, chan.device_gid) if getSettings(self.config).addStationField else None
+            counts = self.coverage.get((stationName, lookupChannelName(account, chan), pointType), {})
+            if any(counts.get(day, 0) < expectedCount for day, expectedCount in expectedCounts.items()):
+                return False
+            for nestedDevice in (chan.nested_devices or {}).values():
+                if not self.channelsCovered(account, nestedDevice, pointType, expectedCounts):
+                    return False
+        return True
+
+    def isCovered(self, account, device, window):
+        """Returns True when Influx held every point of a window of a device, for all of its channels, when the import began."""
+        if self.coverage is None:
+            return False
+        expectedCounts = self.getExpectedCounts(window)
+        if expectedCounts is None:
+            return False
+        settings = getSettings(self.config)
+        pointType = settings.tagValue_hour if window[0] == Scale.HOUR.value else settings.tagValue_day
+        return self.channelsCovered(account, device, pointType, expectedCounts)
+
+    def complete(self, accountName, gids, window, points):
+        """Records the units of a window once its points have been written, and logs the progress of the import."""
+        persist = bool(self.checkpointFile and gids)
+        if persist and not self.flush():
+            logger.warning('Not recording history window as complete since its points failed to write; account={}; window={}'.format(
+                accountName, window))
+            return
+
+        with self.lock:
+            if persist:
+                with open(self.checkpointFile, 'a') as f:
+                    for gid in gids:
+                        unit = self.unitKey(accountName, gid, window)
+                        self.doneUnits.add(unit)
+                        f.write(json.dumps(unit) + '\n')
+                    f.flush()
+                    os.fsync(f.fileno())
+            if gids:
+                self.windowsDoneThisRun += 1
+                self.pointsThisRun += points
+            self.windowsDone += 1
+
+            elapsedSecs = max(time.monotonic() - self.startSecs, 0.001)
+            etaSecs = 0
+            if self.windowsDoneThisRun > 0:
+                etaSecs = elapsedSecs / self.windowsDoneThisRun * (self.windowsTotal - self.windowsDone)
+            logger.info('History import progress; windows={}/{}; etaSecs={}; pointsPerSec={:.1f}'.format(
+                self.windowsDone, self.windowsTotal, int(etaSecs), self.pointsThisRun / elapsedSecs))
+
+
+def loadHistoryCheckpoint(config, flush):
+    """Returns a HistoryCheckpoint, loaded from the optional historyCheckpointFile."""
+    checkpointFile = getConfigValue(config, 'historyCheckpointFile')
+    checkpoint = HistoryCheckpoint(config, checkpointFile, flush)
+    if checkpointFile and config['args'].resetdatabase:
+        logger.info('Ignoring history checkpoint file since the database is being reset; historyCheckpointFile={}'.format(
+            checkpointFile))
+    elif checkpointFile:
+        checkpoint.load()
+    return checkpoint
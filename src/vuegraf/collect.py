@@ -3,18 +3,22 @@
 
 # Contains logic relating to collection of data usage from Emporia cloud
 
+import collections
+import concurrent.futures
 import datetime
-from dataclasses import dataclass
 import logging
 import time
-from typing import Union
 
 from pyemvue.enums import Scale, Unit
 
-from vuegraf.config import getConfigValue, getInfluxTag
-from vuegraf.device import lookupDeviceName, lookupChannelName
-from vuegraf.influx import getLastDBTimeStamp
-from vuegraf.time import calculateHistoryTimeRange, convertToLocalDayInUTC
+from vuegraf.config import getSettings
+from vuegraf.device import EXCLUDED_DETAIL_CHANNEL_NUMBERS, lookupChannel, lookupDeviceName
+from vuegraf.influx import getCachedLastDBTimeStamps, getLastDBTimeStamp
+# Point was defined here before PointBatch, and is still imported from here by plugins
+from vuegraf.points import Point, PointBatch  # noqa: F401
+from vuegraf.ratelimit import getApiLimiter
+from vuegraf.time import convertToLocalDayInUTC, planBackfillChunks, planHistoryWindows
+from vuegraf.usage import convertUsage
 
 
 logger = logging.getLogger('vuegraf.data')
@@ -24,6 +28,18 @@ logger = logging.getLogger('vuegraf.data')
 # before attempting the 7-day rewind backfill again. See getMinuteBackfillSkipCache().
 MINUTE_BACKFILL_SKIP_TTL_SEC = 3600  # 1 hour
 
+# The most minute data that a single chart usage request returns. A minute backfill of up to 7 days is
+# split into chunks of this size.
+MINUTE_BACKFILL_CHUNK = datetime.timedelta(hours=12)
+
+# Emporia keeps second data for 3 hours, and returns at most an hour of it per chart usage request.
+SECOND_BACKFILL_MAX = datetime.timedelta(hours=3)
+SECOND_BACKFILL_CHUNK = datetime.timedelta(hours=1)
+
+# How long to pause between history windows once the Emporia API has started to back off,
+# multiplied by how far it has backed off. See ApiLimiter.getPauseSecs().
+HISTORY_PAUSE_SECS = 5
+
 
 def getMinuteBackfillSkipCache(config):
     """Negative cache for the minute-history backfill loop in extractDataPoints.
@@ -50,198 +66,220 @@ def getMinuteBackfillSkipCache(config):
     return config.setdefault('_minuteBackfillSkipCache', {})
 
 
-@dataclass
-class Point:
-    """Container for timestamped device readings from Vue.
+def mapConcurrently(fn, items, maxWorkers):
+    """Applies fn to each item on up to maxWorkers threads, returning the results in item order.
+
+    Runs inline, without any threads, when maxWorkers is 1 or there is at most one item.
+    """
+    if maxWorkers <= 1 or len(items) <= 1:
+        return [fn(item) for item in items]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(maxWorkers, len(items)),
+                                               thread_name_prefix='vuegraf-collect') as executor:
+        return list(executor.map(fn, items))
+
+
+def mapBackfillChunks(fetchChunk, chunks, settings):
+    """Applies fetchChunk to the (startTimeUTC, stopTimeUTC) chunks of a backfill, returning the results in time order.
 
-    These can be repacked by Influx and MQTT when writing to those engines.
+    Up to backfillConcurrentChunks chunks are fetched at once, starting from the newest chunk when backfillOrder is 'newest'.
     """
-    accountName: str
-    deviceName: str  # aka station; the Vue, smart plug, etc
-    chanName: str  # for example, each circuit or the total/balance
-    usageWatts: float
-    timestamp: datetime.datetime  # zone aware, UTC
-    detailed: Union[bool, str]  # 'Minutes', 'Days', etc or False
+    if settings.backfillNewestFirst:
+        return mapConcurrently(fetchChunk, chunks[::-1], settings.backfillConcurrentChunks)[::-1]
+    return mapConcurrently(fetchChunk, chunks, settings.backfillConcurrentChunks)
 
 
-def extractDataPoints(config, account, device, stopTimeUTC, collectDetails, usageDataPoints: list[Point],
-                      detailedStartTimeUTC, pointType=None, historyStartTimeUTC=None, historyEndTimeUTC=None):
+def extractDataPoints(config, account, device, stopTimeUTC, collectDetails, usageDataPoints: PointBatch,
+                      detailedStartTimeUTC, pointType=None, historyStartTimeUTC=None, historyEndTimeUTC=None,
+                      lastTimestamps=None, historyScale=None):
     """Unpacks Vue API usage data from a fetched device. Module use only.
 
-    Modifies usageDataPoints in place, appending Point objects.
+    Modifies usageDataPoints, a PointBatch or a list, in place, appending points. The optional lastTimestamps dict,
+    from influx.getCachedLastDBTimeStamps, avoids querying Influx once per channel for backfill ranges.
+    During history collection, historyScale limits the history fetched to either HOUR or DAY data.
+
+    Channels are unpacked concurrently, up to maxConcurrentChannels at a time, since each may need several
+    chart usage API calls. Their points are appended in channel order, same as a sequential unpack.
+    """
+    deviceName = lookupDeviceName(account, device.device_gid)
+    if deviceName is None:
+        # Skipped until the device is discovered, so its data is never stored under a placeholder name
+        return
+
+    def extractChannel(channelItem):
+        chanNum, chan = channelItem
+        return extractChannelDataPoints(config, account, deviceName, chanNum, chan, stopTimeUTC, collectDetails,
+                                        detailedStartTimeUTC, pointType, historyStartTimeUTC, historyEndTimeUTC,
+                                        lastTimestamps, historyScale)
+
+    channelsDataPoints = mapConcurrently(extractChannel, list(device.channels.items()),
+                                         getSettings(config).maxConcurrentChannels)
+    for channelDataPoints in channelsDataPoints:
+        usageDataPoints.extend(channelDataPoints)
+
+
+def extractChannelDataPoints(config, account, deviceName, chanNum, chan, stopTimeUTC, collectDetails, detailedStartTimeUTC,
+                             pointType, historyStartTimeUTC, historyEndTimeUTC, lastTimestamps, historyScale=None):
+    """Unpacks Vue API usage data for a single channel, and its nested devices. Module use only.
+
+    Returns a new PointBatch.
     """
+    channelDataPoints = PointBatch()
     accountName = account['name']
-    detailedDataEnabled = getConfigValue(config, 'detailedDataEnabled')
-    detailedSecondsEnabled = detailedDataEnabled and getConfigValue(config, 'detailedDataSecondsEnabled')
-    _, tagValue_second, tagValue_minute, tagValue_hour, tagValue_day = getInfluxTag(config)
-    excludedDetailChannelNumbers = ['Balance', 'TotalUsage']
+    settings = getSettings(config)
+    detailedSecondsEnabled = settings.detailedDataEnabled and settings.detailedDataSecondsEnabled
+    tagValue_second = settings.tagValue_second
+    tagValue_minute = settings.tagValue_minute
+    tagValue_hour = settings.tagValue_hour
+    tagValue_day = settings.tagValue_day
     minutesInAnHour = 60
     secondsInAMinute = 60
     wattsInAKw = 1000
-    deviceName = lookupDeviceName(account, device.device_gid)
 
-    for chanNum, chan in device.channels.items():
-        if chan.nested_devices:
-            for gid, nestedDevice in chan.nested_devices.items():
-                extractDataPoints(config, account, nestedDevice, stopTimeUTC, collectDetails, usageDataPoints,
-                                  detailedStartTimeUTC, pointType, historyStartTimeUTC, historyEndTimeUTC)
-
-        chanName = lookupChannelName(account, chan)
-        kwhUsage = chan.usage
-        if kwhUsage is not None:
-            if pointType is None:
-                # Negative-cache check: if a prior backfill window for this
-                # (device, channel) completed without writing any minute points,
-                # short-circuit to the simple current-sample branch and skip the
-                # 7-day-rewind getLastDBTimeStamp + while-loop entirely. See
-                # getMinuteBackfillSkipCache for the rationale.
-                skipCache = getMinuteBackfillSkipCache(config)
-                cacheKey = (deviceName, chanName)
-                skipExpiry = skipCache.get(cacheKey)
-                if skipExpiry is not None and skipExpiry > time.time():
-                    minuteHistoryStartTime, stopTimeMin, minuteHistoryEnabled = (stopTimeUTC, stopTimeUTC, False)
-                else:
-                    # Collect previous minute averages
-                    minuteHistoryStartTime, stopTimeMin, minuteHistoryEnabled = getLastDBTimeStamp(config, deviceName,
-                                                                                                   chanName, tagValue_minute,
-                                                                                                   stopTimeUTC, stopTimeUTC, False)
-                if not minuteHistoryEnabled or chanNum in excludedDetailChannelNumbers:
-                    watts = float(minutesInAnHour * wattsInAKw) * kwhUsage
-                    timestamp = stopTimeUTC.replace(second=0)
-                    usageDataPoints.append(Point(accountName, deviceName, chanName, watts, timestamp, tagValue_minute))
-                elif chanNum not in excludedDetailChannelNumbers and historyStartTimeUTC is None:
-                    # Still missing recent minute history, attempt to collect in batches of 12 hours
-                    pointsBeforeBackfill = len(usageDataPoints)
-                    noDataFlag = True
-                    while noDataFlag:
-                        # Collect minutes history (if neccessary, never during history collection)
-                        logger.info('Get minute details; device="{}"; start="{}"; stop="{}"'.format(chanName,
-                                    minuteHistoryStartTime, stopTimeMin))
-                        usage, usage_start_time = account['vue'].get_chart_usage(chan, minuteHistoryStartTime, stopTimeMin,
-                                                                                 scale=Scale.MINUTE.value, unit=Unit.KWH.value)
-                        usage_start_time = usage_start_time.replace(second=0, microsecond=0)
-                        index = 0
-                        for kwhUsage in usage:
-                            if kwhUsage is None:
-                                index += 1
-                                continue
-                            noDataFlag = False  # Got at least one datapoint.  Set boolean value so we don't loop back
-                            timestamp = usage_start_time + datetime.timedelta(minutes=index)
-                            watts = float(minutesInAnHour * wattsInAKw) * kwhUsage
-                            usageDataPoints.append(
-                                Point(
-                                    accountName, deviceName, chanName, watts,
-                                    timestamp, tagValue_minute
-                                )
-                            )
-                            index += 1
-                        if noDataFlag:
-                            # Opps!  No data points found for the time interval in question ('None' returned for ALL values)
-                            # Move up the time interval to the next "batch" timeframe
-                            if stopTimeMin < stopTimeUTC.replace(second=0, microsecond=0):
-                                currentIntervalSeconds = int((stopTimeMin - minuteHistoryStartTime).total_seconds())
-                                minuteHistoryStartTime = minuteHistoryStartTime + datetime.timedelta(seconds=currentIntervalSeconds)
-                                # Make sure we don't go beyond the global stopTimeUTC
-                                minuteHistoryStartTime = min(minuteHistoryStartTime, stopTimeUTC.replace(second=0, microsecond=0))
-                                stopTimeMin = stopTimeMin + datetime.timedelta(seconds=currentIntervalSeconds)
-                                # Make sure we don't go beyond the global stopTimeUTC
-                                stopTimeMin = min(stopTimeMin, stopTimeUTC.replace(second=0, microsecond=0))
-                            else:  # Time to break out of the loop; looks like the device in question is offline
-                                noDataFlag = False
-                        minuteHistoryEnabled = False
-                    if len(usageDataPoints) == pointsBeforeBackfill:
-                        # The backfill window completed without writing any minute
-                        # points -- the upstream API returned all-None across the
-                        # entire 7-day rewind for this (device, channel). Cache the
-                        # negative result so subsequent cycles skip the rewind.
-                        skipCache[cacheKey] = time.time() + MINUTE_BACKFILL_SKIP_TTL_SEC
-                        logger.info(
-                            'No historical minute data for device="%s"; suppressing '
-                            'minute backfill for %ds (cache).',
-                            chanName, MINUTE_BACKFILL_SKIP_TTL_SEC,
-                        )
-            elif pointType == tagValue_day:
-                # Collect previous day averages
-                watts = kwhUsage * wattsInAKw
-                timestamp = convertToLocalDayInUTC(config, historyStartTimeUTC)
-                usageDataPoints.append(Point(accountName, deviceName, chanName, watts, timestamp, pointType))
-            elif pointType == tagValue_hour:
-                # Collect previous hour averages
-                watts = kwhUsage * wattsInAKw
-                timestamp = historyStartTimeUTC
-                usageDataPoints.append(Point(accountName, deviceName, chanName, watts, timestamp, pointType))
-
-        if chanNum in excludedDetailChannelNumbers:
-            continue
-
-        if collectDetails and detailedSecondsEnabled and historyStartTimeUTC is None:
-            # Collect seconds (once per hour, never during history collection)
-            secHistoryStartTime, stopTimeSec, secondHistoryEnabled = getLastDBTimeStamp(config, deviceName, chanName, tagValue_second,
-                                                                                        detailedStartTimeUTC, stopTimeUTC,
-                                                                                        detailedSecondsEnabled)
-            logger.debug('Get second details; device="{}"; start="{}"; stop="{}"'.format(chanName, secHistoryStartTime, stopTimeSec))
-            usage, usageStartTimeUTC = account['vue'].get_chart_usage(chan, secHistoryStartTime, stopTimeSec, scale=Scale.SECOND.value,
-                                                                      unit=Unit.KWH.value)
-            usageStartTimeUTC = usageStartTimeUTC.replace(microsecond=0)
-            index = 0
-            for kwhUsage in usage:
-                if kwhUsage is None:
-                    index += 1
-                    continue
-                timestamp = usageStartTimeUTC + datetime.timedelta(seconds=index)
-                watts = float(secondsInAMinute * minutesInAnHour * wattsInAKw) * kwhUsage
-                usageDataPoints.append(Point(accountName, deviceName, chanName, watts, timestamp, tagValue_second))
+    if chan.nested_devices:
+        for gid, nestedDevice in chan.nested_devices.items():
+            extractDataPoints(config, account, nestedDevice, stopTimeUTC, collectDetails, channelDataPoints,
+                              detailedStartTimeUTC, pointType, historyStartTimeUTC, historyEndTimeUTC, lastTimestamps,
+                              historyScale)
+
+    channel = lookupChannel(account, chan)
+    if channel is None:
+        return channelDataPoints
+    chanName = channel.chanName
+    kwhUsage = chan.usage
+    if kwhUsage is not None:
+        if pointType is None:
+            # Negative-cache check: if a prior backfill window for this
+            # (device, channel) completed without writing any minute points,
+            # short-circuit to the simple current-sample branch and skip the
+            # 7-day-rewind getLastDBTimeStamp + chunked fetch entirely. See
+            # getMinuteBackfillSkipCache for the rationale.
+            skipCache = getMinuteBackfillSkipCache(config)
+            cacheKey = (deviceName, chanName)
+            skipExpiry = skipCache.get(cacheKey)
+            if skipExpiry is not None and skipExpiry > time.time():
+                minuteHistoryStartTime, minuteHistoryEnabled = (stopTimeUTC, False)
+            else:
+                # Collect previous minute averages
+                minuteHistoryStartTime, _, minuteHistoryEnabled = getLastDBTimeStamp(config, deviceName,
+                                                                                     chanName, tagValue_minute,
+                                                                                     stopTimeUTC, stopTimeUTC, False,
+                                                                                     lastTimestamps)
+            if not minuteHistoryEnabled or chanNum in EXCLUDED_DETAIL_CHANNEL_NUMBERS:
+                watts = float(minutesInAnHour * wattsInAKw) * kwhUsage
+                timestamp = stopTimeUTC.replace(second=0)
+                channelDataPoints.add(accountName, deviceName, chanName, watts, timestamp, tagValue_minute)
+            elif chanNum not in EXCLUDED_DETAIL_CHANNEL_NUMBERS and historyStartTimeUTC is None:
+                # Still missing recent minute history, so collect all of it this cycle, in concurrent batches of 12 hours
+                # (if neccessary, never during history collection)
+                pointsBeforeBackfill = len(channelDataPoints)
+
+                def fetchMinutes(chunk):
+                    chunkStartTimeUTC, chunkStopTimeUTC = chunk
+                    logger.info('Get minute details; device="{}"; start="{}"; stop="{}"'.format(
+                        chanName, chunkStartTimeUTC, chunkStopTimeUTC))
+                    usage, usage_start_time = account['vue'].get_chart_usage(chan, chunkStartTimeUTC, chunkStopTimeUTC,
+                                                                             scale=Scale.MINUTE.value, unit=Unit.KWH.value)
+                    nanoseconds, watts = convertUsage(usage, usage_start_time.replace(second=0, microsecond=0), secondsInAMinute,
+                                                      float(minutesInAnHour * wattsInAKw))
+                    return nanoseconds, watts
+
+                chunks = planBackfillChunks(minuteHistoryStartTime, stopTimeUTC, MINUTE_BACKFILL_CHUNK)
+                for nanoseconds, watts in mapBackfillChunks(fetchMinutes, chunks, settings):
+                    channelDataPoints.addSeries(accountName, deviceName, chanName, tagValue_minute, nanoseconds, watts)
+                if len(channelDataPoints) == pointsBeforeBackfill:
+                    # The backfill window completed without writing any minute
+                    # points -- the upstream API returned all-None across the
+                    # entire 7-day rewind for this (device, channel). Cache the
+                    # negative result so subsequent cycles skip the rewind.
+                    skipCache[cacheKey] = time.time() + MINUTE_BACKFILL_SKIP_TTL_SEC
+                    logger.info(
+                        'No historical minute data for device="%s"; suppressing '
+                        'minute backfill for %ds (cache).',
+                        chanName, MINUTE_BACKFILL_SKIP_TTL_SEC,
+                    )
+        elif pointType == tagValue_day:
+            # Collect previous day averages
+            watts = kwhUsage * wattsInAKw
+            timestamp = convertToLocalDayInUTC(config, historyStartTimeUTC)
+            channelDataPoints.add(accountName, deviceName, chanName, watts, timestamp, pointType)
+        elif pointType == tagValue_hour:
+            # Collect previous hour averages
+            watts = kwhUsage * wattsInAKw
+            timestamp = historyStartTimeUTC
+            channelDataPoints.add(accountName, deviceName, chanName, watts, timestamp, pointType)
+
+    if chanNum in EXCLUDED_DETAIL_CHANNEL_NUMBERS:
+        return channelDataPoints
+
+    if collectDetails and detailedSecondsEnabled and historyStartTimeUTC is None:
+        # Collect seconds (once per hour, never during history collection), including every missing hour that Emporia still has
+        secHistoryStartTime, _, secondHistoryEnabled = getLastDBTimeStamp(config, deviceName, chanName, tagValue_second,
+                                                                          detailedStartTimeUTC, stopTimeUTC,
+                                                                          detailedSecondsEnabled, lastTimestamps)
+        secHistoryStartTime = max(secHistoryStartTime, stopTimeUTC - SECOND_BACKFILL_MAX)
+
+        def fetchSeconds(chunk):
+            chunkStartTimeUTC, chunkStopTimeUTC = chunk
+            logger.debug('Get second details; device="{}"; start="{}"; stop="{}"'.format(chanName, chunkStartTimeUTC, chunkStopTimeUTC))
+            usage, usageStartTimeUTC = account['vue'].get_chart_usage(chan, chunkStartTimeUTC, chunkStopTimeUTC,
+                                                                      scale=Scale.SECOND.value, unit=Unit.KWH.value)
+            nanoseconds, watts = convertUsage(usage, usageStartTimeUTC.replace(microsecond=0), 1,
+                                              float(secondsInAMinute * minutesInAnHour * wattsInAKw))
+            return nanoseconds, watts
+
+        chunks = planBackfillChunks(secHistoryStartTime, stopTimeUTC, SECOND_BACKFILL_CHUNK)
+        for nanoseconds, watts in mapBackfillChunks(fetchSeconds, chunks, settings):
+            channelDataPoints.addSeries(accountName, deviceName, chanName, tagValue_second, nanoseconds, watts)
+
+    # Fetches historical Hour & Day data, or only the data of historyScale
+    collectHistory = historyStartTimeUTC is not None and historyEndTimeUTC is not None
+    if collectHistory:
+        logger.debug('Get historic details; device="{}"; start="{}"; stop="{}"; scale={}'.format(chanName, historyStartTimeUTC,
+                                                                                                 historyEndTimeUTC, historyScale))
+
+    if collectHistory and historyScale in (None, Scale.HOUR.value):
+        # Collect historical hour averages
+        usage, usageStartTimeUTC = account['vue'].get_chart_usage(chan, historyStartTimeUTC, historyEndTimeUTC,
+                                                                  scale=Scale.HOUR.value, unit=Unit.KWH.value)
+        nanoseconds, watts = convertUsage(usage, usageStartTimeUTC.replace(minute=0, second=0, microsecond=0),
+                                          minutesInAnHour * secondsInAMinute, wattsInAKw)
+        channelDataPoints.addSeries(accountName, deviceName, chanName, tagValue_hour, nanoseconds, watts)
+
+    if collectHistory and historyScale in (None, Scale.DAY.value):
+        # Collect historical day averages
+        usage, usageStartTimeUTC = account['vue'].get_chart_usage(chan, historyStartTimeUTC, historyEndTimeUTC,
+                                                                  scale=Scale.DAY.value, unit=Unit.KWH.value)
+        index = 0
+        for kwhUsage in usage:
+            if kwhUsage is None:
                 index += 1
+                continue
 
-        # Fetches historical Hour & Day data
-        if historyStartTimeUTC is not None and historyEndTimeUTC is not None:
-            logger.debug('Get historic details; device="{}"; start="{}"; stop="{}"'.format(chanName, historyStartTimeUTC,
-                                                                                           historyEndTimeUTC))
-
-            # Collect historical hour averages
-            usage, usageStartTimeUTC = account['vue'].get_chart_usage(chan, historyStartTimeUTC, historyEndTimeUTC,
-                                                                      scale=Scale.HOUR.value, unit=Unit.KWH.value)
-            usageStartTimeUTC = usageStartTimeUTC.replace(minute=0, second=0, microsecond=0)
-            index = 0
-            for kwhUsage in usage:
-                if kwhUsage is None:
-                    index += 1
-                    continue
-                timestamp = usageStartTimeUTC + datetime.timedelta(hours=index)
-                watts = kwhUsage * wattsInAKw
-                usageDataPoints.append(Point(accountName, deviceName, chanName,
-                                       watts, timestamp, tagValue_hour))
-                index += 1
+            # Advance the day by 6 hours + the current day index. The 6 hours shifts time away from common DST threshold hours
+            # to avoid DST issues. Note that historyStartTimeUTC will be set to midnight by the caller, thus
+            # usageStartTimeUTC, returned by Emporia, will be midnight as well.
+            timestamp = convertToLocalDayInUTC(config, usageStartTimeUTC + datetime.timedelta(hours=6, days=index))
 
-            # Collect historical day averages
-            usage, usageStartTimeUTC = account['vue'].get_chart_usage(chan, historyStartTimeUTC, historyEndTimeUTC,
-                                                                      scale=Scale.DAY.value, unit=Unit.KWH.value)
-            index = 0
-            for kwhUsage in usage:
-                if kwhUsage is None:
-                    index += 1
-                    continue
-
-                # Advance the day by 6 hours + the current day index. The 6 hours shifts time away from common DST threshold hours
-                # to avoid DST issues. Note that historyStartTimeUTC will be set to midnight by the caller, thus
-                # usageStartTimeUTC, returned by Emporia, will be midnight as well.
-                timestamp = convertToLocalDayInUTC(config, usageStartTimeUTC + datetime.timedelta(hours=6, days=index))
-
-                watts = kwhUsage * wattsInAKw
-                usageDataPoints.append(Point(accountName, deviceName, chanName, watts, timestamp, tagValue_day))
-                index += 1
+            watts = kwhUsage * wattsInAKw
+            channelDataPoints.add(accountName, deviceName, chanName, watts, timestamp, tagValue_day)
+            index += 1
+
+    return channelDataPoints
 
 
-def collectUsage(config, account, startTimeUTC, stopTimeUTC, collectDetails, usageDataPoints: list[Point], detailedStartTimeUTC, scale):
+def collectUsage(config, account, startTimeUTC, stopTimeUTC, collectDetails, usageDataPoints: PointBatch, detailedStartTimeUTC, scale):
     """Module entrypoint. Fetch Vue data and unpack it into points.
 
-    The usageDataPoints list is modified in place, appending Points.
+    The usageDataPoints PointBatch, or list, is modified in place, appending points. At the SECOND scale only the
+    detailed second data is collected, without the current minute usage.
     """
-    _, _, _, tagValue_hour, tagValue_day = getInfluxTag(config)
+    settings = getSettings(config)
     if scale == Scale.HOUR.value:
-        pointType = tagValue_hour
+        pointType = settings.tagValue_hour
     elif scale == Scale.DAY.value:
-        pointType = tagValue_day
+        pointType = settings.tagValue_day
+    elif scale == Scale.SECOND.value:
+        pointType = settings.tagValue_second
     else:
         pointType = None
 
@@ -250,34 +288,89 @@ def collectUsage(config, account, startTimeUTC, stopTimeUTC, collectDetails, usa
     deviceGids = list(account['deviceIdMap'].keys())
     usages = account['vue'].get_device_list_usage(deviceGids, stopTimeUTC, scale=scale, unit=Unit.KWH.value)
     if usages is not None:
+        # Look up the backfill watermarks of every channel at once, rather than once per channel.
+        # Influx is only queried until the watermark cache has been seeded.
+        pointTypes = []
+        if pointType is None:
+            pointTypes.append(settings.tagValue_minute)
+        detailedSecondsEnabled = settings.detailedDataEnabled and settings.detailedDataSecondsEnabled
+        if pointType in (None, settings.tagValue_second) and collectDetails and detailedSecondsEnabled:
+            pointTypes.append(settings.tagValue_second)
+        lastTimestamps = getCachedLastDBTimeStamps(config, pointTypes) if pointTypes else None
+
         for gid, device in usages.items():
             extractDataPoints(config, account, device, stopTimeUTC, collectDetails,
-                              usageDataPoints, detailedStartTimeUTC, pointType, startTimeUTC)
+                              usageDataPoints, detailedStartTimeUTC, pointType, startTimeUTC,
+                              lastTimestamps=lastTimestamps)
 
 
-def collectHistoryUsage(config, account, startTimeUTC, stopTimeUTC, usageDataPoints: list[Point], pauseEvent):
-    """Module entrypoint. Fetches historic Vue data and unpacks it into points."""
+def countChannels(device):
+    """Returns the number of channels of a device, including the channels of its nested devices."""
+    count = 0
+    for chan in device.channels.values():
+        count += 1
+        if chan.nested_devices:
+            count += sum(countChannels(nestedDevice) for nestedDevice in chan.nested_devices.values())
+    return count
+
+
+def collectHistoryUsage(config, account, startTimeUTC, stopTimeUTC, pauseEvent, checkpoint=None):
+    """Module entrypoint. Fetches historic Vue data, yielding the points of each history window once it is unpacked.
+
+    The history is split into windows by time.planHistoryWindows, each fetching a single scale of data.
+    The caller writes each window before the next one is fetched, so memory use does not grow with the number of history days.
+    Up to historyConcurrentWindows windows are fetched in parallel, and are yielded in order, so the points are the same
+    as when fetching one window at a time. Devices whose window is already recorded in the optional
+    checkpoint.HistoryCheckpoint, or already held by Influx, are skipped, and the others are recorded once the
+    caller has taken the window.
+    """
     # Grab base usage data for later use in history collection
     deviceGids = list(account['deviceIdMap'].keys())
     usages = account['vue'].get_device_list_usage(deviceGids, stopTimeUTC, scale=Scale.MINUTE.value, unit=Unit.KWH.value)
 
-    historicBatchCounter = 0
-    while True:
-        # Determine history start and end times for this batch
-        incrementStartTimeUTC, incrementEndTimeUTC = calculateHistoryTimeRange(config, stopTimeUTC, startTimeUTC,
-                                                                               historicBatchCounter)
-        if incrementStartTimeUTC >= stopTimeUTC:
-            break
-
-        # Collect usage data for the historical period
-        logger.debug('Collecting history data from Emporia; incrementStartTimeUTC={}; incrementEndTimeUTC={}'.format(
-                     incrementStartTimeUTC, incrementEndTimeUTC))
+    # Plan the fewest requests covering the history, and report them before starting
+    windows = planHistoryWindows(config, stopTimeUTC, startTimeUTC)
+    channelCount = sum(countChannels(device) for device in usages.values())
+    logger.info('Planned history collection; account={}; hourWindows={}; dayWindows={}; channels={}; apiCalls={}'.format(
+        account['name'], sum(1 for window in windows if window[0] == Scale.HOUR.value),
+        sum(1 for window in windows if window[0] == Scale.DAY.value), channelCount, len(windows) * channelCount))
+
+    def extractWindow(window):
+        historyScale, incrementStartTimeUTC, incrementEndTimeUTC = window
+        logger.debug('Collecting history data from Emporia; scale={}; incrementStartTimeUTC={}; incrementEndTimeUTC={}'.format(
+                     historyScale, incrementStartTimeUTC, incrementEndTimeUTC))
+        windowDataPoints = PointBatch()
+        windowGids = []
         for gid, device in usages.items():
-            extractDataPoints(config, account, device, stopTimeUTC, False, usageDataPoints, None,
-                              'History', incrementStartTimeUTC, incrementEndTimeUTC)
-
-        historicBatchCounter = historicBatchCounter + 1
-
-        if pauseEvent.wait(5):
-            logging.info("Aborting history collection due to pause interruption")
-            break
+            if checkpoint is not None and (checkpoint.isDone(account['name'], gid, window) or
+                                           checkpoint.isCovered(account, device, window)):
+                continue
+            extractDataPoints(config, account, device, stopTimeUTC, False, windowDataPoints, None,
+                              'History', incrementStartTimeUTC, incrementEndTimeUTC, historyScale=historyScale)
+            windowGids.append(gid)
+        return windowDataPoints, windowGids
+
+    concurrentWindows = getSettings(config).historyConcurrentWindows
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=concurrentWindows, thread_name_prefix='vuegraf-history')
+    try:
+        pending = collections.deque()
+        nextWindow = 0
+        while nextWindow < len(windows) or pending:
+            while nextWindow < len(windows) and len(pending) < concurrentWindows:
+                pending.append((windows[nextWindow], executor.submit(extractWindow, windows[nextWindow])))
+                nextWindow += 1
+
+            window, future = pending.popleft()
+            windowDataPoints, windowGids = future.result()
+            yield windowDataPoints
+            if checkpoint is not None:
+                checkpoint.complete(account['name'], windowGids, window, len(windowDataPoints))
+
+            # Pace the next window by the health of the Emporia API. Windows that were skipped entirely
+            # made no API calls, so need no pause.
+            pauseSecs = getApiLimiter(config).getPauseSecs(HISTORY_PAUSE_SECS) if windowGids else 0
+            if pauseEvent.wait(pauseSecs):
+                logging.info("Aborting history collection due to pause interruption")
+                break
+    finally:
+        executor.shutdown(cancel_futures=True)
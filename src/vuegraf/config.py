@@ -4,13 +4,17 @@
 # Contains logic relating to loading configuration values.
 
 import argparse
+import dataclasses
 import datetime
 import json
 import logging
+import pytz
 
 
 logger = logging.getLogger('vuegraf.config')
 
+BACKFILL_ORDERS = ('oldest', 'newest')
+
 
 def setConfigDefault(config, key, value):
     if key not in config:
@@ -47,6 +51,71 @@ def getInfluxTag(config):
     return tagName, tagValue_second, tagValue_minute, tagValue_hour, tagValue_day
 
 
+@dataclasses.dataclass(frozen=True, slots=True)
+class Settings:
+    """Configuration values used while collecting and writing points, resolved once from the config dict.
+
+    Reading an attribute is much cheaper than the dict lookups behind getConfigValue, getInfluxTag and
+    getInfluxVersion, which matters in per-channel and per-point code.
+    """
+    influxVersion: int
+    tagName: str
+    tagValue_second: str
+    tagValue_minute: str
+    tagValue_hour: str
+    tagValue_day: str
+    addStationField: bool
+    timezone: datetime.tzinfo | None
+    detailedDataEnabled: bool
+    detailedDataSecondsEnabled: bool
+    detailedIntervalSecs: int
+    updateIntervalSecs: int
+    lagSecs: int
+    maxConcurrentChannels: int
+    historyConcurrentWindows: int
+    backfillConcurrentChunks: int
+    backfillNewestFirst: bool
+
+
+def compileSettings(config):
+    setConfigDefaults(config)
+    tagName, tagValue_second, tagValue_minute, tagValue_hour, tagValue_day = getInfluxTag(config)
+    timezoneName = getConfigValue(config, 'timezone')
+    backfillOrder = getConfigValue(config, 'backfillOrder')
+    if backfillOrder not in BACKFILL_ORDERS:
+        raise ValueError('Invalid backfillOrder; backfillOrder={}; allowed={}'.format(backfillOrder, BACKFILL_ORDERS))
+    return Settings(
+        influxVersion=getInfluxVersion(config),
+        tagName=tagName,
+        tagValue_second=tagValue_second,
+        tagValue_minute=tagValue_minute,
+        tagValue_hour=tagValue_hour,
+        tagValue_day=tagValue_day,
+        addStationField=getConfigValue(config, 'addStationField'),
+        timezone=pytz.timezone(timezoneName) if timezoneName is not None else None,
+        detailedDataEnabled=getConfigValue(config, 'detailedDataEnabled'),
+        detailedDataSecondsEnabled=getConfigValue(config, 'detailedDataSecondsEnabled'),
+        detailedIntervalSecs=getConfigValue(config, 'detailedIntervalSecs'),
+        updateIntervalSecs=getConfigValue(config, 'updateIntervalSecs'),
+        lagSecs=getConfigValue(config, 'lagSecs'),
+        maxConcurrentChannels=getConfigValue(config, 'maxConcurrentChannels'),
+        historyConcurrentWindows=getConfigValue(config, 'historyConcurrentWindows'),
+        backfillConcurrentChunks=getConfigValue(config, 'backfillConcurrentChunks'),
+        backfillNewestFirst=backfillOrder == 'newest',
+    )
+
+
+def getSettings(config):
+    """Returns the Settings of a config dict, compiling them on first use.
+
+    initConfig compiles them up front; config dicts built by other means get any missing defaults applied.
+    """
+    settings = config.get('_settings')
+    if settings is None:
+        settings = config.setdefault('_settings', compileSettings(config))
+    return settings
+
+
 def initArgs():
     parser = argparse.ArgumentParser(
         prog='vuegraf.py',
@@ -103,12 +172,7 @@ def initLogging(verbose):
     logger.addHandler(handler)
 
 
-def initConfig():
-    args = initArgs()
-    config = {}
-    with open(args.configFilename) as configFile:
-        config = json.load(configFile)
-
+def setConfigDefaults(config):
     setConfigDefault(config, 'addStationField', False)
     setConfigDefault(config, 'detailedIntervalSecs', 3600)
     setConfigDefault(config, 'detailedDataEnabled', False)
@@ -118,7 +182,43 @@ def initConfig():
     setConfigDefault(config, 'lagSecs', 5)
     setConfigDefault(config, 'timezone', None)
     setConfigDefault(config, 'maxHistoryDays', 720)
+    setConfigDefault(config, 'historyCheckpointFile', None)
+    setConfigDefault(config, 'historySkipExisting', False)
+    setConfigDefault(config, 'stateFile', None)
+    setConfigDefault(config, 'maxConcurrentAccounts', 1)
+    setConfigDefault(config, 'maxConcurrentChannels', 1)
+    setConfigDefault(config, 'historyConcurrentWindows', 1)
+    setConfigDefault(config, 'backfillConcurrentChunks', 1)
+    setConfigDefault(config, 'backfillOrder', 'oldest')
     setConfigDefault(config, 'updateIntervalSecs', 60)
+    setConfigDefault(config, 'apiRequestsPerSec', 0)
+    setConfigDefault(config, 'apiAccountRequestsPerSec', 0)
+    setConfigDefault(config, 'apiBurstRequests', 10)
+    setConfigDefault(config, 'apiMaxConcurrentRequests', 8)
+    setConfigDefault(config, 'apiSlowRequestSecs', 10)
+    setConfigDefault(config, 'writerQueueSize', 100000)
+    setConfigDefault(config, 'writerBatchSize', 5000)
+    setConfigDefault(config, 'writerBatchAgeSecs', 1)
+    setConfigDefault(config, 'writerBackpressure', 'block')
+    setConfigDefault(config, 'writerSpillFile', None)
+    setConfigDefault(config, 'writerShutdownDeadlineSecs', 30)
+    setConfigDefault(config, 'spoolDir', None)
+    setConfigDefault(config, 'spoolSegmentBytes', 67108864)
+    setConfigDefault(config, 'spoolRetrySecs', 30)
+    setConfigDefault(config, 'spoolReplayBatchesPerSec', 5)
+    setConfigDefault(config, 'deviceCacheFile', None)
+    setConfigDefault(config, 'deviceRefreshIntervalSecs', 3600)
+    setConfigDefault(config, 'tokenDir', None)
+    setConfigDefault(config, 'loginStaggerSecs', 1)
+
+
+def initConfig():
+    args = initArgs()
+    config = {}
+    with open(args.configFilename) as configFile:
+        config = json.load(configFile)
+
+    setConfigDefaults(config)
 
     # Create a sanitized copy for logging and remove sensitive information from it
     sanitized_config = config.copy()
@@ -134,4 +234,7 @@ def initConfig():
 
     logger.info('Loaded settings; config={}'.format(sanitized_config))
 
+    # Resolve the values used in hot loops once, failing fast on an unknown timezone
+    getSettings(config)
+
     return config
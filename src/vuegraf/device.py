@@ -3,19 +3,55 @@
 
 # Contains logic relating to Emporia Vue devices and channels.
 
+from dataclasses import dataclass
 import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
 from pyemvue import PyEmVue
 
+from vuegraf.config import getConfigValue
+from vuegraf.ratelimit import RateLimitedVue, getApiLimiter
+
 
 logger = logging.getLogger('vuegraf.device')
 
+# Channels that are only collected as current samples, and never get detailed or history points
+EXCLUDED_DETAIL_CHANNEL_NUMBERS = ('Balance', 'TotalUsage')
+
+# A device missing from the discovered devices is discovered again right away, but at most this often per account,
+# so a device that Emporia does not list yet does not cause a discovery for every channel of every cycle.
+DISCOVERY_MIN_INTERVAL_SECS = 60
+
+
+@dataclass(frozen=True)
+class ChannelInfo:
+    """Resolved names of a channel, as stored in the points written for it.
+
+    The names are interned, so the points of every cycle share the same string objects.
+    """
+    deviceName: str  # aka station
+    chanName: str  # display name, from the devices config when set
+
 
-def populateDevices(account):
+def internName(name):
+    return sys.intern(name) if isinstance(name, str) else name
+
+
+def populateDevices(account, devices=None):
+    """Maps the devices and channels of an account, as returned by PyEmVue.get_devices, which is called when devices is None.
+
+    The maps are built aside and then swapped in, so collection never sees them half built. Only the channels
+    added or removed since the previous call are logged.
+    """
+    if devices is None:
+        devices = account['vue'].get_devices()
+    previousChannelIdMap = account.get('channelIdMap', {})
     deviceIdMap = {}
-    account['deviceIdMap'] = deviceIdMap
     channelIdMap = {}
-    account['channelIdMap'] = channelIdMap
-    devices = account['vue'].get_devices()
     for device in devices:
         # Only map the primary device. We get two device entries per device. The first contains all the
         # device details and has a single 1,2,3 channel for the mains. The second does not have the device
@@ -29,28 +65,80 @@ def populateDevices(account):
             if chan.name is None and chan.channel_num == '1,2,3':
                 chan.name = device.device_name
             channelIdMap[key] = chan
-            logger.info('Discovered new channel: {} ({})'.format(chan.name, chan.channel_num))
+            if key not in previousChannelIdMap:
+                logger.info('Discovered new channel: {} ({})'.format(chan.name, chan.channel_num))
 
+    for key, chan in previousChannelIdMap.items():
+        if key not in channelIdMap:
+            logger.info('Removed channel: {} ({})'.format(chan.name, chan.channel_num))
 
-def lookupDeviceName(account, device_gid):
-    if device_gid not in account['deviceIdMap']:
-        populateDevices(account)
+    account['deviceList'] = devices
+    account['deviceGids'] = {device.device_gid for device in devices}
+    account['deviceIdMap'] = deviceIdMap
+    account['channelIdMap'] = channelIdMap
 
-    deviceName = '{}'.format(device_gid)
-    if device_gid in account['deviceIdMap']:
-        deviceName = account['deviceIdMap'][device_gid].device_name
-    return deviceName
+    # Resolve the names of every channel once, rather than on every collection cycle
+    channelIndex = {}
+    for device in devices:
+        for chan in device.channels:
+            channelIndex[(device.device_gid, chan.channel_num)] = newChannelInfo(account, device.device_gid, chan.channel_num)
+    account['channelIndex'] = channelIndex
 
 
-def lookupChannelName(account, chan):
-    if chan.device_gid not in account['deviceIdMap']:
+def discoverDevices(account):
+    """Discovers the devices of an account again, one discovery at a time per account."""
+    with account.setdefault('discoveryLock', threading.RLock()):
+        account['lastDiscoverySecs'] = time.monotonic()
         populateDevices(account)
 
-    deviceName = lookupDeviceName(account, chan.device_gid)
-    name = '{}-{}'.format(deviceName, chan.channel_num)
+
+def isDeviceKnown(account, device_gid):
+    return device_gid in account['deviceIdMap'] or device_gid in account.get('deviceGids', ())
+
+
+def isDeviceDiscovered(account, device_gid):
+    """Returns whether a device is among the discovered devices of an account, discovering them again when it is not.
+
+    Discovery runs at most once every DISCOVERY_MIN_INTERVAL_SECS per account, and returns False meanwhile.
+    """
+    if isDeviceKnown(account, device_gid):
+        return True
+    with account.setdefault('discoveryLock', threading.RLock()):
+        if isDeviceKnown(account, device_gid):
+            # Discovered by another thread meanwhile
+            return True
+        lastDiscoverySecs = account.get('lastDiscoverySecs')
+        if lastDiscoverySecs is not None and time.monotonic() - lastDiscoverySecs < DISCOVERY_MIN_INTERVAL_SECS:
+            return False
+        try:
+            discoverDevices(account)
+        except Exception:
+            logger.warning('Failed to discover devices; account={}; error={}'.format(account.get('name'), sys.exc_info()[1]))
+            return False
+        if not isDeviceKnown(account, device_gid):
+            logger.warning('Skipping data of an undiscovered device; account={}; deviceGid={}'.format(account.get('name'), device_gid))
+            return False
+        return True
+
+
+def getDeviceName(account, device_gid):
+    device = account['deviceIdMap'].get(device_gid)
+    return device.device_name if device is not None else '{}'.format(device_gid)
+
+
+def lookupDeviceName(account, device_gid):
+    """Returns the name of a device, or None while it is not discovered, so its data is never stored under a placeholder name."""
+    if not isDeviceDiscovered(account, device_gid):
+        return None
+    return getDeviceName(account, device_gid)
+
+
+def resolveChannelName(account, deviceName, channelNum):
+    """Returns the display name of a channel, from the devices config of the account when set."""
+    name = '{}-{}'.format(deviceName, channelNum)
 
     try:
-        num = int(chan.channel_num)
+        num = int(channelNum)
         if 'devices' in account:
             for device in account['devices']:
                 if 'name' in device and device['name'] == deviceName:
@@ -62,15 +150,94 @@ def lookupChannelName(account, chan):
                             name = device['channels'][str(num)]
                             break
     except Exception:
-        if chan.channel_num == '1,2,3':
+        if channelNum == '1,2,3':
             name = deviceName
 
     return name
 
 
-def initDeviceAccount(config, account):
+def newChannelInfo(account, device_gid, channelNum):
+    deviceName = internName(getDeviceName(account, device_gid))
+    return ChannelInfo(deviceName, internName(resolveChannelName(account, deviceName, channelNum)))
+
+
+def lookupChannel(account, chan):
+    """Returns the ChannelInfo of a channel, with a single lookup in the channel index built by populateDevices.
+
+    A channel missing from the index is resolved, and added to it, so it is only resolved once. Returns None
+    while the device of the channel is not discovered, like lookupDeviceName.
+    """
+    key = (chan.device_gid, chan.channel_num)
+    channel = account.get('channelIndex', {}).get(key)
+    if channel is None:
+        if not isDeviceDiscovered(account, chan.device_gid):
+            return None
+        channel = newChannelInfo(account, chan.device_gid, chan.channel_num)
+        account.setdefault('channelIndex', {})[key] = channel
+    return channel
+
+
+def lookupChannelName(account, chan):
+    channel = lookupChannel(account, chan)
+    return channel.chanName if channel is not None else None
+
+
+def getTokenFile(config, account):
+    """Returns the file that the Emporia tokens of an account are saved to, within the optional tokenDir, or None."""
+    tokenDir = getConfigValue(config, 'tokenDir')
+    if not tokenDir:
+        return None
+    return os.path.join(tokenDir, '{}.json'.format(re.sub(r'[^\w.-]', '_', account['name'])))
+
+
+def hasSavedTokens(config, account):
+    tokenFile = getTokenFile(config, account)
+    return tokenFile is not None and os.path.isfile(tokenFile) and os.path.getsize(tokenFile) > 0
+
+
+def loginWithSavedTokens(account, tokenFile):
+    """Logs into an account with the tokens saved by a previous login, returning False when they cannot be used."""
+    try:
+        if account['vue'].login(token_storage_file=tokenFile):
+            return True
+        error = 'login rejected'
+    except Exception:
+        error = sys.exc_info()[1]
+    logger.warning('Unable to log in with saved tokens, logging in with password; account={}; error={}'.format(account['name'], error))
+    return False
+
+
+def initDeviceAccount(config, account, cachedDevices=None):
+    """Logs into an account, and maps its devices, from cachedDevices when given, rather than discovering them.
+
+    When a tokenDir is configured, the tokens saved by a previous login are used, avoiding a password login,
+    and the tokens are saved again whenever PyEmVue renews them.
+    """
     if 'vue' not in account:
-        account['vue'] = PyEmVue()
-        account['vue'].login(username=account['email'], password=account['password'])
+        account['vue'] = RateLimitedVue(PyEmVue(), getApiLimiter(config), account['name'])
+        tokenFile = getTokenFile(config, account)
+        if not hasSavedTokens(config, account) or not loginWithSavedTokens(account, tokenFile):
+            if tokenFile:
+                # The tokens grant access to the account, so only the owner may read them
+                os.makedirs(os.path.dirname(tokenFile), exist_ok=True)
+                os.close(os.open(tokenFile, os.O_WRONLY | os.O_CREAT, 0o600))
+            account['vue'].login(username=account['email'], password=account['password'], token_storage_file=tokenFile)
         logger.info('Emporia Login completed sucessfully')
-        populateDevices(account)
+        populateDevices(account, cachedDevices)
+
+
+def initDeviceAccounts(config, cachedDevices):
+    """Logs into every account, and maps its devices, from the cachedDevices of its name when present.
+
+    Accounts with saved tokens are logged into first. The password logins of the other accounts are spaced
+    loginStaggerSecs apart, plus a random jitter of up to as long again, rather than sent in a burst.
+    """
+    accounts = sorted(config['accounts'], key=lambda account: not hasSavedTokens(config, account))
+    staggerSecs = getConfigValue(config, 'loginStaggerSecs')
+    passwordLogins = 0
+    for account in accounts:
+        if 'vue' not in account and not hasSavedTokens(config, account):
+            if passwordLogins > 0 and staggerSecs > 0:
+                time.sleep(staggerSecs * (1 + random.random()))
+            passwordLogins += 1
+        initDeviceAccount(config, account, cachedDevices.get(account['name']))
@@ -7,9 +7,12 @@ import datetime
 import influxdb         # InfluxDB v1
 import influxdb_client  # InfluxDB v2
 import logging
-import pprint
+import pytz
+import threading
 
-from vuegraf.config import getConfigValue, getInfluxTag, getInfluxVersion
+from vuegraf.config import getSettings
+from vuegraf.lineprotocol import getLineProtocolEncoder
+from vuegraf.points import PointBatch, fromNanoseconds
 from vuegraf.time import getTimeNow
 
 
@@ -17,7 +20,10 @@ logger = logging.getLogger('vuegraf.influx')
 
 
 def createDataPoint(config, pt):
-    """Creates appropriate Influx structure from a collect.Point."""
+    """Creates appropriate Influx structure from a collect.Point.
+
+    Writes use the faster LineProtocolEncoder instead; this remains the reference for its output.
+    """
     accountName = pt.accountName
     deviceName = pt.deviceName
     chanName = pt.chanName
@@ -25,19 +31,18 @@ def createDataPoint(config, pt):
     timestamp = pt.timestamp
     detailed = pt.detailed
 
-    influxVersion = getInfluxVersion(config)
-    tagName, tagValue_second, tagValue_minute, tagValue_hour, tagValue_day = getInfluxTag(config)
-    addStationField = getConfigValue(config, 'addStationField')
+    settings = getSettings(config)
+    tagName = settings.tagName
 
     dataPoint = None
-    if influxVersion == 2:
+    if settings.influxVersion == 2:
         dataPoint = influxdb_client.Point('energy_usage')
         dataPoint.tag('account_name', accountName)
         dataPoint.tag('device_name', chanName)
         dataPoint.tag(tagName, detailed)
         dataPoint.field('usage', watts)
         dataPoint.time(time=timestamp)
-        if addStationField:
+        if settings.addStationField:
             dataPoint.tag('station_name', deviceName)
     else:
         dataPoint = {
@@ -52,20 +57,222 @@ def createDataPoint(config, pt):
             },
             'time': timestamp
         }
-        if addStationField:
+        if settings.addStationField:
             dataPoint['tags']['station_name'] = deviceName
 
     return dataPoint
 
 
-def getLastDBTimeStamp(config, deviceName, chanName, pointType, startTime, stopTime, fillInMissingData):
-    tagName, tagValue_second, tagValue_minute, tagValue_hour, tagValue_day = getInfluxTag(config)
-    influxVersion = getInfluxVersion(config)
-    addStationField = getConfigValue(config, 'addStationField')
+def parseDBTimeStamp(timeStr):
+    """Converts a timestamp string returned by either Influx version into an aware UTC datetime."""
+    # Depending on version of Influx, the string format for the time is different.
+    # So strip out the variable timezone bits (along with any microsecond values)
+    timeStr = timeStr[:19] + 'Z'
+    return datetime.datetime.strptime(timeStr, '%Y-%m-%dT%H:%M:%S%z').replace(tzinfo=datetime.timezone.utc)
+
+
+def getLastDBTimeStamps(config, pointTypes):
+    """Fetches the timestamp of the last record of every series having one of the given detail tags.
+
+    Uses a single grouped query rather than one query per channel. Returns a dict keyed by
+    (stationName, chanName, pointType); stationName is None unless addStationField is enabled.
+    """
+    settings = getSettings(config)
+    tagName = settings.tagName
+    influxVersion = settings.influxVersion
+    addStationField = settings.addStationField
+    groupColumns = ['device_name', tagName]
+    if addStationField:
+        groupColumns.append('station_name')
+
+    lastTimestamps = {}
+    if influxVersion == 2:
+        bucket = config['influxDb']['bucket']
+        query_api = config['influx'].query_api()
+        tagFilter = ' or '.join(['r.' + tagName + ' == "' + pointType + '"' for pointType in pointTypes])
+        result = query_api.query('from(bucket:"' + bucket + '") ' +
+                                 '|> range(start: -3w) ' +
+                                 '|> filter(fn: (r) => ' +
+                                 '  r._measurement == "energy_usage" and ' +
+                                 '  r._field == "usage" and (' + tagFilter + '))' +
+                                 '|> last() ' +
+                                 '|> group(columns: ["' + '", "'.join(groupColumns) + '"]) ' +
+                                 '|> max(column: "_time")')
+        for table in result:
+            for record in table.records:
+                stationName = record['station_name'] if addStationField else None
+                key = (stationName, record['device_name'], record[tagName])
+                lastTimestamps[key] = parseDBTimeStamp(record['_time'].isoformat())
+
+    else:  # Influx v1
+        tagFilter = ' OR '.join([tagName.replace('\'', '\\\'') + ' = \'' + pointType + '\'' for pointType in pointTypes])
+        query = 'select last(usage) from energy_usage where (' + tagFilter + ') group by ' + ', '.join(groupColumns)
+        logger.debug('InfluxDB v1 Query: %s', query)
+        result = config['influx'].query(query)
+        for (_, tags), points in result.items():
+            stationName = tags['station_name'] if addStationField else None
+            key = (stationName, tags['device_name'], tags[tagName])
+            lastTimestamps[key] = parseDBTimeStamp(next(points)['time'])
+
+    logger.debug('Fetched last timestamps; series={}'.format(len(lastTimestamps)))
+    return lastTimestamps
+
+
+def getHistoryCoverage(config, startTimeUTC, stopTimeUTC):
+    """Fetches the daily count of Hour and Day points of every series between startTimeUTC and stopTimeUTC.
+
+    Uses a single grouped query, counting by calendar day in the configured timezone, or UTC when none is set.
+    Returns a dict keyed by (stationName, chanName, pointType), like getLastDBTimeStamps, of dicts mapping
+    each local date having points to their count.
+    """
+    settings = getSettings(config)
+    tagName = settings.tagName
+    pointTypes = [settings.tagValue_hour, settings.tagValue_day]
+    addStationField = settings.addStationField
+    timezone = settings.timezone or pytz.UTC
+    groupColumns = ['device_name', tagName]
+    if addStationField:
+        groupColumns.append('station_name')
+
+    coverage = {}
+    if settings.influxVersion == 2:
+        bucket = config['influxDb']['bucket']
+        query_api = config['influx'].query_api()
+        tagFilter = ' or '.join(['r.' + tagName + ' == "' + pointType + '"' for pointType in pointTypes])
+        # The range stop is exclusive, whereas stopTimeUTC is the last second of the range
+        result = query_api.query('import "timezone"\n' +
+                                 'option location = timezone.location(name: "' + timezone.zone + '")\n' +
+                                 'from(bucket:"' + bucket + '") ' +
+                                 '|> range(start: ' + startTimeUTC.strftime('%Y-%m-%dT%H:%M:%SZ') +
+                                 ', stop: ' + (stopTimeUTC + datetime.timedelta(seconds=1)).strftime('%Y-%m-%dT%H:%M:%SZ') + ') ' +
+                                 '|> filter(fn: (r) => ' +
+                                 '  r._measurement == "energy_usage" and ' +
+                                 '  r._field == "usage" and (' + tagFilter + '))' +
+                                 '|> group(columns: ["' + '", "'.join(groupColumns) + '"]) ' +
+                                 '|> aggregateWindow(every: 1d, fn: count, timeSrc: "_start", createEmpty: false)')
+        for table in result:
+            for record in table.records:
+                stationName = record['station_name'] if addStationField else None
+                counts = coverage.setdefault((stationName, record['device_name'], record[tagName]), {})
+                counts[record['_time'].astimezone(timezone).date()] = record['_value']
+
+    else:  # Influx v1
+        tagFilter = ' OR '.join([tagName.replace('\'', '\\\'') + ' = \'' + pointType + '\'' for pointType in pointTypes])
+        query = 'select count(usage) from energy_usage where (' + tagFilter + ') and ' + \
+                'time >= \'' + startTimeUTC.strftime('%Y-%m-%dT%H:%M:%SZ') + '\' and ' + \
+                'time <= \'' + stopTimeUTC.strftime('%Y-%m-%dT%H:%M:%SZ') + '\' ' + \
+                'group by time(1d), ' + ', '.join(groupColumns) + ' fill(none) tz(\'' + timezone.zone + '\')'
+        logger.debug('InfluxDB v1 Query: %s', query)
+        result = config['influx'].query(query)
+        for (_, tags), points in result.items():
+            stationName = tags['station_name'] if addStationField else None
+            counts = coverage.setdefault((stationName, tags['device_name'], tags[tagName]), {})
+            for point in points:
+                # Days start at local midnight, so the date of each day is its local date
+                counts[datetime.date.fromisoformat(point['time'][:10])] = point['count']
+
+    logger.debug('Fetched history coverage; series={}'.format(len(coverage)))
+    return coverage
+
+
+def getWatermarks(config):
+    """In-process high-watermark cache of the newest timestamp stored for each series.
+
+    The 'timestamps' dict uses the same (stationName, chanName, pointType) keys as getLastDBTimeStamps.
+    It is seeded from Influx once per detail tag, recorded in 'pointTypes', and afterwards advanced by
+    writeInfluxPoints after each successful write, so steady-state cycles never query Influx for
+    backfill ranges. A failed write invalidates the cache so that the next cycle re-reads Influx.
+    The 'lock' serializes seeding, advancing and invalidation, which happen on the writer thread too.
+
+    The cache is bound to the config dict (one cache per Vuegraf process).
+    """
+    return config.setdefault('_watermarks', {'pointTypes': set(), 'timestamps': {}, 'lock': threading.Lock()})
+
+
+def advanceWatermarks(watermarks, lastTimestamps):
+    """Merges the given (stationName, chanName, pointType) timestamps, keeping the newest per series."""
+    timestamps = watermarks['timestamps']
+    for key, timestamp in lastTimestamps.items():
+        current = timestamps.get(key)
+        if current is None or timestamp > current:
+            timestamps[key] = timestamp
+
+
+def updateWatermarks(config, usageDataPoints):
+    """Advances the watermark cache to the newest timestamp of each series in a written batch."""
+    addStationField = getSettings(config).addStationField
+    lastTimestamps = {}
+    if isinstance(usageDataPoints, PointBatch):
+        # Compare the nanoseconds of each point, and only convert the newest timestamp of each series
+        seriesKeys = [(deviceName if addStationField else None, chanName, detailed)
+                      for accountName, deviceName, chanName, detailed in usageDataPoints.series]
+        lastNanoseconds = {}
+        for seriesIndex, nanoseconds in zip(usageDataPoints.seriesColumn, usageDataPoints.timestampColumn):
+            key = seriesKeys[seriesIndex]
+            current = lastNanoseconds.get(key)
+            if current is None or nanoseconds > current:
+                lastNanoseconds[key] = nanoseconds
+        lastTimestamps = {key: fromNanoseconds(nanoseconds) for key, nanoseconds in lastNanoseconds.items()}
+    else:
+        for pt in usageDataPoints:
+            key = (pt.deviceName if addStationField else None, pt.chanName, pt.detailed)
+            current = lastTimestamps.get(key)
+            if current is None or pt.timestamp > current:
+                lastTimestamps[key] = pt.timestamp
+    watermarks = getWatermarks(config)
+    with watermarks['lock']:
+        advanceWatermarks(watermarks, lastTimestamps)
+
+
+def invalidateWatermarks(config):
+    """Forgets all cached watermarks, forcing the next lookup to query Influx again.
+
+    The timestamps are replaced rather than cleared, since collection still running may hold them, and must not
+    fall back to backfilling every series from scratch.
+    """
+    watermarks = getWatermarks(config)
+    with watermarks['lock']:
+        watermarks['pointTypes'] = set()
+        watermarks['timestamps'] = {}
+
+
+def getCachedLastDBTimeStamps(config, pointTypes):
+    """Returns the watermark cache, seeding it from Influx for any detail tag not yet seeded.
+
+    On a cold start this issues a single getLastDBTimeStamps query, even when accounts or jobs are collected
+    in parallel; in steady state it issues none.
+    """
+    watermarks = getWatermarks(config)
+    with watermarks['lock']:
+        unseededPointTypes = [pointType for pointType in pointTypes if pointType not in watermarks['pointTypes']]
+        if unseededPointTypes:
+            advanceWatermarks(watermarks, getLastDBTimeStamps(config, unseededPointTypes))
+            watermarks['pointTypes'].update(unseededPointTypes)
+        return watermarks['timestamps']
+
+
+def getLastDBTimeStamp(config, deviceName, chanName, pointType, startTime, stopTime, fillInMissingData, lastTimestamps=None):
+    """Determines the start and stop times needed to backfill any data missing for the given series.
+
+    If lastTimestamps, as returned by getLastDBTimeStamps, is provided then the last record time is
+    looked up there instead of querying Influx for this series alone. The stopTime is returned unchanged,
+    since collect splits the backfill window into chunks with planBackfillChunks.
+    """
+    settings = getSettings(config)
+    tagName = settings.tagName
+    tagValue_second = settings.tagValue_second
+    tagValue_minute = settings.tagValue_minute
+    influxVersion = settings.influxVersion
+    addStationField = settings.addStationField
     timeStr = ''
+    dbLastRecordTime = None
     # Get timestamp of last record in database
+    if lastTimestamps is not None:
+        stationName = deviceName if addStationField else None
+        dbLastRecordTime = lastTimestamps.get((stationName, chanName, pointType))
+
     # Influx v2
-    if influxVersion == 2:
+    elif influxVersion == 2:
         stationFilter = ""
         if addStationField:
             stationFilter = '  r.station_name == "' + deviceName + '" and '
@@ -97,14 +304,10 @@ def getLastDBTimeStamp(config, deviceName, chanName, pointType, startTime, stopT
         if len(result) > 0:
             timeStr = next(result.get_points())['time']
 
-    # Depending on version of Influx, the string format for the time is different.
-    # So strip out the variable timezone bits (along with any microsecond values)
     if len(timeStr) > 0:
-        timeStr = timeStr[:19] + 'Z'
-
-        # Convert the timeStr into an aware datetime object.
-        dbLastRecordTime = datetime.datetime.strptime(timeStr, '%Y-%m-%dT%H:%M:%S%z').replace(tzinfo=datetime.timezone.utc)
+        dbLastRecordTime = parseDBTimeStamp(timeStr)
 
+    if dbLastRecordTime is not None:
         if pointType == tagValue_minute:
             if dbLastRecordTime < (stopTime - datetime.timedelta(minutes=2, seconds=stopTime.second)):
                 fillInMissingData = True
@@ -114,42 +317,20 @@ def getLastDBTimeStamp(config, deviceName, chanName, pointType, startTime, stopT
                 if int((stopTime - startTime).total_seconds()) > 604800:      # 7 Days
                     startTime = stopTime - datetime.timedelta(minutes=10080)  # 7 Days
 
-                # Can only get a maximum of 12 hours worth of minute data in a single API call.
-                # If more than 12 hours worth is needed, get data in batches; set stopTime to be
-                # 12 hours more than the starttime
-                if int((stopTime - startTime).total_seconds()) > 43200:       # 12 Hours
-                    stopTime = startTime + datetime.timedelta(minutes=720)    # 12 Hours
-
         if pointType == tagValue_second:
             if dbLastRecordTime < (startTime - datetime.timedelta(seconds=2)):
                 fillInMissingData = True
                 startTime = (dbLastRecordTime + datetime.timedelta(seconds=1)).replace(microsecond=0)
-                # Adjust start or stop times if backfill interval exceeds 1 hour
-                if (int((stopTime - startTime).total_seconds()) > 3600):
-                    detailedIntervalSecs = getConfigValue(config, 'detailedIntervalSecs')
-                    # Can never get more than 1 hour of historical second data if detailedIntervalSecs
-                    # is set to greater than 1h.  Set backfill period to be just the past one hour in that case.
-                    if (detailedIntervalSecs > 3600):
-                        # 1 Hour max since detailedIntervalSecs is more than 1 hour
-                        startTime = stopTime - datetime.timedelta(seconds=3600)
-                    else:
-                        # Can only backfill a maximum of 3 hours for second data.
-                        # So if last record in DB exceeds 3 hours, set the startTime to be 3 hours ago.
-                        if int((stopTime - startTime).total_seconds()) > 10800:        # 3 Hours
-                            startTime = stopTime - datetime.timedelta(seconds=10800)   # 3 Hours
-
-                        # Can only get a maximum of 1 hour's worth of second data in a single API call.
-                        # If more than 1 hour's worth is needed, get data in batches; set stopTime to be
-                        # 1 hour more than the starttime
-                        stopTime = startTime + datetime.timedelta(seconds=3600)  # limit to 1 hour batch
+                # Can only backfill a maximum of 3 hours for second data.
+                # So if last record in DB exceeds 3 hours, set the startTime to be 3 hours ago.
+                if int((stopTime - startTime).total_seconds()) > 10800:        # 3 Hours
+                    startTime = stopTime - datetime.timedelta(seconds=10800)   # 3 Hours
     else:
         if pointType == tagValue_minute:
             startTime = startTime - datetime.timedelta(days=7)
-            stopTime = startTime + datetime.timedelta(hours=12)
             fillInMissingData = True
         elif pointType == tagValue_second:
             startTime = startTime - datetime.timedelta(hours=3)
-            stopTime = startTime + datetime.timedelta(hours=1)
             fillInMissingData = True
 
     return startTime, stopTime, fillInMissingData
@@ -162,8 +343,7 @@ def initInfluxConnection(config):
 
     timeout = config['influxDb']['timeout'] if 'timeout' in config['influxDb'] else 60_000
 
-    influxVersion = getInfluxVersion(config)
-    if influxVersion == 2:
+    if getSettings(config).influxVersion == 2:
         logger.info('Using InfluxDB version 2')
         bucket = config['influxDb']['bucket']
         org = config['influxDb']['org']
@@ -210,33 +390,53 @@ def initInfluxConnection(config):
     config['influx'] = influx
 
 
+def writeInfluxLines(config, lines):
+    """Writes lines of line protocol, as encoded by LineProtocolEncoder, to the Influx db."""
+    if getSettings(config).influxVersion == 2:
+        bucket = config['influxDb']['bucket']
+        write_api = config['influx'].write_api(write_options=influxdb_client.client.write_api.SYNCHRONOUS)
+        write_api.write(bucket=bucket, record='\n'.join(lines).encode('utf-8'))
+    else:
+        config['influx'].write_points(lines, batch_size=5000, protocol='line')
+
+
+def isRejectedWrite(exc):
+    """Returns True if the exception is an HTTP 4xx response, other than 429, so Influx will never accept the write as is.
+
+    Connection errors, and 429 or 5xx responses, are transient, and the write may be retried.
+    """
+    if isinstance(exc, influxdb_client.rest.ApiException):
+        statusCode = exc.status
+    elif isinstance(exc, influxdb.exceptions.InfluxDBClientError):
+        statusCode = exc.code
+    else:
+        return False
+    return isinstance(statusCode, int) and 400 <= statusCode < 500 and statusCode != 429
+
+
 def writeInfluxPoints(config, usageDataPoints):
-    """Writes a list of collect.Point objects to the Influx db.
+    """Writes a points.PointBatch, or a list of Point objects, to the Influx db.
 
-    Converts to the appropriate internal Influx data format for writing.
+    Points are encoded directly into line protocol, which both Influx versions accept.
     """
     # Write to database after each historical batch to prevent timeout issues on large history intervals.
     logger.info('Submitting datapoints to database; points={}'.format(len(usageDataPoints)))
-    influxPoints = [createDataPoint(config, pt) for pt in usageDataPoints]
+    lines = getLineProtocolEncoder(config).encodePoints(usageDataPoints)
     if config['args'].debug:
-        dumpPoints(config, "Sending to database", influxPoints)
+        dumpPoints("Sending to database", lines)
     if config['args'].dryrun:
         logger.info('Dryrun mode enabled.  Skipping database write.')
     else:
-        influxVersion = getInfluxVersion(config)
-        if influxVersion == 2:
-            bucket = config['influxDb']['bucket']
-            write_api = config['influx'].write_api(write_options=influxdb_client.client.write_api.SYNCHRONOUS)
-            write_api.write(bucket=bucket, record=influxPoints)
-        else:
-            config['influx'].write_points(influxPoints, batch_size=5000)
+        try:
+            writeInfluxLines(config, lines)
+        except Exception:
+            # Some points may not have been stored; fall back to querying Influx for backfill ranges
+            invalidateWatermarks(config)
+            raise
+        updateWatermarks(config, usageDataPoints)
 
 
-def dumpPoints(config, label, usageDataPoints):
-    influxVersion = getInfluxVersion(config)
+def dumpPoints(label, lines):
     logger.debug(label)
-    for point in usageDataPoints:
-        if influxVersion == 2:
-            logger.debug('  {}'.format(point.to_line_protocol()))
-        else:
-            logger.debug(f'  {pprint.pformat(point)}')
+    for line in lines:
+        logger.debug('  {}'.format(line))
@@ -0,0 +1,118 @@
+# Copyright (c) Jason Ertel (jertel).
+# This file is part of the Vuegraf project and is made available under the MIT License.
+
+# Contains logic relating to encoding data points into InfluxDB line protocol.
+
+import math
+
+from vuegraf.config import getSettings
+from vuegraf.points import PointBatch, toNanoseconds
+
+
+MEASUREMENT = 'energy_usage'
+
+# Same escaping as influxdb_client applies to tag keys and values
+ESCAPE_TAG = str.maketrans({
+    ',': r'\,',
+    '=': r'\=',
+    ' ': r'\ ',
+    '\n': r'\n',
+    '\t': r'\t',
+    '\r': r'\r',
+})
+
+
+def escapeTag(value):
+    escaped = str(value).translate(ESCAPE_TAG)
+    if escaped.endswith('\\'):
+        escaped += ' '
+    return escaped
+
+
+def formatUsage(watts):
+    """Formats a usage field value the way influxdb_client does, returning None for values Influx cannot store."""
+    if isinstance(watts, bool):
+        return str(watts).lower()
+    if isinstance(watts, int):
+        return '{}i'.format(watts)
+    if not math.isfinite(watts):
+        return None
+    value = str(watts)
+    return value[:-2] if value.endswith('.0') else value
+
+
+class LineProtocolEncoder:
+    """Encodes points.Point objects, or a points.PointBatch, into InfluxDB line protocol, which both Influx versions accept.
+
+    The detail tag and station settings are read from the config once, and the escaped measurement
+    and tag set of each series is cached, so encoding a point only formats its value and timestamp.
+    Output is identical to influxdb_client.Point.to_line_protocol(), with tags sorted by key.
+    """
+
+    def __init__(self, tagName, addStationField):
+        self.tagName = tagName
+        self.addStationField = addStationField
+        self.seriesPrefixes = {}
+
+    def getSeriesPrefix(self, accountName, deviceName, chanName, detailed):
+        key = (accountName, deviceName if self.addStationField else None, chanName, detailed)
+        prefix = self.seriesPrefixes.get(key)
+        if prefix is None:
+            tags = {
+                'account_name': accountName,
+                'device_name': chanName,
+                self.tagName: detailed,
+            }
+            if self.addStationField:
+                tags['station_name'] = deviceName
+            tagSet = ''
+            for name, value in sorted(tags.items()):
+                value = escapeTag(value)
+                # Like influxdb_client, omit empty tags, which Influx rejects
+                if value != '':
+                    tagSet += ',{}={}'.format(escapeTag(name), value)
+            prefix = self.seriesPrefixes.setdefault(key, '{}{} usage='.format(MEASUREMENT, tagSet))
+        return prefix
+
+    def encodeLines(self, usageDataPoints):
+        """Returns one line of line protocol per point, skipping points without a storable value."""
+        lines = []
+        timestamps = {}
+        for pt in usageDataPoints:
+            usage = formatUsage(pt.usageWatts)
+            if usage is None:
+                continue
+            # Channels of a device share timestamps, so convert each one only once per batch
+            nanoseconds = timestamps.get(pt.timestamp)
+            if nanoseconds is None:
+                nanoseconds = timestamps.setdefault(pt.timestamp, toNanoseconds(pt.timestamp))
+            prefix = self.getSeriesPrefix(pt.accountName, pt.deviceName, pt.chanName, pt.detailed)
+            lines.append('{}{} {}'.format(prefix, usage, nanoseconds))
+        return lines
+
+    def encodePoints(self, usageDataPoints):
+        """Returns one line of line protocol per point of a PointBatch or a list of Point objects."""
+        if isinstance(usageDataPoints, PointBatch):
+            return self.encodeBatch(usageDataPoints)
+        return self.encodeLines(usageDataPoints)
+
+    def encodeBatch(self, batch):
+        """Returns one line of line protocol per point of a PointBatch, skipping points without a storable value.
+
+        The timestamps are already in nanoseconds, and the tag set of each series is looked up once per batch.
+        """
+        prefixes = [self.getSeriesPrefix(*key) for key in batch.series]
+        lines = []
+        for seriesIndex, timestamp, value in zip(batch.seriesColumn, batch.timestampColumn, batch.wattsColumn):
+            usage = formatUsage(value)
+            if usage is not None:
+                lines.append('{}{} {}'.format(prefixes[seriesIndex], usage, timestamp))
+        return lines
+
+
+def getLineProtocolEncoder(config):
+    encoder = config.get('_lineProtocolEncoder')
+    if encoder is None:
+        settings = getSettings(config)
+        encoder = config.setdefault('_lineProtocolEncoder', LineProtocolEncoder(settings.tagName, settings.addStationField))
+    return encoder
@@ -11,7 +11,8 @@ import json
 import logging
 from paho.mqtt import client
 
-from vuegraf.config import getConfigValue
+from vuegraf.config import getSettings
+from vuegraf.points import PointBatch
 
 logger = logging.getLogger('vuegraf.mqtt')
 
@@ -48,7 +49,17 @@ def initMqttConnectionIfConfigured(config) -> None:
     logger.info(f"MQTT client set up to publish to {mqtt_host} on {topic}.")
 
 
-def _retainOnlyLatestPointPerChannel(points: list) -> list:
+def _retainOnlyLatestPointPerChannel(points) -> list:
+    if isinstance(points, PointBatch):
+        # Only create a Point for the latest point of each channel
+        latestIndexes = {}
+        for index, (seriesIndex, timestamp) in enumerate(zip(points.seriesColumn, points.timestampColumn)):
+            key = points.series[seriesIndex][:3]
+            latestIndex = latestIndexes.get(key)
+            if latestIndex is None or timestamp > points.timestampColumn[latestIndex]:
+                latestIndexes[key] = index
+        return [points.getPoint(index) for index in latestIndexes.values()]
+
     acctAndChanToPoints = defaultdict(list)
     for pt in points:
         acctAndChanToPoints[(pt.accountName, pt.deviceName, pt.chanName)].append(pt)
@@ -58,8 +69,8 @@ def _retainOnlyLatestPointPerChannel(points: list) -> list:
     ]
 
 
-def publishMqttMessagesIfConnected(config, usageDataPoints: list) -> None:
-    """Publishes usage value message to MQTT from collect.Point value list.
+def publishMqttMessagesIfConnected(config, usageDataPoints) -> None:
+    """Publishes usage value message to MQTT from a points.PointBatch, or a list of Point objects.
 
     Only publishes the latest point in a batch for each account+channel combo.
     Whereas Influx wants to have a complete picture, MQTT only wants to publish
@@ -71,7 +82,7 @@ def publishMqttMessagesIfConnected(config, usageDataPoints: list) -> None:
         return
     topic = config["mqtt"]["topic"]
 
-    addStationField = getConfigValue(config, "addStationField")
+    addStationField = getSettings(config).addStationField
 
     latestPoints = _retainOnlyLatestPointPerChannel(usageDataPoints)
     if len(usageDataPoints) != len(latestPoints):
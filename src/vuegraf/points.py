@@ -0,0 +1,141 @@
+# Copyright (c) Jason Ertel (jertel).
+# This file is part of the Vuegraf project and is made available under the MIT License.
+
+# Contains the containers of collected data points.
+
+import array
+from dataclasses import dataclass
+import datetime
+import itertools
+from typing import Union
+
+
+EPOCH = datetime.datetime.fromtimestamp(0, tz=datetime.timezone.utc)
+
+
+def toNanoseconds(timestamp):
+    """Converts a datetime, assumed to be UTC when naive, into nanoseconds since the epoch."""
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=datetime.timezone.utc)
+    delta = timestamp - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1_000_000_000 + delta.microseconds * 1000
+
+
+def fromNanoseconds(nanoseconds):
+    """Converts nanoseconds since the epoch into an aware UTC datetime, truncated to microseconds."""
+    return EPOCH + datetime.timedelta(microseconds=nanoseconds // 1000)
+
+
+@dataclass
+class Point:
+    """Container for timestamped device readings from Vue.
+
+    These can be repacked by Influx and MQTT when writing to those engines.
+    """
+    accountName: str
+    deviceName: str  # aka station; the Vue, smart plug, etc
+    chanName: str  # for example, each circuit or the total/balance
+    usageWatts: float
+    timestamp: datetime.datetime  # zone aware, UTC
+    detailed: Union[bool, str]  # 'Minutes', 'Days', etc or False
+
+
+class PointBatch:
+    """Columnar container of collected points, which costs a fraction of the memory of a list of Point objects.
+
+    Each distinct (accountName, deviceName, chanName, detailed) series is stored once, and every point only
+    takes an entry in three arrays: the index of its series, its timestamp, in nanoseconds since the epoch,
+    and its usage in watts, always stored as a float. Iterating or indexing a batch yields Point objects,
+    so code written for lists of points keeps working.
+    """
+
+    def __init__(self, points=()):
+        self.series = []
+        self.seriesIndexes = {}
+        self.seriesColumn = array.array('L')
+        self.timestampColumn = array.array('q')
+        self.wattsColumn = array.array('d')
+        self.extend(points)
+
+    def getSeriesIndex(self, accountName, deviceName, chanName, detailed):
+        key = (accountName, deviceName, chanName, detailed)
+        index = self.seriesIndexes.get(key)
+        if index is None:
+            index = self.seriesIndexes.setdefault(key, len(self.series))
+            self.series.append(key)
+        return index
+
+    def add(self, accountName, deviceName, chanName, usageWatts, timestamp, detailed):
+        """Appends a point, given the same fields as a Point."""
+        self.seriesColumn.append(self.getSeriesIndex(accountName, deviceName, chanName, detailed))
+        self.timestampColumn.append(toNanoseconds(timestamp))
+        self.wattsColumn.append(usageWatts)
+
+    def append(self, point):
+        self.add(point.accountName, point.deviceName, point.chanName, point.usageWatts, point.timestamp, point.detailed)
+
+    def addSeries(self, accountName, deviceName, chanName, detailed, nanoseconds, watts):
+        """Appends the timestamps and watts of a single series, as returned by usage.convertUsage, without creating any Point."""
+        if hasattr(nanoseconds, 'tolist'):
+            nanoseconds, watts = nanoseconds.tolist(), watts.tolist()
+        seriesIndex = self.getSeriesIndex(accountName, deviceName, chanName, detailed)
+        self.seriesColumn.extend(itertools.repeat(seriesIndex, len(nanoseconds)))
+        self.timestampColumn.extend(nanoseconds)
+        self.wattsColumn.extend(watts)
+
+    def extend(self, points):
+        """Appends the points of another PointBatch, or of any iterable of Point objects."""
+        if not isinstance(points, PointBatch):
+            for point in points:
+                self.append(point)
+            return
+        seriesIndexes = [self.getSeriesIndex(*key) for key in points.series]
+        self.seriesColumn.extend(seriesIndexes[seriesIndex] for seriesIndex in points.seriesColumn)
+        self.timestampColumn.extend(points.timestampColumn)
+        self.wattsColumn.extend(points.wattsColumn)
+
+    def select(self, indexes):
+        """Returns a new batch of the points at the given indexes, or in the given slice."""
+        batch = PointBatch()
+        batch.series = list(self.series)
+        batch.seriesIndexes = dict(self.seriesIndexes)
+        if isinstance(indexes, slice):
+            batch.seriesColumn = self.seriesColumn[indexes]
+            batch.timestampColumn = self.timestampColumn[indexes]
+            batch.wattsColumn = self.wattsColumn[indexes]
+        else:
+            for index in indexes:
+                batch.seriesColumn.append(self.seriesColumn[index])
+                batch.timestampColumn.append(self.timestampColumn[index])
+                batch.wattsColumn.append(self.wattsColumn[index])
+        return batch
+
+    def getPoint(self, index):
+        accountName, deviceName, chanName, detailed = self.series[self.seriesColumn[index]]
+        return Point(accountName, deviceName, chanName, self.wattsColumn[index], fromNanoseconds(self.timestampColumn[index]), detailed)
+
+    def __len__(self):
+        return len(self.timestampColumn)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self.getPoint(index)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.select(index)
+        return self.getPoint(index)
+
+    def __eq__(self, other):
+        """A batch equals a batch, or a list, of the same points in the same order."""
+        if not isinstance(other, (PointBatch, list)):
+            return NotImplemented
+        return len(self) == len(other) and list(self) == list(other)
+
+    def __repr__(self):
+        return 'PointBatch({!r})'.format(list(self))
+
+
+def toPointBatch(points):
+    """Returns the given points as a PointBatch, converting a list of Point objects if needed."""
+    return points if isinstance(points, PointBatch) else PointBatch(points)
@@ -0,0 +1,196 @@
+# Copyright (c) Jason Ertel (jertel).
+# This file is part of the Vuegraf project and is made available under the MIT License.
+
+# Contains logic relating to pacing the requests made to the Emporia API.
+
+import functools
+import logging
+import threading
+import time
+
+from vuegraf.config import getConfigValue
+
+
+logger = logging.getLogger('vuegraf.ratelimit')
+
+# PyEmVue methods which make a request to the Emporia API
+LIMITED_CALLS = ('login', 'get_devices', 'get_device_list_usage', 'get_chart_usage')
+
+
+class TokenBucket:
+    """Allows ratePerSec calls per second on average, in bursts of up to burst calls.
+
+    A ratePerSec of 0 disables the bucket.
+    """
+
+    def __init__(self, ratePerSec, burst):
+        self.ratePerSec = ratePerSec
+        self.capacity = max(burst, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Takes a token, sleeping until it is available, and returns the seconds slept."""
+        if self.ratePerSec <= 0:
+            return 0
+
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.ratePerSec)
+            self.updated = now
+            # Tokens may go negative, which reserves a future token and keeps waiting callers in order
+            self.tokens -= 1
+            waitSecs = max(0, -self.tokens / self.ratePerSec)
+
+        if waitSecs > 0:
+            time.sleep(waitSecs)
+        return waitSecs
+
+
+class ConcurrencyGovernor:
+    """Limits the number of requests in flight, adapting the limit with additive increase, multiplicative decrease.
+
+    The limit halves on every unhealthy request and grows by one after as many healthy requests
+    as the current limit, up to maxLimit.
+    """
+
+    def __init__(self, maxLimit):
+        self.maxLimit = max(maxLimit, 1)
+        self.limit = self.maxLimit
+        self.inFlight = 0
+        self.healthyCount = 0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while self.inFlight >= self.limit:
+                self.condition.wait()
+            self.inFlight += 1
+
+    def release(self, healthy):
+        with self.condition:
+            self.inFlight -= 1
+            if healthy:
+                self.healthyCount += 1
+                if self.healthyCount >= self.limit:
+                    self.healthyCount = 0
+                    self.limit = min(self.maxLimit, self.limit + 1)
+            else:
+                self.healthyCount = 0
+                if self.limit > 1:
+                    self.limit = self.limit // 2
+                    logger.warning('Backing off Emporia API concurrency; limit={}'.format(self.limit))
+            self.condition.notify_all()
+
+
+def isThrottled(exc):
+    """Returns True if the exception is an HTTP response indicating the Emporia API is overloaded."""
+    response = getattr(exc, 'response', None)
+    statusCode = getattr(response, 'status_code', None)
+    return isinstance(statusCode, int) and (statusCode == 429 or statusCode >= 500)
+
+
+def newCounters():
+    return {'calls': 0, 'throttled': 0, 'errors': 0, 'waitSecs': 0.0, 'latencySecs': 0.0}
+
+
+class ApiLimiter:
+    """Shared gate for all Emporia API calls, combining a global and per-account token buckets with a ConcurrencyGovernor.
+
+    Usage counters are kept per account until taken with takeCounters.
+    """
+
+    def __init__(self, requestsPerSec, accountRequestsPerSec, burst, maxConcurrentRequests, slowRequestSecs):
+        self.globalBucket = TokenBucket(requestsPerSec, burst)
+        self.accountRequestsPerSec = accountRequestsPerSec
+        self.burst = burst
+        self.slowRequestSecs = slowRequestSecs
+        self.governor = ConcurrencyGovernor(maxConcurrentRequests)
+        self.accountBuckets = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def call(self, accountName, fn, *args, **kwargs):
+        with self.lock:
+            if accountName not in self.accountBuckets:
+                self.accountBuckets[accountName] = TokenBucket(self.accountRequestsPerSec, self.burst)
+            accountBucket = self.accountBuckets[accountName]
+
+        waitSecs = accountBucket.acquire() + self.globalBucket.acquire()
+        self.governor.acquire()
+        startTime = time.monotonic()
+        throttled = False
+        failed = False
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            failed = True
+            throttled = isThrottled(e)
+            raise
+        finally:
+            latencySecs = time.monotonic() - startTime
+            slow = self.slowRequestSecs > 0 and latencySecs > self.slowRequestSecs
+            self.governor.release(not throttled and not slow)
+            with self.lock:
+                counters = self.counters.setdefault(accountName, newCounters())
+                counters['calls'] += 1
+                counters['throttled'] += int(throttled)
+                counters['errors'] += int(failed)
+                counters['waitSecs'] += waitSecs
+                counters['latencySecs'] += latencySecs
+
+    def getPauseSecs(self, baseSecs):
+        """Returns how long bulk collection should pause between batches of requests.
+
+        No pause is needed while the API is healthy. Once the governor has backed off, the pause grows
+        with how far it has backed off, by baseSecs for each halving of the concurrency limit.
+        """
+        backoff = self.governor.maxLimit // self.governor.limit
+        return baseSecs * (backoff.bit_length() - 1)
+
+    def takeCounters(self):
+        """Returns the usage counters of each account since the previous call, and resets them."""
+        with self.lock:
+            counters = self.counters
+            self.counters = {}
+        return counters
+
+
+class RateLimitedVue:
+    """Wraps a PyEmVue instance so each Emporia API call passes through the shared ApiLimiter."""
+
+    def __init__(self, vue, limiter, accountName):
+        self.vue = vue
+        self.limiter = limiter
+        self.accountName = accountName
+
+    def __getattr__(self, name):
+        attr = getattr(self.vue, name)
+        if name in LIMITED_CALLS:
+            return functools.partial(self.limiter.call, self.accountName, attr)
+        return attr
+
+
+def getApiLimiter(config):
+    limiter = config.get('_apiLimiter')
+    if limiter is None:
+        limiter = config.setdefault('_apiLimiter', ApiLimiter(
+            getConfigValue(config, 'apiRequestsPerSec'),
+            getConfigValue(config, 'apiAccountRequestsPerSec'),
+            getConfigValue(config, 'apiBurstRequests'),
+            getConfigValue(config, 'apiMaxConcurrentRequests'),
+            getConfigValue(config, 'apiSlowRequestSecs')))
+    return limiter
+
+
+def logApiUsage(config):
+    """Logs, and resets, the Emporia API usage of each account since the previous call."""
+    limiter = config.get('_apiLimiter')
+    if limiter is None:
+        return
+
+    for accountName, counters in limiter.takeCounters().items():
+        logger.info('Emporia API usage; account={}; calls={}; throttled={}; errors={}; waitSecs={:.1f}; latencySecs={:.1f}; '
+                    'concurrencyLimit={}'.format(accountName, counters['calls'], counters['throttled'], counters['errors'],
+                                                 counters['waitSecs'], counters['latencySecs'], limiter.governor.limit))
@@ -0,0 +1,155 @@
+# Copyright (c) Jason Ertel (jertel).
+# This file is part of the Vuegraf project and is made available under the MIT License.
+
+# Contains logic relating to keeping the devices of every account up to date, and caching them on disk.
+
+import json
+import logging
+import sys
+import threading
+import time
+
+from pyemvue.device import VueDevice, VueDeviceChannel
+
+from vuegraf.atomicfile import writeJsonAtomically
+from vuegraf.config import getConfigValue
+from vuegraf.device import discoverDevices
+
+
+logger = logging.getLogger('vuegraf.registry')
+
+DEVICE_CACHE_FILE_VERSION = 1
+
+
+def saveDeviceCache(config):
+    """Atomically writes the devices and channels of every account to the optional deviceCacheFile."""
+    cacheFile = getConfigValue(config, 'deviceCacheFile')
+    if not cacheFile:
+        return
+
+    cache = {
+        'version': DEVICE_CACHE_FILE_VERSION,
+        'accounts': {
+            account['name']: [[device.device_gid, device.device_name, [[chan.channel_num, chan.name] for chan in device.channels]]
+                              for device in account['deviceList']]
+            for account in config['accounts'] if 'deviceList' in account
+        },
+    }
+
+    writeJsonAtomically(cacheFile, cache, '.vuegraf-devices-')
+    logger.debug('Saved device cache; deviceCacheFile={}; accounts={}'.format(cacheFile, len(cache['accounts'])))
+
+
+def loadDeviceCache(config):
+    """Returns the devices of each account name saved in the optional deviceCacheFile, as returned by PyEmVue.get_devices.
+
+    A missing or unreadable cache is ignored, leaving the devices to be discovered on startup as usual.
+    """
+    cacheFile = getConfigValue(config, 'deviceCacheFile')
+    if not cacheFile:
+        return {}
+
+    try:
+        with open(cacheFile) as f:
+            cache = json.load(f)
+        if cache['version'] != DEVICE_CACHE_FILE_VERSION:
+            raise ValueError('unsupported device cache file version {}'.format(cache['version']))
+        accountsDevices = {}
+        for accountName, devices in cache['accounts'].items():
+            accountsDevices[accountName] = [newDevice(gid, deviceName, channels) for gid, deviceName, channels in devices]
+    except FileNotFoundError:
+        logger.info('No device cache file found, devices will be discovered; deviceCacheFile={}'.format(cacheFile))
+        return {}
+    except Exception as e:
+        logger.warning('Ignoring unreadable device cache file; deviceCacheFile={}; error={}'.format(cacheFile, e))
+        return {}
+
+    logger.info('Loaded device cache; deviceCacheFile={}; accounts={}'.format(cacheFile, len(accountsDevices)))
+    return accountsDevices
+
+
+def newDevice(gid, deviceName, channels):
+    device = VueDevice()
+    device.device_gid = gid
+    device.device_name = deviceName
+    device.channels = []
+    for channelNum, chanName in channels:
+        chan = VueDeviceChannel()
+        chan.device_gid = gid
+        chan.channel_num = channelNum
+        chan.name = chanName
+        device.channels.append(chan)
+    return device
+
+
+class DeviceRegistry:
+    """Discovers the devices and channels of every account again from a background thread, so collection never waits for it.
+
+    Devices are discovered every deviceRefreshIntervalSecs, unless set to 0. Only the channels added or removed since
+    are logged. After each discovery the devices are saved
+    to the optional deviceCacheFile, so a restart can begin collecting from them while discovery runs in the background.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.refreshIntervalSecs = getConfigValue(config, 'deviceRefreshIntervalSecs')
+        self.condition = threading.Condition()
+        self.stopping = False
+        # Monotonic time of the last discovery, or None when one is due right away
+        self.lastRefreshSecs = time.monotonic()
+        self.thread = threading.Thread(target=self.run, name='vuegraf-devices', daemon=True)
+
+    def start(self, discover):
+        """Starts refreshing the devices of every account, right away when discover is set, such as after loading cached devices."""
+        if discover:
+            self.lastRefreshSecs = None
+        else:
+            self.saveCache()
+        self.thread.start()
+
+    def getWaitSecs(self):
+        """Returns the seconds until the next discovery, or None when none is due. Caller must hold the condition."""
+        if self.lastRefreshSecs is None:
+            return 0
+        if self.refreshIntervalSecs <= 0:
+            return None
+        return max(0, self.refreshIntervalSecs - (time.monotonic() - self.lastRefreshSecs))
+
+    def takeRefresh(self):
+        """Waits until a discovery is due, returning False once stopped."""
+        with self.condition:
+            while not self.stopping:
+                waitSecs = self.getWaitSecs()
+                if waitSecs == 0:
+                    self.lastRefreshSecs = time.monotonic()
+                    return True
+                self.condition.wait(waitSecs)
+            return False
+
+    def run(self):
+        while self.takeRefresh():
+            self.refresh()
+
+    def refresh(self):
+        for account in self.config['accounts']:
+            if self.stopping:
+                break
+            try:
+                discoverDevices(account)
+            except Exception:
+                # The previously discovered devices remain in use until the next discovery
+                logger.warning('Failed to discover devices; account={}; error={}'.format(account['name'], sys.exc_info()[1]))
+        self.saveCache()
+
+    def saveCache(self):
+        try:
+            saveDeviceCache(self.config)
+        except Exception:
+            logger.warning('Failed to save device cache; error={}'.format(sys.exc_info()[1]))
+
+    def shutdown(self, deadlineSecs=None):
+        """Stops refreshing, waiting at most deadlineSecs for the discovery of the current account to finish."""
+        with self.condition:
+            self.stopping = True
+            self.condition.notify_all()
+        self.thread.join(deadlineSecs)
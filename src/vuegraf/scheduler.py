@@ -0,0 +1,163 @@
+# Copyright (c) Jason Ertel (jertel).
+# This file is part of the Vuegraf project and is made available under the MIT License.
+
+# Contains logic relating to scheduling collection jobs.
+
+import concurrent.futures
+import logging
+import sys
+import threading
+import time
+import traceback
+
+from vuegraf.config import getConfigValue
+from vuegraf.points import PointBatch
+
+
+logger = logging.getLogger('vuegraf.scheduler')
+
+
+def initAccountCollector(config):
+    """Prepares a worker pool for collecting all accounts in parallel.
+
+    Returns a function that applies a collect function to every account, returning the results in
+    account order, and a function that releases the pool on shutdown.
+    """
+    maxConcurrentAccounts = getConfigValue(config, 'maxConcurrentAccounts')
+    logger.debug('Initializing account collection; maxConcurrentAccounts={}'.format(maxConcurrentAccounts))
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=maxConcurrentAccounts, thread_name_prefix='vuegraf-account')
+
+    def collectAccounts(collectAccount):
+        return list(executor.map(collectAccount, config['accounts']))
+    return collectAccounts, executor.shutdown
+
+
+class Job:
+    """A type of collection, run for every account on the job's own worker thread whenever it is due.
+
+    On every scheduler tick, due is called with the current UTC time and returns the arguments for the next
+    run, or None when the job is not due. The collect function is called with an account followed by those
+    arguments, and returns the account's points. Due jobs are dispatched in ascending priority order.
+
+    When coalesce is set, a due run is skipped while the previous run is still in progress, otherwise it is
+    queued behind it. An account that fails to collect is retried up to maxRetries times, retryDelaySecs apart.
+
+    When stream is set, the collect function instead returns an iterable of point batches, and each batch is
+    saved as soon as it is produced, so a long run never holds all of its points in memory. A retried
+    streaming run starts over, rewriting the batches already saved.
+    """
+
+    def __init__(self, name, priority, due, collect, maxRetries=0, retryDelaySecs=0, coalesce=True, stream=False):
+        self.name = name
+        self.priority = priority
+        self.due = due
+        self.collect = collect
+        self.maxRetries = maxRetries
+        self.retryDelaySecs = retryDelaySecs
+        self.coalesce = coalesce
+        self.stream = stream
+        self.pendingRuns = 0
+
+
+class JobScheduler:
+    """Runs each Job on its own worker thread, so a slow job never delays the others.
+
+    The points collected by a job run, from all accounts, are handed to savePoints at the end of the run, or
+    batch by batch for a streaming job.
+    """
+
+    def __init__(self, config, savePoints):
+        self.config = config
+        self.savePoints = savePoints
+        self.jobs = []
+        self.lock = threading.Lock()
+        self.stopEvent = threading.Event()
+        # Job runs queued or in progress
+        self.futures = set()
+
+    def addJob(self, job):
+        job.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='vuegraf-' + job.name)
+        job.collectAccounts, job.shutdownCollector = initAccountCollector(self.config)
+        self.jobs.append(job)
+        self.jobs.sort(key=lambda j: j.priority)
+
+    def dispatch(self, nowUTC):
+        """Starts, or queues, a run of every job that is due."""
+        for job in self.jobs:
+            args = job.due(nowUTC)
+            if args is None:
+                continue
+
+            with self.lock:
+                if job.coalesce and job.pendingRuns > 0:
+                    logger.warning('Skipping job run since the previous run is still in progress; job={}'.format(job.name))
+                    continue
+                job.pendingRuns += 1
+            future = job.executor.submit(self.runJob, job, args)
+            with self.lock:
+                self.futures.add(future)
+            future.add_done_callback(self.discardFuture)
+
+    def discardFuture(self, future):
+        with self.lock:
+            self.futures.discard(future)
+
+    def runJob(self, job, args):
+        startSecs = time.monotonic()
+        try:
+            accountsDataPoints = job.collectAccounts(lambda account: self.collectAccount(job, account, args))
+            usageDataPoints = PointBatch()
+            for accountDataPoints in accountsDataPoints:
+                usageDataPoints.extend(accountDataPoints)
+            if not job.stream:
+                self.savePoints(usageDataPoints)
+            logger.debug('Finished job run; job={}; points={}; durationSecs={:.1f}'
+                         .format(job.name, len(usageDataPoints), time.monotonic() - startSecs))
+        except Exception:
+            logger.error('Failed to save job data; job={}: {}'.format(job.name, sys.exc_info()))
+            traceback.print_exc()
+        finally:
+            with self.lock:
+                job.pendingRuns -= 1
+
+    def collectAccount(self, job, account, args):
+        """Collects a single account, retrying failures. A failure only affects this account."""
+        attempt = 0
+        while True:
+            try:
+                if not job.stream:
+                    return job.collect(account, *args)
+                for batchDataPoints in job.collect(account, *args):
+                    self.savePoints(batchDataPoints)
+                    if self.stopEvent.is_set():
+                        # The batches not yet produced are collected by the next start
+                        break
+                return []
+            except Exception:
+                attempt += 1
+                if attempt > job.maxRetries or self.stopEvent.is_set():
+                    logger.error('Failed to record new usage data; job={}: {}'.format(job.name, sys.exc_info()))
+                    traceback.print_exc()
+                    return []
+                logger.warning('Failed to record new usage data, retrying; job={}; attempt={}; retryDelaySecs={}; error={}'
+                               .format(job.name, attempt, job.retryDelaySecs, sys.exc_info()[1]))
+                if self.stopEvent.wait(job.retryDelaySecs):
+                    return []
+
+    def shutdown(self, deadlineSecs=None):
+        """Cancels queued job runs, and waits at most deadlineSecs, or without limit when None, for the runs in progress.
+
+        Further retries and batches of a streaming run are abandoned. Runs still in progress after the deadline
+        are abandoned too, so their points may not be saved; the next start backfills them.
+        """
+        self.stopEvent.set()
+        for job in self.jobs:
+            job.executor.shutdown(wait=False, cancel_futures=True)
+        with self.lock:
+            futures = list(self.futures)
+        notDone = concurrent.futures.wait(futures, deadlineSecs).not_done
+        if notDone:
+            logger.warning('Abandoning job runs still in progress; runs={}'.format(len(notDone)))
+        for job in self.jobs:
+            job.shutdownCollector(wait=False)
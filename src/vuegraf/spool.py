@@ -0,0 +1,239 @@
+# Copyright (c) Jason Ertel (jertel).
+# This file is part of the Vuegraf project and is made available under the MIT License.
+
+# Contains logic relating to spooling encoded points on disk until InfluxDB has stored them.
+
+import json
+import logging
+import os
+import sys
+import threading
+import traceback
+
+from vuegraf.atomicfile import writeJsonAtomically
+from vuegraf.config import getConfigValue
+from vuegraf.influx import dumpPoints, isRejectedWrite, updateWatermarks, writeInfluxLines
+from vuegraf.lineprotocol import getLineProtocolEncoder
+
+
+logger = logging.getLogger('vuegraf.spool')
+
+SEGMENT_SUFFIX = '.seg'
+ACK_FILE = 'ack'
+QUARANTINE_FILE = 'quarantine.lp'
+
+
+class Spool:
+    """Durable, append-only log of line protocol batches waiting to be written to InfluxDB.
+
+    Batches are appended to numbered segment files in the spool directory, and a new segment is started
+    once the current one reaches segmentMaxBytes. Each record is the length of its batch in bytes on a
+    line of its own, followed by the batch. The position of the oldest unacknowledged batch is kept in
+    an ack file, and a segment is deleted once all of its batches are acknowledged. A record left
+    incomplete by a crash is discarded on startup. Batches the database rejects are moved to a quarantine
+    file of plain line protocol, so they can be inspected, and written again once corrected.
+    """
+
+    def __init__(self, directory, segmentMaxBytes):
+        self.directory = directory
+        self.segmentMaxBytes = segmentMaxBytes
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+        self.segments = sorted(int(name[:-len(SEGMENT_SUFFIX)]) for name in os.listdir(directory) if name.endswith(SEGMENT_SUFFIX))
+        self.head = self.loadAck()
+        for segment in [segment for segment in self.segments if segment < self.head[0]]:
+            self.deleteSegment(segment)
+        if not self.segments:
+            self.segments.append(self.head[0])
+        elif self.segments[0] != self.head[0]:
+            # The acknowledged segment was already deleted
+            self.head = (self.segments[0], 0)
+
+        self.backlog = 0
+        for segment in self.segments:
+            self.backlog += self.recoverSegment(segment, self.head[1] if segment == self.head[0] else 0)
+        if self.backlog > 0:
+            logger.info('Found spooled batches to replay; backlog={}; spoolDir={}'.format(self.backlog, directory))
+
+    def segmentPath(self, segment):
+        return os.path.join(self.directory, '{:016d}{}'.format(segment, SEGMENT_SUFFIX))
+
+    def deleteSegment(self, segment):
+        os.unlink(self.segmentPath(segment))
+        self.segments.remove(segment)
+
+    def loadAck(self):
+        try:
+            with open(os.path.join(self.directory, ACK_FILE)) as f:
+                segment, offset = json.load(f)
+            return segment, offset
+        except FileNotFoundError:
+            return (self.segments[0] if self.segments else 0), 0
+
+    def saveAck(self):
+        writeJsonAtomically(os.path.join(self.directory, ACK_FILE), list(self.head), '.ack-')
+
+    def readRecord(self, f):
+        """Returns the next batch in an open segment file, or None at its end or at an incomplete record."""
+        header = f.readline()
+        if not header.endswith(b'\n') or not header[:-1].isdigit():
+            return None
+        payload = f.read(int(header))
+        if len(payload) != int(header) or f.read(1) != b'\n':
+            return None
+        return payload
+
+    def recoverSegment(self, segment, offset):
+        """Counts the batches of a segment from offset, truncating any incomplete record at its end."""
+        path = self.segmentPath(segment)
+        if not os.path.exists(path):
+            return 0
+        count = 0
+        with open(path, 'rb+') as f:
+            f.seek(offset)
+            while True:
+                recordOffset = f.tell()
+                if self.readRecord(f) is None:
+                    break
+                count += 1
+            if recordOffset < os.path.getsize(path):
+                logger.warning('Discarding incomplete spooled batch; segment={}; offset={}'.format(path, recordOffset))
+                f.truncate(recordOffset)
+        return count
+
+    def append(self, lines):
+        """Durably appends a batch of lines, before returning."""
+        payload = '\n'.join(lines).encode('utf-8')
+        with self.lock:
+            path = self.segmentPath(self.segments[-1])
+            if os.path.exists(path) and os.path.getsize(path) >= self.segmentMaxBytes:
+                self.segments.append(self.segments[-1] + 1)
+                path = self.segmentPath(self.segments[-1])
+            with open(path, 'ab') as f:
+                f.write(str(len(payload)).encode('ascii') + b'\n' + payload + b'\n')
+                f.flush()
+                os.fsync(f.fileno())
+            self.backlog += 1
+
+    def peek(self):
+        """Returns the position after, and the lines of, the oldest unacknowledged batch, or None when there is none."""
+        with self.lock:
+            if self.backlog == 0:
+                return None
+            segment, offset = self.head
+            while True:
+                with open(self.segmentPath(segment), 'rb') as f:
+                    f.seek(offset)
+                    payload = self.readRecord(f)
+                    if payload is not None:
+                        return (segment, f.tell()), payload.decode('utf-8').split('\n')
+                # The head segment is exhausted, so the batch starts the next segment
+                segment = self.segments[self.segments.index(segment) + 1]
+                offset = 0
+
+    def ack(self, position):
+        """Acknowledges the batch returned by peek along with position, deleting segments no longer needed."""
+        with self.lock:
+            self.head = position
+            for segment in [segment for segment in self.segments[:-1] if segment < position[0]]:
+                self.deleteSegment(segment)
+            self.saveAck()
+            self.backlog -= 1
+
+    def quarantine(self, position, lines):
+        """Durably appends the batch returned by peek along with position to the quarantine file, then acknowledges it."""
+        with self.lock:
+            with open(self.quarantinePath(), 'a', encoding='utf-8') as f:
+                f.write('\n'.join(lines) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+        self.ack(position)
+
+    def quarantinePath(self):
+        return os.path.join(self.directory, QUARANTINE_FILE)
+
+
+class SpoolReplayer:
+    """Writes spooled batches to InfluxDB from a dedicated thread, oldest first, acknowledging each once stored.
+
+    A batch that fails to write stays spooled, and is retried every spoolRetrySecs, unless the database rejected
+    it, in which case it is quarantined so it does not hold up the batches behind it. Once a write has failed,
+    or when batches were left spooled by a previous run, the backlog is replayed at up to
+    spoolReplayBatchesPerSec batches per second, so a recovering database is not flooded. 0 disables pacing.
+    """
+
+    def __init__(self, config, spool):
+        self.config = config
+        self.spool = spool
+        self.retrySecs = getConfigValue(config, 'spoolRetrySecs')
+        self.replayBatchesPerSec = getConfigValue(config, 'spoolReplayBatchesPerSec')
+        self.recovering = spool.backlog > 0
+        self.stopping = False
+        self.wakeEvent = threading.Event()
+        self.stopEvent = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='vuegraf-spool', daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def notify(self):
+        self.wakeEvent.set()
+
+    def run(self):
+        while not self.stopEvent.is_set():
+            self.wakeEvent.clear()
+            record = self.spool.peek()
+            if record is None:
+                if self.recovering:
+                    logger.info('Finished replaying spooled batches')
+                    self.recovering = False
+                if self.stopping:
+                    return
+                self.wakeEvent.wait()
+                continue
+
+            position, lines = record
+            try:
+                writeInfluxLines(self.config, lines)
+            except Exception as e:
+                if isRejectedWrite(e):
+                    logger.error('Database rejected spooled points, moving them to quarantine; lines={}; quarantineFile={}; error={}'
+                                 .format(len(lines), self.spool.quarantinePath(), e))
+                    self.spool.quarantine(position, lines)
+                    continue
+                logger.error('Failed to write spooled points to the database, retrying; backlog={}; retrySecs={}: {}'.format(
+                    self.spool.backlog, self.retrySecs, sys.exc_info()))
+                traceback.print_exc()
+                self.recovering = True
+                self.stopEvent.wait(self.retrySecs)
+                continue
+
+            self.spool.ack(position)
+            if self.recovering and self.replayBatchesPerSec > 0:
+                self.stopEvent.wait(1 / self.replayBatchesPerSec)
+
+    def shutdown(self, deadlineSecs):
+        """Stops once the backlog is written, waiting at most deadlineSecs. Any remaining backlog is replayed on the next start."""
+        self.stopping = True
+        self.wakeEvent.set()
+        self.thread.join(deadlineSecs)
+        self.stopEvent.set()
+        self.wakeEvent.set()
+        if self.spool.backlog > 0:
+            logger.info('Leaving spooled batches for the next start; backlog={}'.format(self.spool.backlog))
+
+
+def spoolPoints(config, spool, usageDataPoints):
+    """Encodes a points.PointBatch, or a list of Point objects, and durably appends them to the spool.
+
+    Spooled points will reach the database, so the watermarks advance right away, and an outage does not
+    cause the same data to be fetched from Emporia again.
+    """
+    logger.info('Spooling datapoints; points={}'.format(len(usageDataPoints)))
+    lines = getLineProtocolEncoder(config).encodePoints(usageDataPoints)
+    if config['args'].debug:
+        dumpPoints("Spooling for database", lines)
+    if lines:
+        spool.append(lines)
+    updateWatermarks(config, usageDataPoints)
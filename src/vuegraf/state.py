@@ -0,0 +1,82 @@
+# Copyright (c) Jason Ertel (jertel).
+# This file is part of the Vuegraf project and is made available under the MIT License.
+
+# Contains logic relating to persisting collection state across restarts.
+
+import datetime
+import json
+import logging
+
+from vuegraf.atomicfile import writeJsonAtomically
+from vuegraf.config import getConfigValue
+from vuegraf.influx import advanceWatermarks, getWatermarks
+from vuegraf.time import getTimeNow
+
+
+logger = logging.getLogger('vuegraf.state')
+
+STATE_FILE_VERSION = 1
+
+# State saved longer ago than this is ignored; minute data can only be backfilled 7 days anyway.
+STATE_FILE_MAX_AGE_SEC = 604800  # 7 days
+
+
+def saveState(config):
+    """Atomically writes the series watermarks to the optional stateFile."""
+    stateFile = getConfigValue(config, 'stateFile')
+    if not stateFile:
+        return
+
+    watermarks = getWatermarks(config)
+    state = {
+        'version': STATE_FILE_VERSION,
+        'savedAt': getTimeNow(datetime.UTC).isoformat(),
+        'pointTypes': sorted(watermarks['pointTypes']),
+        'watermarks': [[stationName, chanName, pointType, timestamp.isoformat()]
+                       for (stationName, chanName, pointType), timestamp in list(watermarks['timestamps'].items())],
+    }
+
+    writeJsonAtomically(stateFile, state, '.vuegraf-state-')
+    logger.debug('Saved state; stateFile={}; series={}'.format(stateFile, len(state['watermarks'])))
+
+
+def loadState(config):
+    """Seeds the watermark cache from the optional stateFile, so the first cycle does not query Influx.
+
+    Missing, stale or corrupt state is ignored, leaving the watermarks to be read from Influx as usual.
+    """
+    stateFile = getConfigValue(config, 'stateFile')
+    if not stateFile:
+        return False
+
+    if config['args'].resetdatabase:
+        logger.info('Ignoring state file since the database is being reset; stateFile={}'.format(stateFile))
+        return False
+
+    try:
+        with open(stateFile) as f:
+            state = json.load(f)
+        if state['version'] != STATE_FILE_VERSION:
+            raise ValueError('unsupported state file version {}'.format(state['version']))
+        savedAt = datetime.datetime.fromisoformat(state['savedAt'])
+        lastTimestamps = {}
+        for stationName, chanName, pointType, timestamp in state['watermarks']:
+            lastTimestamps[(stationName, chanName, pointType)] = datetime.datetime.fromisoformat(timestamp)
+        pointTypes = set(state['pointTypes'])
+    except FileNotFoundError:
+        logger.info('No state file found, watermarks will be read from the database; stateFile={}'.format(stateFile))
+        return False
+    except Exception as e:
+        logger.warning('Ignoring unreadable state file; stateFile={}; error={}'.format(stateFile, e))
+        return False
+
+    ageSecs = (getTimeNow(datetime.UTC) - savedAt).total_seconds()
+    if ageSecs > STATE_FILE_MAX_AGE_SEC:
+        logger.info('Ignoring stale state file; stateFile={}; ageSecs={}'.format(stateFile, int(ageSecs)))
+        return False
+
+    watermarks = getWatermarks(config)
+    advanceWatermarks(watermarks, lastTimestamps)
+    watermarks['pointTypes'].update(pointTypes)
+    logger.info('Loaded state; stateFile={}; series={}'.format(stateFile, len(lastTimestamps)))
+    return True
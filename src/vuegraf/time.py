@@ -4,18 +4,16 @@
 # Contains logic relating to timezones and time calculations.
 
 import datetime
+import math
 import pytz
+from pyemvue.enums import Scale
 
 # Local imports
-from vuegraf.config import getConfigValue
+from vuegraf.config import getSettings
 
 
 def getTimezone(config):
-    timezoneName = getConfigValue(config, 'timezone')
-    timezone = None
-    if timezoneName is not None:
-        timezone = pytz.timezone(timezoneName)
-    return timezone
+    return getSettings(config).timezone
 
 
 def getCurrentHourUTC():
@@ -30,6 +28,11 @@ def getTimeNow(timezone):
     return datetime.datetime.now(timezone).replace(microsecond=0)
 
 
+def getNextTickSecs(nowSecs, intervalSecs, offsetSecs):
+    """Returns the first epoch time after nowSecs that falls offsetSecs past a multiple of intervalSecs."""
+    return (math.floor((nowSecs - offsetSecs) / intervalSecs) + 1) * intervalSecs + offsetSecs
+
+
 def convertToLocalDayInUTC(config, timestamp):
     timestamp = timestamp.astimezone(getTimezone(config))
     timestamp = timestamp.replace(hour=23, minute=59, second=59, microsecond=0)
@@ -37,8 +40,29 @@ def convertToLocalDayInUTC(config, timestamp):
     return timestamp
 
 
-def calculateHistoryTimeRange(config, nowLagUTC, startTimeUTC, historyIncrements):
-    historySizeDays = 20  # Default to 20 days of history per increment
+def getLocalMidnightUTC(timezone, day):
+    """Returns the time at which a date starts in a pytz timezone, in UTC."""
+    return timezone.localize(datetime.datetime.combine(day, datetime.time())).astimezone(datetime.UTC)
+
+
+def planBackfillChunks(startTimeUTC, stopTimeUTC, chunkSize):
+    """Splits a backfill range into consecutive (startTimeUTC, stopTimeUTC) chunks, each at most chunkSize long."""
+    chunks = []
+    while startTimeUTC < stopTimeUTC:
+        chunks.append((startTimeUTC, min(startTimeUTC + chunkSize, stopTimeUTC)))
+        startTimeUTC += chunkSize
+    return chunks
+
+
+# The most days of history fetched in a single chart usage request at each history scale. An HOUR request
+# for 20 days returns 480 values; a DAY request for a year returns fewer values than that.
+HISTORY_WINDOW_DAYS = {
+    Scale.DAY.value: 365,
+    Scale.HOUR.value: 20,
+}
+
+
+def calculateHistoryTimeRange(config, nowLagUTC, startTimeUTC, historyIncrements, historySizeDays=20):
     timezone = getTimezone(config)
     startTimeUTC = startTimeUTC + datetime.timedelta(days=historyIncrements * historySizeDays)
     startTimeLocal = startTimeUTC.astimezone(timezone)
@@ -51,3 +75,21 @@ def calculateHistoryTimeRange(config, nowLagUTC, startTimeUTC, historyIncrements
     stopTimeUTC = min(stopTimeUTC, nowLagUTC)
 
     return startTimeUTC, stopTimeUTC
+
+
+def planHistoryWindows(config, nowLagUTC, startTimeUTC):
+    """Splits a history import into (scale, startTimeUTC, stopTimeUTC) windows, one chart usage request each per channel.
+
+    Each scale is fetched in the largest windows allowed by HISTORY_WINDOW_DAYS, so day data needs far fewer
+    requests than when it was fetched alongside each window of hour data.
+    """
+    windows = []
+    for scale, windowDays in HISTORY_WINDOW_DAYS.items():
+        historyIncrements = 0
+        while True:
+            windowStartUTC, windowStopUTC = calculateHistoryTimeRange(config, nowLagUTC, startTimeUTC, historyIncrements, windowDays)
+            if windowStartUTC >= nowLagUTC:
+                break
+            windows.append((scale, windowStartUTC, windowStopUTC))
+            historyIncrements += 1
+    return windows
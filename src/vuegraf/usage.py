@@ -0,0 +1,41 @@
+# Copyright (c) Jason Ertel (jertel).
+# This file is part of the Vuegraf project and is made available under the MIT License.
+
+# Contains logic relating to converting Emporia chart usage into timestamps and watts.
+
+import math
+
+try:
+    import numpy  # Optional, see convertUsage
+except ImportError:
+    numpy = None
+
+from vuegraf.points import toNanoseconds
+
+
+NANOSECONDS_PER_SEC = 1_000_000_000
+
+
+def convertUsage(usage, startTimeUTC, intervalSecs, wattsPerKwh):
+    """Converts a chart usage list, of kWh per interval starting at startTimeUTC, into the timestamps and watts of its values.
+
+    Returns the timestamps, as nanoseconds since the epoch, and the watts of each value, dropping the None values
+    of intervals without data, and any NaN values, which cannot be stored. When NumPy is installed, both are
+    NumPy arrays converted in a single vectorized step, otherwise they are lists. Either way, the values are identical.
+    """
+    startNanoseconds = toNanoseconds(startTimeUTC)
+    intervalNanoseconds = intervalSecs * NANOSECONDS_PER_SEC
+    if numpy is not None:
+        # None becomes NaN, which the mask drops
+        kwh = numpy.array(usage, dtype=numpy.float64)
+        indexes = numpy.flatnonzero(~numpy.isnan(kwh))
+        return startNanoseconds + indexes * intervalNanoseconds, kwh[indexes] * wattsPerKwh
+
+    nanoseconds = []
+    watts = []
+    for index, kwhUsage in enumerate(usage):
+        if kwhUsage is None or math.isnan(kwhUsage):
+            continue
+        nanoseconds.append(startNanoseconds + index * intervalNanoseconds)
+        watts.append(kwhUsage * wattsPerKwh)
+    return nanoseconds, watts
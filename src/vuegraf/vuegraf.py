@@ -21,120 +21,226 @@ import logging
 import signal
 import sys
 import threading
+import time
 import traceback
 from pyemvue.enums import Scale
 
 # Local imports
+from vuegraf.checkpoint import loadHistoryCheckpoint
 from vuegraf.collect import collectHistoryUsage, collectUsage
 from vuegraf.config import getConfigValue, initConfig
-from vuegraf.device import initDeviceAccount
-from vuegraf.influx import initInfluxConnection, writeInfluxPoints
+from vuegraf.device import initDeviceAccounts
+from vuegraf.influx import initInfluxConnection
 from vuegraf.mqtt import (
   initMqttConnectionIfConfigured,
   publishMqttMessagesIfConnected,
   stopMqttIfConnected,
 )
-from vuegraf.time import getCurrentHourUTC, getCurrentDayLocal, getTimeNow
+from vuegraf.points import PointBatch
+from vuegraf.ratelimit import logApiUsage
+from vuegraf.registry import DeviceRegistry, loadDeviceCache
+from vuegraf.scheduler import Job, JobScheduler
+from vuegraf.state import loadState, saveState
+from vuegraf.time import getCurrentHourUTC, getCurrentDayLocal, getNextTickSecs, getTimeNow
+from vuegraf.writer import PointWriter
 
 
 logger = logging.getLogger('vuegraf')
 pauseEvent = threading.Event()
 
+# Hourly and daily averages are only collected once, when the hour or day changes, so failures are retried.
+# Minute data is backfilled by the next run anyway.
+AVERAGES_MAX_RETRIES = 3
+AVERAGES_RETRY_DELAY_SECS = 60
+SECONDS_MAX_RETRIES = 1
+SECONDS_RETRY_DELAY_SECS = 30
 
-def run():
-    global running
-
-    config = initConfig()
-    logger.info('Starting Vuegraf version {}'.format(__version__))
 
-    initInfluxConnection(config)
-    initMqttConnectionIfConfigured(config)
+def newMinuteJob(config):
+    lagSecs = getConfigValue(config, 'lagSecs')
 
-    detailedStartTimeUTC = getTimeNow(datetime.UTC)
+    def due(nowUTC):
+        return (nowUTC - datetime.timedelta(seconds=lagSecs),)
 
-    maxHistoryDays = getConfigValue(config, 'maxHistoryDays')
-    historyDays = min(config['args'].historydays, maxHistoryDays)
-    historyEnabled = historyDays > 0
+    def collect(account, nowLagUTC):
+        accountDataPoints = PointBatch()
+        collectUsage(config, account, None, nowLagUTC, False, accountDataPoints, None, Scale.MINUTE.value)
+        return accountDataPoints
 
-    intervalSecs = getConfigValue(config, 'updateIntervalSecs')
+    return Job('minute', 0, due, collect)
 
-    detailedIntervalSecs = getConfigValue(config, 'detailedIntervalSecs')
-    detailedDataEnabled = getConfigValue(config, 'detailedDataEnabled')
-    detailedDaysEnabled = detailedDataEnabled and getConfigValue(config, 'detailedDataDaysEnabled')
-    detailedHoursEnabled = detailedDataEnabled and getConfigValue(config, 'detailedDataHoursEnabled')
 
-    # Initialize vars to track when an hour or day changes which will trigger hourly/daily averages
+def newHourJob(config):
     prevHourUTC = getCurrentHourUTC()
-    prevDayLocal = getCurrentDayLocal(config)
-
-    running = True
-    while running:
-        usageDataPoints = []
 
-        # Set updated vars to compare with previous run
+    def due(nowUTC):
+        # Use UTC time for this to avoid DST issues
+        nonlocal prevHourUTC
         curHourUTC = getCurrentHourUTC()
+        if curHourUTC == prevHourUTC:
+            return None
+        hourUTC, prevHourUTC = prevHourUTC, curHourUTC
+        return (hourUTC,)
+
+    def collect(account, hourUTC):
+        accountDataPoints = PointBatch()
+        collectUsage(config, account, hourUTC, hourUTC, False, accountDataPoints, None, Scale.HOUR.value)
+        return accountDataPoints
+
+    return Job('hour', 1, due, collect, AVERAGES_MAX_RETRIES, AVERAGES_RETRY_DELAY_SECS, coalesce=False)
+
+
+def newDayJob(config):
+    prevDayLocal = getCurrentDayLocal(config)
+
+    def due(nowUTC):
+        # Note that this is local time. If UTC was used it would attempt to collect the day's average before
+        # the local day was complete (for UTC-X timezones)
+        nonlocal prevDayLocal
         curDayLocal = getCurrentDayLocal(config)
+        if curDayLocal == prevDayLocal:
+            return None
+        dayUTC, prevDayLocal = prevDayLocal.astimezone(datetime.UTC), curDayLocal
+        return (dayUTC,)
+
+    def collect(account, dayUTC):
+        accountDataPoints = PointBatch()
+        collectUsage(config, account, dayUTC, dayUTC, False, accountDataPoints, None, Scale.DAY.value)
+        return accountDataPoints
+
+    return Job('day', 2, due, collect, AVERAGES_MAX_RETRIES, AVERAGES_RETRY_DELAY_SECS, coalesce=False)
 
-        nowUTC = getTimeNow(datetime.UTC)
-        nowLagUTC = nowUTC - datetime.timedelta(seconds=getConfigValue(config, 'lagSecs'))
 
-        # Determine whether detailed "second" data should be collected on this run
+def newSecondJob(config, detailedStartTimeUTC):
+    lagSecs = getConfigValue(config, 'lagSecs')
+    detailedIntervalSecs = getConfigValue(config, 'detailedIntervalSecs')
+
+    def due(nowUTC):
+        nonlocal detailedStartTimeUTC
+        nowLagUTC = nowUTC - datetime.timedelta(seconds=lagSecs)
         secondsSinceLastDetailCollection = (nowLagUTC - detailedStartTimeUTC).total_seconds()
-        collectDetails = detailedDataEnabled and detailedIntervalSecs > 0 and secondsSinceLastDetailCollection >= detailedIntervalSecs
+        if secondsSinceLastDetailCollection < detailedIntervalSecs:
+            return None
+        startTimeUTC, detailedStartTimeUTC = detailedStartTimeUTC, nowLagUTC + datetime.timedelta(seconds=1)
+        return nowLagUTC, startTimeUTC
+
+    def collect(account, nowLagUTC, startTimeUTC):
+        accountDataPoints = PointBatch()
+        collectUsage(config, account, None, nowLagUTC, True, accountDataPoints, startTimeUTC, Scale.SECOND.value)
+        return accountDataPoints
+
+    return Job('second', 3, due, collect, SECONDS_MAX_RETRIES, SECONDS_RETRY_DELAY_SECS)
+
+
+def newHistoryJob(config, historyDays, checkpoint):
+    lagSecs = getConfigValue(config, 'lagSecs')
+    pending = True
+
+    def due(nowUTC):
+        # Only run history collection once
+        nonlocal pending
+        if not pending:
+            return None
+        pending = False
+        # Start at current time (minus a small lag) and go back in time by `historyDays` days
+        nowLagUTC = nowUTC - datetime.timedelta(seconds=lagSecs)
+        historyStartTimeUTC = checkpoint.begin(historyDays, nowLagUTC - datetime.timedelta(historyDays), nowLagUTC,
+                                               len(config['accounts']))
+        return historyStartTimeUTC, nowLagUTC
+
+    def collect(account, historyStartTimeUTC, nowLagUTC):
+        logger.info('Loading historical data; historyDays={}'.format(historyDays))
+        return collectHistoryUsage(config, account, historyStartTimeUTC, nowLagUTC, pauseEvent, checkpoint)
+
+    return Job('history', 4, due, collect, stream=True)
+
+
+def initJobs(config, historyDays, historyCheckpoint=None):
+    """Creates a job for each enabled type of collection."""
+    detailedDataEnabled = getConfigValue(config, 'detailedDataEnabled')
 
-        logger.debug('Starting next event collection; collectDetails={}; secondsSinceLastDetailCollection={}; detailedIntervalSecs={}'
-                     .format(collectDetails, secondsSinceLastDetailCollection, detailedIntervalSecs))
+    jobs = [newMinuteJob(config)]
+    if detailedDataEnabled and getConfigValue(config, 'detailedDataHoursEnabled'):
+        jobs.append(newHourJob(config))
+    if detailedDataEnabled and getConfigValue(config, 'detailedDataDaysEnabled'):
+        jobs.append(newDayJob(config))
+    if detailedDataEnabled and getConfigValue(config, 'detailedDataSecondsEnabled') and getConfigValue(config, 'detailedIntervalSecs') > 0:
+        jobs.append(newSecondJob(config, getTimeNow(datetime.UTC)))
+    if historyDays > 0:
+        jobs.append(newHistoryJob(config, historyDays, historyCheckpoint))
+    return jobs
 
-        for account in config['accounts']:
-            initDeviceAccount(config, account)
 
-            try:
-                if historyEnabled:
-                    logger.info('Loading historical data; historyDays={}'.format(historyDays))
+def savePoints(config, pointWriter, usageDataPoints):
+    """Queues the points of a job run for writing to InfluxDB, and publishes them to MQTT."""
+    pointWriter.submit(usageDataPoints)
+    publishMqttMessagesIfConnected(config, usageDataPoints)
 
-                    # Start at current time (minus a small lag) and go back in time by `historyDays` days
-                    historyStartTimeUTC = nowLagUTC - datetime.timedelta(historyDays)
 
-                    collectHistoryUsage(config, account, historyStartTimeUTC, nowLagUTC, usageDataPoints, pauseEvent)
-                else:
-                    # Collect current usage data for the last interval for each device in the current account
-                    collectUsage(config, account, None, nowLagUTC, collectDetails, usageDataPoints,
-                                 detailedStartTimeUTC, Scale.MINUTE.value)
+def run():
+    global running
 
-                    # Collect hourly averages if the hour just changed. Use UTC time for this to avoid DST
-                    # issues.
-                    if detailedHoursEnabled and curHourUTC != prevHourUTC:
-                        collectUsage(config, account, prevHourUTC, prevHourUTC, False, usageDataPoints, None, Scale.HOUR.value)
-                        prevHourUTC = curHourUTC
+    config = initConfig()
+    logger.info('Starting Vuegraf version {}'.format(__version__))
 
-                    # Collect daily averages if the day just changed. Note that this is local time
-                    # If used UTC was used it would attempt to collect the day's average before the local
-                    # day was complete (for UTC-X timezones)
-                    if detailedDaysEnabled and curDayLocal != prevDayLocal:
-                        prevDayUTC = prevDayLocal.astimezone(datetime.UTC)
-                        collectUsage(config, account, prevDayUTC, prevDayUTC, False, usageDataPoints, None, Scale.DAY.value)
-                        prevDayLocal = curDayLocal
+    initInfluxConnection(config)
+    initMqttConnectionIfConfigured(config)
+    loadState(config)
 
-            except Exception:
-                logger.error('Failed to record new usage data: {}'.format(sys.exc_info()))
-                traceback.print_exc()
+    # Collection begins right away from cached devices, while they are discovered again in the background
+    cachedDevices = loadDeviceCache(config)
+    initDeviceAccounts(config, cachedDevices)
+    deviceRegistry = DeviceRegistry(config)
+    deviceRegistry.start(any(account['name'] in cachedDevices for account in config['accounts']))
 
-            if not running:
-                break
+    maxHistoryDays = getConfigValue(config, 'maxHistoryDays')
+    historyDays = min(config['args'].historydays, maxHistoryDays)
 
-        # Save accumulated data points into InfluxDB
-        writeInfluxPoints(config, usageDataPoints)
-        publishMqttMessagesIfConnected(config, usageDataPoints)
+    intervalSecs = getConfigValue(config, 'updateIntervalSecs')
+    lagSecs = getConfigValue(config, 'lagSecs')
 
-        if collectDetails:
-            detailedStartTimeUTC = nowLagUTC + datetime.timedelta(seconds=1)
+    # Points are written by a background thread, so that a slow database never delays collection
+    pointWriter = PointWriter(config)
+    pointWriter.start()
 
-        # Only run history collection once per each account
-        historyEnabled = False
+    # Each type of collection is a separate job on its own worker, so that a slow job never delays the others
+    scheduler = JobScheduler(config, lambda usageDataPoints: savePoints(config, pointWriter, usageDataPoints))
+    historyCheckpoint = loadHistoryCheckpoint(config, pointWriter.flush) if historyDays > 0 else None
+    for job in initJobs(config, historyDays, historyCheckpoint):
+        scheduler.addJob(job)
 
-        # Sleep for the specified interval before starting the next collection
-        pauseEvent.wait(intervalSecs)
+    # Jobs are dispatched on wall-clock boundaries, lagSecs past each multiple of the update interval,
+    # so that the period does not drift
+    tickSecs = None
 
+    running = True
+    while running:
+        scheduler.dispatch(getTimeNow(datetime.UTC))
+        logApiUsage(config)
+
+        # Sleep until the next interval boundary. Missed ticks are skipped rather than run back to back,
+        # since the next minute job backfills the minutes they would have collected.
+        nowSecs = time.time()
+        if tickSecs is None:
+            nextTickSecs = getNextTickSecs(nowSecs, intervalSecs, lagSecs)
+        else:
+            nextTickSecs = getNextTickSecs(max(nowSecs, tickSecs), intervalSecs, lagSecs)
+            skippedTicks = round((nextTickSecs - tickSecs) / intervalSecs) - 1
+            if skippedTicks > 0:
+                logger.warning('Scheduler overran the update interval; overrunSecs={:.1f}; skippedTicks={}'
+                               .format(nowSecs - tickSecs - intervalSecs, skippedTicks))
+        tickSecs = nextTickSecs
+        pauseEvent.wait(nextTickSecs - nowSecs)
+
+    # Shutdown finishes within writerShutdownDeadlineSecs, so the queued points and the state are saved before
+    # a supervisor kills the process. Job runs and device discovery still in progress get at most half of it.
+    shutdownSecs = getConfigValue(config, 'writerShutdownDeadlineSecs')
+    deadline = time.monotonic() + shutdownSecs
+    stopDeadline = time.monotonic() + shutdownSecs / 2
+    scheduler.shutdown(max(0, stopDeadline - time.monotonic()))
+    deviceRegistry.shutdown(max(0, stopDeadline - time.monotonic()))
+    pointWriter.shutdown(max(0, deadline - time.monotonic()))
+    saveState(config)
     stopMqttIfConnected(config)
     logger.info('Finished')
 
@@ -150,6 +256,7 @@ def main(args=None):
     try:
         signal.signal(signal.SIGINT, handleExitSignal)
         signal.signal(signal.SIGHUP, handleExitSignal)
+        signal.signal(signal.SIGTERM, handleExitSignal)
         run()
     except SystemExit as e:
         # If sys.exit was 2, then normal syntax exit from help or bad command line, no error message
@@ -0,0 +1,257 @@
+# Copyright (c) Jason Ertel (jertel).
+# This file is part of the Vuegraf project and is made available under the MIT License.
+
+# Contains logic relating to writing collected points to InfluxDB in the background.
+
+import collections
+import datetime
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+
+from vuegraf.config import getConfigValue, getSettings
+from vuegraf.influx import writeInfluxPoints
+from vuegraf.points import PointBatch, toPointBatch
+from vuegraf.spool import Spool, SpoolReplayer, spoolPoints
+from vuegraf.state import saveState
+
+
+logger = logging.getLogger('vuegraf.writer')
+
+BACKPRESSURE_POLICIES = ('block', 'drop', 'spill')
+
+
+class PointWriter:
+    """Writes collected points to InfluxDB from a dedicated thread, so a slow database never delays collection.
+
+    Points are queued, up to writerQueueSize points, and written in batches of up to writerBatchSize points
+    once the oldest queued point has waited writerBatchAgeSecs. When the queue is full, writerBackpressure
+    decides what happens to newly submitted points:
+
+    - block: the submitter waits for room in the queue.
+    - drop: queued second-level points are discarded, oldest first, then submitted ones, before blocking.
+    - spill: points that do not fit are appended to writerSpillFile, and written once the queue drains.
+
+    When a spoolDir is configured, batches are written to a Spool instead, and a SpoolReplayer writes them
+    to InfluxDB, so points survive a database outage.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.queueSize = getConfigValue(config, 'writerQueueSize')
+        self.batchSize = getConfigValue(config, 'writerBatchSize')
+        self.batchAgeSecs = getConfigValue(config, 'writerBatchAgeSecs')
+        self.backpressure = getConfigValue(config, 'writerBackpressure')
+        self.spillFile = getConfigValue(config, 'writerSpillFile')
+        if self.backpressure not in BACKPRESSURE_POLICIES:
+            raise ValueError('Invalid writerBackpressure; writerBackpressure={}; allowed={}'.format(
+                self.backpressure, BACKPRESSURE_POLICIES))
+        if self.backpressure == 'spill' and not self.spillFile:
+            raise ValueError('The spill writerBackpressure requires a writerSpillFile')
+
+        # Queued (submitSecs, PointBatch) tuples, holding queuedPoints points in total
+        self.queue = collections.deque()
+        self.queuedPoints = 0
+        self.condition = threading.Condition()
+        self.stopping = False
+        self.writing = False
+        self.writeFailures = 0
+        self.spillPending = bool(self.spillFile) and os.path.exists(self.spillFile)
+        self.thread = threading.Thread(target=self.run, name='vuegraf-writer', daemon=True)
+
+        self.spool = None
+        spoolDir = getConfigValue(config, 'spoolDir')
+        if spoolDir and not config['args'].dryrun:
+            self.spool = Spool(spoolDir, getConfigValue(config, 'spoolSegmentBytes'))
+            self.replayer = SpoolReplayer(config, self.spool)
+
+    def start(self):
+        self.thread.start()
+        if self.spool is not None:
+            self.replayer.start()
+
+    def submit(self, usageDataPoints):
+        """Queues a PointBatch, or a list of points, for writing, applying the backpressure policy when the queue is full."""
+        usageDataPoints = toPointBatch(usageDataPoints)
+        with self.condition:
+            if self.queuedPoints + len(usageDataPoints) > self.queueSize:
+                if self.backpressure == 'drop':
+                    usageDataPoints = self.dropSecondPoints(usageDataPoints)
+                elif self.backpressure == 'spill':
+                    room = max(0, self.queueSize - self.queuedPoints)
+                    self.spill(usageDataPoints[room:])
+                    usageDataPoints = usageDataPoints[:room]
+
+            # An oversized submission is accepted once the queue is empty, rather than blocking forever
+            while self.queue and self.queuedPoints + len(usageDataPoints) > self.queueSize:
+                self.condition.wait()
+
+            if usageDataPoints:
+                self.queue.append((time.monotonic(), usageDataPoints))
+                self.queuedPoints += len(usageDataPoints)
+            self.condition.notify_all()
+
+    def dropSecondPoints(self, usageDataPoints):
+        """Discards second-level points until the submitted points fit, if possible. Caller must hold the condition."""
+        tagValue_second = getSettings(self.config).tagValue_second
+        excess = self.queuedPoints + len(usageDataPoints) - self.queueSize
+        dropped = 0
+
+        def dropFrom(batch):
+            nonlocal dropped
+            secondSeries = {index for index, key in enumerate(batch.series) if key[3] == tagValue_second}
+            if dropped >= excess or not secondSeries:
+                return batch
+            keptIndexes = []
+            for index, seriesIndex in enumerate(batch.seriesColumn):
+                if dropped < excess and seriesIndex in secondSeries:
+                    dropped += 1
+                else:
+                    keptIndexes.append(index)
+            return batch.select(keptIndexes)
+
+        keptQueue = collections.deque()
+        for submitSecs, batch in self.queue:
+            batch = dropFrom(batch)
+            if batch:
+                keptQueue.append((submitSecs, batch))
+        self.queue = keptQueue
+        self.queuedPoints -= dropped
+        keptPoints = dropFrom(usageDataPoints)
+
+        logger.warning('Point queue is full, dropped second-level points; dropped={}'.format(dropped))
+        return keptPoints
+
+    def spill(self, usageDataPoints):
+        """Appends points to the spill file. Caller must hold the condition."""
+        if not usageDataPoints:
+            return
+        with open(self.spillFile, 'a') as f:
+            for point in usageDataPoints:
+                f.write(json.dumps([point.accountName, point.deviceName, point.chanName, point.usageWatts,
+                                    point.timestamp.isoformat(), point.detailed]) + '\n')
+        self.spillPending = True
+        logger.warning('Point queue is full, spilled points to disk; spilled={}; spillFile={}'.format(len(usageDataPoints),
+                                                                                                      self.spillFile))
+
+    def takeSpill(self):
+        """Reads and removes the spill file, returning its points as a PointBatch. Caller must hold the condition."""
+        usageDataPoints = PointBatch()
+        with open(self.spillFile) as f:
+            for line in f:
+                accountName, deviceName, chanName, usageWatts, timestamp, detailed = json.loads(line)
+                usageDataPoints.add(accountName, deviceName, chanName, usageWatts, datetime.datetime.fromisoformat(timestamp), detailed)
+        os.unlink(self.spillFile)
+        self.spillPending = False
+        return usageDataPoints
+
+    def takeBatch(self):
+        """Waits until a batch is due, and returns it.
+
+        Returns an empty PointBatch when the queue is idle but spilled points are pending, and None once stopped and drained.
+        """
+        with self.condition:
+            while True:
+                self.writing = False
+                if self.queue:
+                    ageSecs = time.monotonic() - self.queue[0][0]
+                    if self.stopping or self.queuedPoints >= self.batchSize or ageSecs >= self.batchAgeSecs:
+                        batch = self.popBatch()
+                        self.writing = True
+                        self.condition.notify_all()
+                        return batch
+                    self.condition.wait(self.batchAgeSecs - ageSecs)
+                elif self.stopping:
+                    self.condition.notify_all()
+                    return None
+                elif self.spillPending:
+                    self.writing = True
+                    return PointBatch()
+                else:
+                    self.condition.notify_all()
+                    self.condition.wait()
+
+    def popBatch(self):
+        """Removes up to batchSize of the oldest queued points, returning them as one PointBatch. Caller must hold the condition."""
+        batch = PointBatch()
+        while self.queue and len(batch) < self.batchSize:
+            submitSecs, queued = self.queue.popleft()
+            room = self.batchSize - len(batch)
+            if len(queued) > room:
+                # Requeue the rest of a submission that does not fit, keeping its place and age
+                self.queue.appendleft((submitSecs, queued[room:]))
+                queued = queued[:room]
+            batch.extend(queued)
+        self.queuedPoints -= len(batch)
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.takeBatch()
+            if batch is None:
+                return
+            if batch:
+                self.write(batch)
+                continue
+
+            with self.condition:
+                spilledPoints = self.takeSpill()
+            logger.info('Writing spilled points; points={}'.format(len(spilledPoints)))
+            for start in range(0, len(spilledPoints), self.batchSize):
+                self.write(spilledPoints[start:start + self.batchSize])
+
+    def write(self, batch):
+        try:
+            if self.spool is None:
+                writeInfluxPoints(self.config, batch)
+            else:
+                spoolPoints(self.config, self.spool, batch)
+                self.replayer.notify()
+            saveState(self.config)
+        except Exception:
+            logger.error('Failed to write points to the database; points={}: {}'.format(len(batch), sys.exc_info()))
+            traceback.print_exc()
+            with self.condition:
+                self.writeFailures += 1
+
+    def flush(self):
+        """Waits until every point submitted so far, including spilled points, has been written.
+
+        Returns False when a write failed in the meantime, in which case the points may not have been stored.
+        """
+        with self.condition:
+            writeFailures = self.writeFailures
+            while (self.queue or self.writing or self.spillPending) and self.thread.is_alive():
+                self.condition.wait()
+            return self.writeFailures == writeFailures
+
+    def shutdown(self, deadlineSecs):
+        """Stops the writer once the queued points are written, waiting at most deadlineSecs.
+
+        Points still queued after the deadline are spilled when a spill file is configured, otherwise they are lost.
+        With a spool, the spooled backlog is written to the database within the same deadline, or on the next start.
+        """
+        deadline = time.monotonic() + deadlineSecs
+        with self.condition:
+            self.stopping = True
+            self.condition.notify_all()
+        self.thread.join(deadlineSecs)
+
+        if self.thread.is_alive():
+            with self.condition:
+                remainingPoints = PointBatch()
+                for submitSecs, queued in self.queue:
+                    remainingPoints.extend(queued)
+                self.queue.clear()
+                self.queuedPoints = 0
+                if self.spillFile:
+                    self.spill(remainingPoints)
+                else:
+                    logger.error('Timed out writing queued points to the database; lostPoints={}'.format(len(remainingPoints)))
+
+        if self.spool is not None:
+            self.replayer.shutdown(max(0, deadline - time.monotonic()))